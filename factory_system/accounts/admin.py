@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile, Permission
+from .models import UserProfile, Permission, DashboardSnapshot, StatusCounter
 
 
 @admin.register(Permission)
@@ -59,3 +59,17 @@ class UserAdmin(BaseUserAdmin):
 
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
+
+
+@admin.register(DashboardSnapshot)
+class DashboardSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['group', 'scope', 'computed_at', 'dirty', 'generation']
+    list_filter = ['group', 'dirty']
+    readonly_fields = ['group', 'scope', 'data', 'computed_at', 'dirty', 'generation']
+
+
+@admin.register(StatusCounter)
+class StatusCounterAdmin(admin.ModelAdmin):
+    list_display = ['model', 'status', 'salesperson_id', 'count']
+    list_filter = ['model']
+    readonly_fields = ['model', 'status', 'salesperson_id', 'count']
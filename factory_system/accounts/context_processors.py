@@ -0,0 +1,32 @@
+from .menu import MENU_BY_KEY, get_menu
+
+
+def navigation(request):
+    """侧边栏菜单 nav_menu：[{'key', 'label', 'icon', 'url', 'active'}]，未登录时为空"""
+    user = getattr(request, 'user', None)
+    if not user or not user.is_authenticated:
+        return {'nav_menu': []}
+
+    try:
+        profile = user.profile
+        # 总经理可见全部菜单，不需要读取权限集合
+        permissions = frozenset() if profile.role == 'ceo' else profile.get_permission_set()
+        menu = get_menu(profile.role, permissions)
+    except AttributeError:
+        # 没有角色的用户只显示无限制的菜单项
+        menu = get_menu(None, frozenset())
+
+    match = getattr(request, 'resolver_match', None)
+    app_name = match.app_name if match else ''
+    url_name = match.url_name if match else ''
+    nav_menu = []
+    for key, url in menu:
+        item = MENU_BY_KEY[key]
+        nav_menu.append({
+            'key': key,
+            'label': item.label,
+            'icon': item.icon,
+            'url': url,
+            'active': item.is_active(app_name, url_name),
+        })
+    return {'nav_menu': nav_menu}
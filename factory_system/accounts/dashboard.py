@@ -0,0 +1,423 @@
+"""
+仪表板指标快照（DashboardSnapshot）
+
+仪表板不再每次打开都现场计算全部指标，改为读取按指标组预先计算的快照：
+- 指标组：订单、生产、库存、采购、物流、异常预警，每组一行快照；订单组按筛选条件（日期、销售员、客户）、
+  采购组按开始日期分别保存快照，无筛选条件的为默认范围
+- 业务数据变化时由信号登记受影响的指标组（见 accounts.signals），事务提交后一条 UPDATE 标记为待刷新
+- refresh_dashboard_snapshots 命令（建议每分钟定时执行）重新计算待刷新和跨天的快照；
+  仪表板读取时快照缺失、跨天，或待刷新超过 settings.DASHBOARD_SNAPSHOT_MAX_AGE 秒（未配置定时任务时的兜底）才现场计算
+- 计算期间如有新的变动（generation 变化），写入结果但保持待刷新，不会丢失变动
+- 按状态的数量（待审批订单、进行中生产任务、待发货、已发货未签收等）读取增量维护的状态计数
+  （accounts.status_counters），仪表板每次打开时用最新计数覆盖快照中的这些数字（live_counts）
+"""
+import hashlib
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DashboardSnapshot
+from .status_counters import count_of, load_counts
+
+
+GROUP_ORDERS = 'orders'
+GROUP_PRODUCTION = 'production'
+GROUP_INVENTORY = 'inventory'
+GROUP_PURCHASE = 'purchase'
+GROUP_LOGISTICS = 'logistics'
+GROUP_ALERTS = 'alerts'
+
+GROUPS = [GROUP_ORDERS, GROUP_PRODUCTION, GROUP_INVENTORY, GROUP_PURCHASE, GROUP_LOGISTICS, GROUP_ALERTS]
+
+# 临近交期天数（默认7天）
+NEAR_DELIVERY_DAYS = 7
+# 长时间未推进天数（默认48小时，转换为天数）
+NO_PROGRESS_DAYS = 2
+
+ACTIVE_TASK_STATUSES = ['received', 'material_preparing', 'in_production', 'qc_checking']
+
+# 各指标组使用的筛选条件
+FILTER_FIELDS = {
+    GROUP_ORDERS: ('date_from', 'date_to', 'salesperson', 'customer'),
+    GROUP_PURCHASE: ('date_from',),
+}
+
+_pending = threading.local()
+
+
+def get_max_age():
+    """待刷新快照在读取时重新计算前可继续使用的秒数（settings.DASHBOARD_SNAPSHOT_MAX_AGE，默认5分钟）"""
+    return getattr(settings, 'DASHBOARD_SNAPSHOT_MAX_AGE', 5 * 60)
+
+
+def scope_key(group, filters):
+    """指标组在这组筛选条件下的快照范围，无筛选条件时为空字符串"""
+    values = [f'{field}={filters.get(field) or ""}' for field in FILTER_FIELDS.get(group, ())]
+    if not any(filters.get(field) for field in FILTER_FIELDS.get(group, ())):
+        return ''
+    scope = '&'.join(values)
+    if len(scope) > 200:
+        scope = hashlib.md5(scope.encode()).hexdigest()
+    return scope
+
+
+def compute_orders(filters, today):
+    """订单态势"""
+    from sales.models import SalesOrder
+
+    orders = SalesOrder.objects.all()
+    date_from = filters.get('date_from')
+    if date_from:
+        orders = orders.filter(created_at__gte=date_from)
+    if filters.get('date_to'):
+        orders = orders.filter(created_at__lte=filters['date_to'])
+    if filters.get('salesperson'):
+        orders = orders.filter(salesperson_id=filters['salesperson'])
+    if filters.get('customer'):
+        orders = orders.filter(customer_id=filters['customer'])
+
+    # 1. 订单总数、2. 订单总金额（不包括已终结订单）
+    totals = orders.exclude(status='terminated').aggregate(
+        count=models.Count('pk'), total=models.Sum('total_amount'),
+    )
+
+    # 3. 待审批订单数（只按销售员筛选时取状态计数）
+    live = live_counts(filters, load_counts()).get('order_status')
+    if live:
+        pending_approval_orders = live['pending_approval_orders']
+    else:
+        pending_approval_orders = orders.filter(status='pending').count()
+
+    # 4. 本期新增订单数（默认本月）
+    new_orders = orders.filter(created_at__gte=date_from or today.replace(day=1)).count()
+
+    # 5. 临近交期订单数（未来N天内）
+    near_delivery_orders = orders.filter(
+        delivery_date__gte=today,
+        delivery_date__lte=today + timedelta(days=NEAR_DELIVERY_DAYS),
+        status__in=['in_production', 'ready_to_ship']
+    ).count()
+
+    # 6. 已逾期未交付订单数
+    overdue_orders = orders.filter(
+        delivery_date__lt=today,
+        status__in=['pending', 'approved', 'ceo_pending', 'ceo_approved', 'in_production', 'ready_to_ship']
+    ).count()
+
+    return {
+        'total_orders': totals['count'],
+        'total_order_amount': totals['total'] or Decimal('0'),
+        'pending_approval_orders': pending_approval_orders,
+        'new_orders': new_orders,
+        'near_delivery_orders': near_delivery_orders,
+        'overdue_orders': overdue_orders,
+    }
+
+
+def compute_production(filters, today):
+    """生产态势"""
+    from production.models import ProductionTask
+
+    return {
+        **live_counts(filters, load_counts())['production_status'],
+        'overdue_tasks': ProductionTask.objects.filter(
+            planned_completion_date__lt=today,
+            status__in=ACTIVE_TASK_STATUSES,
+        ).count(),
+    }
+
+
+def compute_inventory(filters, today):
+    """库存态势（库存金额成品按售价、原料按基础单价）"""
+    from inventory.models import Inventory
+    from inventory.valuation import BASIS_CHOICES, BASIS_SALE, stock_valuation
+    from inventory.stock_health import (
+        below_safety_stock, get_idle_inventory_days, idle_stock, negative_stock, requisition_shortages,
+    )
+
+    idle_inventory_days = get_idle_inventory_days()
+    inventory_valuation = stock_valuation(BASIS_SALE)
+    # 呆滞库存物料（N天无出入库记录，按最近出入库时间一次范围查询）
+    idle_materials = idle_stock(idle_inventory_days, inventory_type='material')
+
+    return {
+        'total_materials': Inventory.objects.filter(inventory_type='material').count(),
+        'total_quantity': Inventory.objects.aggregate(total=models.Sum('quantity'))['total'] or Decimal('0'),
+        'total_inventory_value': inventory_valuation['total'],
+        'inventory_valuation': inventory_valuation,
+        'valuation_basis_display': dict(BASIS_CHOICES)[BASIS_SALE],
+        'low_stock_materials': below_safety_stock('material').count(),
+        # 缺料物料数（未完成领料单的需求按物料汇总后与库存比较）
+        'shortage_materials': requisition_shortages().count(),
+        'negative_stock': negative_stock().count(),
+        'idle_materials': idle_materials.count,
+        'idle_value': idle_materials.value,
+        'idle_days': idle_inventory_days,
+    }
+
+
+def compute_purchase(filters, today):
+    """采购态势"""
+    from purchase.models import PurchaseTask
+
+    totals = PurchaseTask.objects.aggregate(count=models.Count('pk'), total=models.Sum('total_amount'))
+    # 本期采购金额（默认本月）
+    if filters.get('date_from'):
+        current_purchases = PurchaseTask.objects.filter(created_at__gte=filters['date_from'])
+    else:
+        current_purchases = PurchaseTask.objects.filter(created_at__date__gte=today.replace(day=1))
+    current_month_amount = current_purchases.aggregate(total=models.Sum('total_amount'))['total']
+
+    return {
+        'total_tasks': totals['count'],
+        'total_amount': totals['total'] or Decimal('0'),
+        'current_month_amount': current_month_amount or Decimal('0'),
+    }
+
+
+def compute_logistics(filters, today):
+    """物流态势"""
+    from sales.models import SalesOrder
+
+    return {
+        **live_counts(filters, load_counts())['logistics_status'],
+        'overdue_ship_orders': SalesOrder.objects.filter(delivery_date__lt=today, status='ready_to_ship').count(),
+    }
+
+
+def compute_alerts(filters, today):
+    """异常预警中需要单独查询的指标，其余预警取自其它指标组（见 build_alerts）"""
+    from sales.models import SalesOrder
+    from production.models import ProductionTask
+
+    near_delivery_date = today + timedelta(days=NEAR_DELIVERY_DAYS)
+    # 订单交期冲突（简化：临近交期、生产中且有未完成生产任务的订单），一次查询
+    conflict_orders = SalesOrder.objects.filter(
+        delivery_date__lte=near_delivery_date,
+        delivery_date__gte=today,
+        status__in=['in_production'],
+        production_tasks__status__in=['pending'] + ACTIVE_TASK_STATUSES,
+    ).distinct().values_list('order_no', flat=True)
+
+    # 临期未排产订单数
+    near_unplanned = SalesOrder.objects.filter(
+        delivery_date__lte=near_delivery_date,
+        delivery_date__gte=today,
+        production_tasks__isnull=True,
+        status__in=['ceo_approved']
+    ).distinct().count()
+
+    # 生产任务长时间未推进
+    no_progress_tasks = ProductionTask.objects.filter(
+        status__in=ACTIVE_TASK_STATUSES,
+        updated_at__lt=today - timedelta(days=NO_PROGRESS_DAYS)
+    ).count()
+
+    return {
+        'conflict_orders': list(conflict_orders),
+        'near_unplanned': near_unplanned,
+        'no_progress_tasks': no_progress_tasks,
+    }
+
+
+def live_counts(filters, counts):
+    """由状态计数得到的指标 {context名: {指标: 数量}}，订单组有日期或客户筛选时不适用"""
+    pending_ship_orders = count_of(counts, 'sales.SalesOrder', ['ready_to_ship'])
+    result = {
+        'production_status': {
+            'total_tasks': count_of(counts, 'production.ProductionTask'),
+            'active_tasks': count_of(counts, 'production.ProductionTask', ACTIVE_TASK_STATUSES),
+        },
+        'logistics_status': {
+            'pending_ship_orders': pending_ship_orders,
+            # 今日待发货订单数（简化处理，使用ready_to_ship状态，实际应该根据计划发货日期）
+            'today_pending_ship': pending_ship_orders,
+            'shipped_not_delivered': count_of(counts, 'logistics.Shipment', ['shipped']),
+        },
+    }
+    if not any(filters.get(field) for field in ('date_from', 'date_to', 'customer')):
+        salesperson = filters.get('salesperson')
+        try:
+            salesperson_id = int(salesperson) if salesperson else None
+        except ValueError:
+            salesperson_id = None
+        if not salesperson or salesperson_id is not None:
+            result['order_status'] = {
+                'pending_approval_orders': count_of(counts, 'sales.SalesOrder', ['pending'], salesperson_id),
+            }
+    return result
+
+
+COMPUTERS = {
+    GROUP_ORDERS: compute_orders,
+    GROUP_PRODUCTION: compute_production,
+    GROUP_INVENTORY: compute_inventory,
+    GROUP_PURCHASE: compute_purchase,
+    GROUP_LOGISTICS: compute_logistics,
+    GROUP_ALERTS: compute_alerts,
+}
+
+
+def refresh_snapshot(group, filters=None, snapshot=None):
+    """重新计算一个指标组的快照并保存"""
+    filters = filters or {}
+    scope = scope_key(group, filters)
+    generation = snapshot.generation if snapshot else None
+    if generation is None:
+        generation = DashboardSnapshot.objects.filter(group=group, scope=scope).values_list('generation', flat=True).first()
+
+    now = timezone.now()
+    data = COMPUTERS[group](filters, timezone.localdate())
+
+    with transaction.atomic():
+        snapshot, created = DashboardSnapshot.objects.get_or_create(
+            group=group, scope=scope, defaults={'data': data, 'computed_at': now},
+        )
+        if not created:
+            # 计算期间又有变动（generation 已变化）时保持待刷新
+            updated = DashboardSnapshot.objects.filter(pk=snapshot.pk, generation=generation).update(
+                data=data, computed_at=now, dirty=False,
+            )
+            if not updated:
+                DashboardSnapshot.objects.filter(pk=snapshot.pk).update(data=data, computed_at=now)
+            snapshot.refresh_from_db()
+    return snapshot
+
+
+def is_outdated(snapshot, today=None):
+    """快照需要重新计算：跨天（逾期、呆滞等指标随日期变化），或待刷新已超过最长使用时间"""
+    today = today or timezone.localdate()
+    if timezone.localdate(snapshot.computed_at) != today:
+        return True
+    return snapshot.dirty and (timezone.now() - snapshot.computed_at).total_seconds() >= get_max_age()
+
+
+def load_snapshots(groups, filters=None, force=False):
+    """读取指标组快照 {group: DashboardSnapshot}，缺失或过期的现场计算"""
+    filters = filters or {}
+    scopes = {group: scope_key(group, filters) for group in groups}
+    snapshots = {
+        snapshot.group: snapshot
+        for snapshot in DashboardSnapshot.objects.filter(group__in=groups, scope__in=set(scopes.values()))
+        if scopes[snapshot.group] == snapshot.scope
+    }
+
+    today = timezone.localdate()
+    for group in groups:
+        snapshot = snapshots.get(group)
+        if force or snapshot is None or is_outdated(snapshot, today):
+            snapshots[group] = refresh_snapshot(group, filters, snapshot)
+    return snapshots
+
+
+def build_alerts(context, alert_data):
+    """由各指标组数据组装异常预警列表"""
+    alerts = []
+
+    # 1. 订单交期冲突预警
+    for order_no in alert_data['conflict_orders']:
+        alerts.append({
+            'type': 'order_delivery_conflict',
+            'message': f'订单 {order_no} 交期临近但生产未完成',
+            'level': 'warning',
+        })
+
+    # 2. 临期未排产订单数
+    near_unplanned = alert_data['near_unplanned']
+    if near_unplanned > 0:
+        alerts.append({
+            'type': 'near_unplanned_orders',
+            'count': near_unplanned,
+            'message': f'有 {near_unplanned} 个临期订单未排产',
+            'level': 'danger',
+        })
+
+    # 3. 已逾期未交付订单数（已在订单态势中计算）
+    overdue_orders = context.get('order_status', {}).get('overdue_orders', 0)
+    if overdue_orders > 0:
+        alerts.append({
+            'type': 'overdue_orders',
+            'count': overdue_orders,
+            'message': f'有 {overdue_orders} 个订单已逾期未交付',
+            'level': 'danger',
+        })
+
+    # 5. 生产任务延期预警
+    overdue_tasks = context.get('production_status', {}).get('overdue_tasks', 0)
+    if overdue_tasks > 0:
+        alerts.append({
+            'type': 'overdue_tasks',
+            'count': overdue_tasks,
+            'message': f'有 {overdue_tasks} 个生产任务已延期',
+            'level': 'warning',
+        })
+
+    # 6. 生产任务长时间未推进
+    no_progress_tasks = alert_data['no_progress_tasks']
+    if no_progress_tasks > 0:
+        alerts.append({
+            'type': 'no_progress_tasks',
+            'count': no_progress_tasks,
+            'message': f'有 {no_progress_tasks} 个生产任务长时间未推进',
+            'level': 'warning',
+        })
+
+    inventory_status = context.get('inventory_status', {})
+    # 9. 关键物料缺料预警
+    if inventory_status.get('shortage_materials', 0) > 0:
+        alerts.append({
+            'type': 'material_shortage',
+            'count': inventory_status['shortage_materials'],
+            'message': f'有 {inventory_status["shortage_materials"]} 种物料缺料',
+            'level': 'danger',
+        })
+
+    # 10. 安全库存跌破预警
+    if inventory_status.get('low_stock_materials', 0) > 0:
+        alerts.append({
+            'type': 'low_stock',
+            'count': inventory_status['low_stock_materials'],
+            'message': f'有 {inventory_status["low_stock_materials"]} 种物料低于安全库存',
+            'level': 'warning',
+        })
+
+    # 负库存预警
+    if inventory_status.get('negative_stock', 0) > 0:
+        alerts.append({
+            'type': 'negative_stock',
+            'count': inventory_status['negative_stock'],
+            'message': f'有 {inventory_status["negative_stock"]} 项库存数量为负，请核对出入库记录',
+            'level': 'danger',
+        })
+
+    # 13. 逾期未发货预警
+    overdue_ship_orders = context.get('logistics_status', {}).get('overdue_ship_orders', 0)
+    if overdue_ship_orders > 0:
+        alerts.append({
+            'type': 'overdue_shipment',
+            'count': overdue_ship_orders,
+            'message': f'有 {overdue_ship_orders} 个订单逾期未发货',
+            'level': 'warning',
+        })
+
+    return alerts
+
+
+def _flush():
+    groups = getattr(_pending, 'groups', None)
+    if groups:
+        _pending.groups = set()
+        DashboardSnapshot.objects.filter(group__in=groups).update(dirty=True, generation=F('generation') + 1)
+
+
+def mark_dirty(*groups):
+    """登记受影响的指标组，事务提交后合并标记为待刷新"""
+    if getattr(_pending, 'groups', None) is None:
+        _pending.groups = set()
+    _pending.groups.update(groups)
+    transaction.on_commit(_flush)
@@ -82,3 +82,9 @@ def role_or_permission_required(*allowed_roles, permission_code=None):
         return wrapped_view
     return decorator
 
+
+
+def session_readonly(view_func):
+    """只读轮询接口（JSON）不写 session：不刷新过期时间，见 accounts.middleware.SessionRefreshMiddleware"""
+    view_func.session_readonly = True
+    return view_func
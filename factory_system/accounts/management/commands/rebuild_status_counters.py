@@ -0,0 +1,46 @@
+"""
+重建单据状态计数（StatusCounter）：按当前数据重新统计，用于核对增量维护的计数或数据导入后
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import status_counters
+from accounts.models import StatusCounter
+
+
+class Command(BaseCommand):
+    help = '按当前数据重建销售订单、生产任务、领料单、采购任务、发货单的状态计数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='只报告与当前计数的差异，不修改')
+
+    def handle(self, *args, **options):
+        before = {
+            (counter.model, counter.status, counter.salesperson_id): counter.count
+            for counter in StatusCounter.objects.all()
+        }
+        
+        if options['check']:
+            with transaction.atomic():
+                status_counters.rebuild()
+                after = status_counters.load_counts()
+                transaction.set_rollback(True)
+        else:
+            status_counters.rebuild()
+            after = status_counters.load_counts()
+        
+        differences = [
+            (key, before.get(key, 0), after.get(key, 0))
+            for key in sorted(before.keys() | after.keys())
+            if before.get(key, 0) != after.get(key, 0)
+        ]
+        for (model, status, salesperson_id), old, new in differences:
+            owner = f' 销售员{salesperson_id}' if salesperson_id else ''
+            self.stdout.write(f'  {model} {status}{owner}：{old} -> {new}')
+        
+        if not differences:
+            self.stdout.write(self.style.SUCCESS('状态计数与当前数据一致'))
+        elif options['check']:
+            self.stdout.write(self.style.WARNING(f'{len(differences)} 项计数有偏差，未修改'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'状态计数已重建，修正 {len(differences)} 项'))
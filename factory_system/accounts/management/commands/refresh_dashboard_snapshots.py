@@ -0,0 +1,65 @@
+"""
+刷新仪表板指标快照（DashboardSnapshot），建议每分钟定时执行：
+重新计算待刷新、跨天和缺失的默认范围快照，删除超过一天未重新计算的筛选范围快照（再次查看时重新生成）
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.dashboard import GROUPS, is_outdated, refresh_snapshot, scope_key
+from accounts.models import DashboardSnapshot
+
+
+# 筛选范围快照超过该时间未重新计算时删除
+SCOPED_SNAPSHOT_RETENTION = timedelta(days=1)
+
+
+def _parse_scope(group, scope):
+    """由快照范围还原筛选条件（超长范围以摘要保存，无法还原时返回 None）"""
+    if not scope:
+        return {}
+    filters = {}
+    for part in scope.split('&'):
+        field, sep, value = part.partition('=')
+        if not sep:
+            return None
+        filters[field] = value or None
+    return filters if scope_key(group, filters) == scope else None
+
+
+class Command(BaseCommand):
+    help = '刷新仪表板指标快照（待刷新、跨天和缺失的快照）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='重新计算全部快照')
+
+    def handle(self, *args, **options):
+        refresh_all = options['all']
+        today = timezone.localdate()
+        refreshed = 0
+        
+        # 默认范围（无筛选条件）的快照始终保留
+        existing = {
+            (snapshot.group, snapshot.scope): snapshot
+            for snapshot in DashboardSnapshot.objects.all()
+        }
+        for group in GROUPS:
+            snapshot = existing.pop((group, ''), None)
+            if refresh_all or snapshot is None or snapshot.dirty or is_outdated(snapshot, today):
+                refresh_snapshot(group, {}, snapshot)
+                refreshed += 1
+        
+        # 筛选范围快照：近期计算过的按需刷新，长时间未计算的删除
+        removed = 0
+        cutoff = timezone.now() - SCOPED_SNAPSHOT_RETENTION
+        for (group, scope), snapshot in existing.items():
+            filters = _parse_scope(group, scope)
+            if filters is None or snapshot.computed_at < cutoff:
+                snapshot.delete()
+                removed += 1
+            elif refresh_all or snapshot.dirty or is_outdated(snapshot, today):
+                refresh_snapshot(group, filters, snapshot)
+                refreshed += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'已刷新 {refreshed} 个仪表板快照，删除 {removed} 个过期的筛选范围快照'))
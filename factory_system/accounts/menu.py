@@ -0,0 +1,94 @@
+"""
+侧边栏导航菜单
+
+菜单项在 MENU 中集中声明所需角色和权限（满足任一角色或拥有任一权限即可见，总经理全部可见），
+按 (角色, 有效权限集合) 计算可见菜单并缓存：
+- 缓存键带权限版本号（见 accounts.permission_cache），额外权限或角色变化后自然失效
+- 角色和权限相同的用户共用一份缓存
+- 当前页面高亮（active）与请求有关，不缓存，由 context processor 按 resolver_match 计算
+
+context processor（accounts.context_processors.navigation）把菜单以 nav_menu 提供给 base.html。
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.urls import reverse
+
+from .permission_cache import PERMISSION_CACHE_TIMEOUT, get_permissions_version
+
+
+class MenuItem:
+    """菜单项：roles、permissions 都为空时所有登录用户可见"""
+
+    def __init__(self, key, label, icon, url_name, roles=(), permissions=(), active=None):
+        self.key = key
+        self.label = label
+        self.icon = icon
+        self.url_name = url_name
+        self.roles = frozenset(roles)
+        self.permissions = frozenset(permissions)
+        self.active = active  # (app_name, url_name) -> bool
+
+    def is_visible(self, role, permissions):
+        if not self.roles and not self.permissions:
+            return True
+        return role == 'ceo' or role in self.roles or bool(self.permissions & permissions)
+
+    def is_active(self, app_name, url_name):
+        return bool(self.active and self.active(app_name or '', url_name or ''))
+
+
+MENU = [
+    MenuItem(
+        'dashboard', '仪表板', 'bi-speedometer2', 'dashboard',
+        active=lambda app, name: name == 'dashboard',
+    ),
+    MenuItem(
+        'sales', '产品订单', 'bi-cart', 'sales:order_list',
+        roles=('sales', 'sales_mgr', 'warehouse'), permissions=('sales.order.view',),
+        active=lambda app, name: app == 'sales',
+    ),
+    MenuItem(
+        'customers', '客户信息', 'bi-people', 'inventory:customer_list',
+        roles=('sales', 'sales_mgr'), permissions=('inventory.customer.view',),
+        active=lambda app, name: app == 'inventory' and name[:8] == 'customer',
+    ),
+    MenuItem(
+        'purchase', '物品采购', 'bi-cart', 'purchase:task_list',
+        roles=('warehouse',),
+        active=lambda app, name: app == 'purchase',
+    ),
+    MenuItem(
+        'inventory', '库存管理', 'bi-box-seam', 'inventory:inventory_list',
+        roles=('warehouse', 'production'), permissions=('inventory.view', 'inventory.view_product'),
+        active=lambda app, name: app == 'inventory' and name[:8] != 'customer' and name != 'bom_list',
+    ),
+    MenuItem(
+        'production', '生产流程', 'bi-gear', 'production:task_list',
+        roles=('production',), permissions=('production.task.view', 'inventory.bom.view'),
+        active=lambda app, name: app == 'production' or (app == 'inventory' and name == 'bom_list'),
+    ),
+    MenuItem(
+        'logistics', '物流管理', 'bi-truck', 'logistics:shipment_list',
+        roles=('logistics',), permissions=('logistics.shipment.view',),
+        active=lambda app, name: app == 'logistics',
+    ),
+]
+
+MENU_BY_KEY = {item.key: item for item in MENU}
+
+
+def build_menu(role, permissions):
+    """可见菜单 [(key, url)]"""
+    return [(item.key, reverse(item.url_name)) for item in MENU if item.is_visible(role, permissions)]
+
+
+def get_menu(role, permissions):
+    """按 (权限版本号, 角色, 权限集合) 缓存的可见菜单"""
+    digest = hashlib.md5(','.join(sorted(permissions)).encode()).hexdigest()[:12]
+    key = f'accounts:menu:{get_permissions_version()}:{role}:{digest}'
+    menu = cache.get(key)
+    if menu is None:
+        menu = build_menu(role, permissions)
+        cache.set(key, menu, timeout=PERMISSION_CACHE_TIMEOUT)
+    return menu
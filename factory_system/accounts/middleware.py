@@ -0,0 +1,44 @@
+"""
+Session 过期时间按需刷新
+
+不再每次请求都保存 session（SESSION_SAVE_EVERY_REQUEST = False），改为：
+- 距上次刷新超过 SESSION_COOKIE_AGE * SESSION_REFRESH_FRACTION 时才写一次 session，
+  由 SessionMiddleware 保存并重新下发 cookie，过期时间随之顺延（滑动过期的误差不超过该比例）
+- 标记为 session_readonly 的只读轮询接口（accounts.decorators）从不刷新
+
+需放在 django.contrib.sessions.middleware.SessionMiddleware 之后。
+"""
+import time
+
+from django.conf import settings
+
+
+REFRESHED_AT_KEY = '_session_refreshed_at'
+
+
+def get_refresh_interval():
+    """刷新间隔（秒）：SESSION_COOKIE_AGE * settings.SESSION_REFRESH_FRACTION（默认0.1）"""
+    return settings.SESSION_COOKIE_AGE * getattr(settings, 'SESSION_REFRESH_FRACTION', 0.1)
+
+
+class SessionRefreshMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.session_readonly = False
+        response = self.get_response(request)
+
+        session = getattr(request, 'session', None)
+        if session is None or request.session_readonly or session.is_empty() or response.status_code == 500:
+            return response
+
+        now = int(time.time())
+        # 本次请求修改过 session（如登录）时本来就会保存，顺便记下刷新时间
+        if session.modified or now - session.get(REFRESHED_AT_KEY, 0) >= get_refresh_interval():
+            session[REFRESHED_AT_KEY] = now
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'session_readonly', False):
+            request.session_readonly = True
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:06
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_permission_userprofile_permissions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(choices=[('orders', '订单态势'), ('production', '生产态势'), ('inventory', '库存态势'), ('purchase', '采购态势'), ('logistics', '物流态势'), ('alerts', '异常预警')], max_length=20, verbose_name='指标组')),
+                ('scope', models.CharField(blank=True, default='', max_length=200, verbose_name='筛选范围')),
+                ('data', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='指标数据')),
+                ('computed_at', models.DateTimeField(verbose_name='计算时间')),
+                ('dirty', models.BooleanField(default=False, verbose_name='待刷新')),
+                ('generation', models.PositiveIntegerField(default=0, verbose_name='变动序号')),
+            ],
+            options={
+                'verbose_name': '仪表板快照',
+                'verbose_name_plural': '仪表板快照',
+                'constraints': [models.UniqueConstraint(fields=('group', 'scope'), name='unique_dashboard_snapshot_scope')],
+            },
+        ),
+    ]
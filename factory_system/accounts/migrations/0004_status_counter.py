@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:08
+
+from django.db import migrations, models
+
+
+COUNTED_MODELS = [
+    ('sales', 'SalesOrder', 'salesperson_id'),
+    ('production', 'ProductionTask', None),
+    ('production', 'MaterialRequisition', None),
+    ('purchase', 'PurchaseTask', None),
+    ('logistics', 'Shipment', None),
+]
+
+
+def backfill_status_counters(apps, schema_editor):
+    """按现有单据初始化状态计数"""
+    StatusCounter = apps.get_model('accounts', 'StatusCounter')
+    for app_label, model_name, salesperson_field in COUNTED_MODELS:
+        fields = ('status', salesperson_field) if salesperson_field else ('status',)
+        rows = apps.get_model(app_label, model_name).objects.values(*fields).annotate(
+            total=models.Count('pk'),
+        ).order_by()
+        StatusCounter.objects.bulk_create([
+            StatusCounter(
+                model=f'{app_label}.{model_name}',
+                status=row['status'],
+                salesperson_id=(row[salesperson_field] or 0) if salesperson_field else 0,
+                count=row['total'],
+            )
+            for row in rows
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_dashboard_snapshot'),
+        ('sales', '0010_backfill_batch_reserved_quantity'),
+        ('production', '0006_task_material_blocks'),
+        ('purchase', '0003_supplier'),
+        ('logistics', '0005_shipmentimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='单据类型')),
+                ('status', models.CharField(max_length=25, verbose_name='状态')),
+                ('salesperson_id', models.PositiveIntegerField(default=0, verbose_name='销售员ID')),
+                ('count', models.IntegerField(default=0, verbose_name='数量')),
+            ],
+            options={
+                'verbose_name': '状态计数',
+                'verbose_name_plural': '状态计数',
+                'constraints': [models.UniqueConstraint(fields=('model', 'status', 'salesperson_id'), name='unique_status_counter')],
+            },
+        ),
+        migrations.RunPython(backfill_status_counters, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
+from .permission_cache import ROLE_DEFAULT_PERMISSIONS, load_permission_set
+
 
 class Permission(models.Model):
     """系统权限定义"""
@@ -59,113 +62,72 @@ class UserProfile(models.Model):
         if self.role == 'ceo':
             return True
         
-        # 检查角色默认权限
-        role_permissions = self.get_role_default_permissions()
-        if permission_code in role_permissions:
-            return True
-        
-        # 检查额外配置的权限
-        return self.permissions.filter(code=permission_code).exists()
+        return permission_code in self.get_permission_set()
+    
+    def get_permission_set(self):
+        """有效权限集合（角色默认权限 + 额外权限），同一请求内只计算一次，跨请求见 accounts.permission_cache"""
+        permissions = getattr(self, '_permission_set', None)
+        if permissions is None:
+            permissions = self._permission_set = load_permission_set(self)
+        return permissions
+    
+    def clear_permission_cache(self):
+        """额外权限或角色变化后清除实例上记住的权限集合"""
+        self._permission_set = None
     
     def get_role_default_permissions(self):
         """获取角色默认权限列表"""
-        role_permission_map = {
-            'sales': [
-                'sales.order.create',
-                'sales.order.view',
-                'sales.order.edit',
-                'inventory.customer.view',
-                'inventory.customer.create',
-                'inventory.customer.edit',
-                'inventory.customer.delete',
-            ],
-            'sales_mgr': [
-                'sales.order.create',
-                'sales.order.view',
-                'sales.order.edit',
-                'sales.order.approve',
-                'sales.order.view_all',
-                'inventory.customer.view',
-                'inventory.customer.create',
-                'inventory.customer.edit',
-                'inventory.customer.delete',
-                'inventory.customer.manage',
-            ],
-            'warehouse': [
-                'inventory.view',
-                'inventory.transaction.view',
-                'inventory.product.view',
-                'inventory.product.manage',
-                'inventory.material.manage',
-                'inventory.category.manage',
-                'inventory.adjustment.create',
-                'production.requisition.approve',
-                'production.inbound.create',
-            ],
-            'production': [
-                'production.task.view',
-                'production.task.receive',
-                'production.requisition.create',
-                'inventory.bom.view',
-            ],
-            'qc': [
-                'production.qc.create',
-                'production.task.view',
-            ],
-            'logistics': [
-                'logistics.shipment.create',
-                'logistics.shipment.view',
-                'logistics.driver.manage',
-                'logistics.vehicle.manage',
-            ],
-            'ceo': [
-                # 销售权限
-                'sales.order.create',
-                'sales.order.view',
-                'sales.order.view_all',
-                'sales.order.edit',
-                'sales.order.approve',
-                'sales.order.delete',
-                # 库存权限
-                'inventory.view',
-                'inventory.view_product',
-                'inventory.view_material',
-                'inventory.transaction.view',
-                'inventory.customer.view',
-                'inventory.customer.create',
-                'inventory.customer.edit',
-                'inventory.customer.delete',
-                'inventory.customer.manage',
-                'inventory.product.view',
-                'inventory.product.manage',
-                'inventory.material.manage',
-                'inventory.category.manage',
-                'inventory.adjustment.create',
-                'inventory.adjustment.approve',
-                'inventory.bom.view',
-                'inventory.bom.manage',
-                # 生产权限
-                'production.task.view',
-                'production.task.receive',
-                'production.requisition.create',
-                'production.requisition.approve',
-                'production.qc.create',
-                'production.inbound.create',
-                # 物流权限
-                'logistics.shipment.view',
-                'logistics.shipment.create',
-                'logistics.shipment.ship',
-                'logistics.driver.manage',
-                'logistics.vehicle.manage',
-                # 系统权限
-                'system.dashboard.view',
-                'system.user.manage',
-            ],  # CEO通过has_permission方法直接返回True，但这里列出所有权限以便显示
-        }
-        return role_permission_map.get(self.role, [])
+        return list(ROLE_DEFAULT_PERMISSIONS.get(self.role, ()))
     
     def get_all_permissions(self):
         """获取用户所有权限（角色默认权限 + 额外权限）"""
-        permissions = set(self.get_role_default_permissions())
-        permissions.update(self.permissions.values_list('code', flat=True))
-        return list(permissions)
+        return list(self.get_permission_set())
+
+
+class DashboardSnapshot(models.Model):
+    """仪表板指标快照：按指标组和筛选范围预先计算，仪表板只读快照（见 accounts.dashboard）"""
+    GROUP_CHOICES = [
+        ('orders', '订单态势'),
+        ('production', '生产态势'),
+        ('inventory', '库存态势'),
+        ('purchase', '采购态势'),
+        ('logistics', '物流态势'),
+        ('alerts', '异常预警'),
+    ]
+    
+    group = models.CharField(max_length=20, choices=GROUP_CHOICES, verbose_name='指标组')
+    scope = models.CharField(max_length=200, blank=True, default='', verbose_name='筛选范围')
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='指标数据')
+    computed_at = models.DateTimeField(verbose_name='计算时间')
+    dirty = models.BooleanField(default=False, verbose_name='待刷新')
+    # 每次标记待刷新时递增，计算期间有新的变动时保持待刷新
+    generation = models.PositiveIntegerField(default=0, verbose_name='变动序号')
+    
+    class Meta:
+        verbose_name = '仪表板快照'
+        verbose_name_plural = '仪表板快照'
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'scope'], name='unique_dashboard_snapshot_scope'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_group_display()} {self.scope or '全部'} @ {self.computed_at:%Y-%m-%d %H:%M}"
+
+
+class StatusCounter(models.Model):
+    """按状态计数：销售订单、生产任务、领料单、采购任务、发货单各状态的数量，随状态变化增量维护（见 accounts.status_counters）"""
+    model = models.CharField(max_length=50, verbose_name='单据类型')
+    status = models.CharField(max_length=25, verbose_name='状态')
+    # 销售订单按销售员分别计数，其它单据为0
+    salesperson_id = models.PositiveIntegerField(default=0, verbose_name='销售员ID')
+    count = models.IntegerField(default=0, verbose_name='数量')
+    
+    class Meta:
+        verbose_name = '状态计数'
+        verbose_name_plural = '状态计数'
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'status', 'salesperson_id'], name='unique_status_counter'),
+        ]
+    
+    def __str__(self):
+        return f"{self.model} {self.status} {self.salesperson_id or ''}: {self.count}"
@@ -0,0 +1,152 @@
+"""
+用户有效权限集合缓存
+
+有效权限 = 角色默认权限（ROLE_DEFAULT_PERMISSIONS，模块常量）+ 额外配置的权限（一条查询），
+以 frozenset 表示，两级缓存：
+- 请求内：记在 UserProfile 实例上（request.user.profile 在同一请求内是同一个对象），
+  导航栏、装饰器、视图多次调用 has_permission 只计算一次
+- 跨请求：存放在 Django 缓存中，缓存键带全局版本号和角色；用户额外权限、角色或权限定义变化后
+  递增版本号（见 accounts.signals），旧记录自然失效
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+VERSION_KEY = 'accounts:permissions:version'
+
+# 权限集合在缓存中的有效期（秒），版本号变化后旧记录自然失效
+PERMISSION_CACHE_TIMEOUT = 60 * 60 * 24
+
+# 角色默认权限（有序，用于显示）
+ROLE_DEFAULT_PERMISSIONS = {
+    'sales': (
+        'sales.order.create',
+        'sales.order.view',
+        'sales.order.edit',
+        'inventory.customer.view',
+        'inventory.customer.create',
+        'inventory.customer.edit',
+        'inventory.customer.delete',
+    ),
+    'sales_mgr': (
+        'sales.order.create',
+        'sales.order.view',
+        'sales.order.edit',
+        'sales.order.approve',
+        'sales.order.view_all',
+        'inventory.customer.view',
+        'inventory.customer.create',
+        'inventory.customer.edit',
+        'inventory.customer.delete',
+        'inventory.customer.manage',
+    ),
+    'warehouse': (
+        'inventory.view',
+        'inventory.transaction.view',
+        'inventory.product.view',
+        'inventory.product.manage',
+        'inventory.material.manage',
+        'inventory.category.manage',
+        'inventory.adjustment.create',
+        'production.requisition.approve',
+        'production.inbound.create',
+    ),
+    'production': (
+        'production.task.view',
+        'production.task.receive',
+        'production.requisition.create',
+        'inventory.bom.view',
+    ),
+    'qc': (
+        'production.qc.create',
+        'production.task.view',
+    ),
+    'logistics': (
+        'logistics.shipment.create',
+        'logistics.shipment.view',
+        'logistics.driver.manage',
+        'logistics.vehicle.manage',
+    ),
+    'ceo': (
+        # 销售权限
+        'sales.order.create',
+        'sales.order.view',
+        'sales.order.view_all',
+        'sales.order.edit',
+        'sales.order.approve',
+        'sales.order.delete',
+        # 库存权限
+        'inventory.view',
+        'inventory.view_product',
+        'inventory.view_material',
+        'inventory.transaction.view',
+        'inventory.customer.view',
+        'inventory.customer.create',
+        'inventory.customer.edit',
+        'inventory.customer.delete',
+        'inventory.customer.manage',
+        'inventory.product.view',
+        'inventory.product.manage',
+        'inventory.material.manage',
+        'inventory.category.manage',
+        'inventory.adjustment.create',
+        'inventory.adjustment.approve',
+        'inventory.bom.view',
+        'inventory.bom.manage',
+        # 生产权限
+        'production.task.view',
+        'production.task.receive',
+        'production.requisition.create',
+        'production.requisition.approve',
+        'production.qc.create',
+        'production.inbound.create',
+        # 物流权限
+        'logistics.shipment.view',
+        'logistics.shipment.create',
+        'logistics.shipment.ship',
+        'logistics.driver.manage',
+        'logistics.vehicle.manage',
+        # 系统权限
+        'system.dashboard.view',
+        'system.user.manage',
+    ),  # CEO通过has_permission方法直接返回True，但这里列出所有权限以便显示
+}
+
+ROLE_DEFAULT_PERMISSION_SETS = {role: frozenset(codes) for role, codes in ROLE_DEFAULT_PERMISSIONS.items()}
+
+
+def get_permissions_version():
+    """当前权限版本号"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # 以毫秒时间戳作为初始版本号，版本号被缓存淘汰后重新初始化也不会与旧的缓存键重复
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_permissions_version():
+    """递增权限版本号，使所有用户缓存的权限集合失效"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def bump_permissions_version_on_commit():
+    """事务提交后递增版本号"""
+    transaction.on_commit(bump_permissions_version)
+
+
+def load_permission_set(profile):
+    """读取用户的有效权限集合：先查缓存，未命中时一条查询额外权限后写回"""
+    key = f'accounts:permissions:{get_permissions_version()}:{profile.pk}:{profile.role}'
+    permissions = cache.get(key)
+    if permissions is None:
+        permissions = ROLE_DEFAULT_PERMISSION_SETS.get(profile.role, frozenset()) | frozenset(
+            profile.permissions.values_list('code', flat=True)
+        )
+        cache.set(key, permissions, timeout=PERMISSION_CACHE_TIMEOUT)
+    return permissions
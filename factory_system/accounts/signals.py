@@ -0,0 +1,67 @@
+"""
+用户额外权限、角色或权限定义变化时递增权限版本号（见 accounts.permission_cache），后台编辑、命令都经过这里
+
+订单、生产任务、领料、采购、发货、库存变化时标记受影响的仪表板指标组待刷新（见 accounts.dashboard）
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from inventory.signals import stock_changed
+
+from .dashboard import mark_dirty as mark_dashboard_dirty
+from .models import Permission, UserProfile
+from .permission_cache import bump_permissions_version_on_commit
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_permissions(sender, instance, **kwargs):
+    if isinstance(instance, UserProfile):
+        instance.clear_permission_cache()
+    bump_permissions_version_on_commit()
+
+
+@receiver(m2m_changed, sender=UserProfile.permissions.through)
+def invalidate_permissions_on_change(sender, instance, action, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, UserProfile):
+        instance.clear_permission_cache()
+    bump_permissions_version_on_commit()
+
+
+# 仪表板快照：业务数据变化时登记受影响的指标组（见 accounts.dashboard）
+DASHBOARD_GROUPS_BY_MODEL = {
+    'sales.SalesOrder': ('orders', 'logistics', 'alerts'),
+    'production.ProductionTask': ('production', 'alerts'),
+    'production.MaterialRequisition': ('inventory',),
+    'production.MaterialRequisitionItem': ('inventory',),
+    'purchase.PurchaseTask': ('purchase',),
+    'logistics.Shipment': ('logistics',),
+    'inventory.Inventory': ('inventory',),
+    'inventory.StockTransaction': ('inventory',),
+    'inventory.Product': ('inventory',),
+    'inventory.Material': ('inventory',),
+}
+
+
+def _make_dashboard_receiver(groups):
+    def receiver_func(sender, **kwargs):
+        mark_dashboard_dirty(*groups)
+    return receiver_func
+
+
+_dashboard_receivers = []
+for _label, _groups in DASHBOARD_GROUPS_BY_MODEL.items():
+    _receiver = _make_dashboard_receiver(_groups)
+    _dashboard_receivers.append(_receiver)  # 信号默认弱引用，保留引用
+    post_save.connect(_receiver, sender=_label, dispatch_uid=f'dashboard_save_{_label}')
+    post_delete.connect(_receiver, sender=_label, dispatch_uid=f'dashboard_delete_{_label}')
+
+
+@receiver(stock_changed)
+def mark_inventory_dashboard_dirty(sender, inventory, **kwargs):
+    # 库存数量按差额更新（不经过 Inventory.save）
+    mark_dashboard_dirty('inventory')
@@ -0,0 +1,169 @@
+"""
+单据状态计数（StatusCounter）
+
+仪表板上按状态的数量（待审批订单、进行中生产任务、待发货订单、已发货未签收等）不再每次 COUNT(*)，
+改为读取按 (单据类型, 状态[, 销售员]) 增量维护的计数：
+- 保存前（pre_save）从数据库读取旧状态，保存后（post_save）与新状态比较，旧状态 -1、新状态 +1；
+  删除前读取、删除后 -1。不使用实例加载时的状态：同一单据的两个过期实例（如重复提交审批）
+  会各自把单据从旧状态移出一次
+- 在事务中保存时旧状态用 select_for_update 读取，并发修改同一单据的请求依次读取到对方提交后的状态
+  （视图的状态变更都在 transaction.atomic 中；删除本身在事务中执行）
+- 计数更新在保存所在的事务中执行，回滚时一并回滚
+- 批量 QuerySet.update 不触发信号，需调用 adjust 手动调整（如 production.mrp、production.material_blocks）
+- rebuild_status_counters 命令按当前数据重建全部计数，用于初始化和核对
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from .models import StatusCounter
+
+
+# 单据类型 -> 按销售员分别计数的字段（None 表示不区分）
+TRACKED_MODELS = {
+    'sales.SalesOrder': 'salesperson_id',
+    'production.ProductionTask': None,
+    'production.MaterialRequisition': None,
+    'purchase.PurchaseTask': None,
+    'logistics.Shipment': None,
+}
+
+_STATE_ATTR = '_status_counter_state'
+
+
+def _state(label, instance):
+    """实例当前的计数键 (状态, 销售员ID)"""
+    salesperson_field = TRACKED_MODELS[label]
+    salesperson_id = getattr(instance, salesperson_field) if salesperson_field else 0
+    return instance.status, salesperson_id or 0
+
+
+def _stored_state(label, model, pk):
+    """数据库中的计数键 (状态, 销售员ID)，事务中加行锁；记录不存在时返回 None"""
+    queryset = model._default_manager.filter(pk=pk)
+    if transaction.get_connection(queryset.db).in_atomic_block:
+        queryset = queryset.select_for_update()
+    row = queryset.values_list(*_fields(label)).first()
+    if row is None:
+        return None
+    return row[0], (row[1] if len(row) > 1 else 0) or 0
+
+
+def _fields(label):
+    salesperson_field = TRACKED_MODELS[label]
+    return ('status', salesperson_field) if salesperson_field else ('status',)
+
+
+def adjust(label, deltas):
+    """调整计数 {(状态, 销售员ID): 增量}，不存在的计数行先创建"""
+    with transaction.atomic():
+        for (status, salesperson_id), delta in deltas.items():
+            if not delta:
+                continue
+            counters = StatusCounter.objects.filter(model=label, status=status, salesperson_id=salesperson_id)
+            if not counters.update(count=F('count') + delta):
+                StatusCounter.objects.get_or_create(model=label, status=status, salesperson_id=salesperson_id)
+                counters.update(count=F('count') + delta)
+
+
+def adjust_status(label, old_status, new_status, quantity):
+    """批量更新状态后调整计数（不区分销售员的单据）"""
+    if quantity:
+        adjust(label, {(old_status, 0): -quantity, (new_status, 0): quantity})
+
+
+def _make_receivers(label):
+    fields = _fields(label)
+    # update_fields 可以是字段名（salesperson）或列名（salesperson_id）
+    watched = set(fields) | {field.removesuffix('_id') for field in fields}
+
+    def before_save(sender, instance, raw=False, update_fields=None, **kwargs):
+        instance.__dict__.pop(_STATE_ATTR, None)
+        if raw or instance._state.adding or instance.pk is None:
+            return
+        if update_fields is not None and not watched & set(update_fields):
+            return
+        setattr(instance, _STATE_ATTR, _stored_state(label, sender, instance.pk))
+
+    def before_delete(sender, instance, **kwargs):
+        setattr(instance, _STATE_ATTR, _stored_state(label, sender, instance.pk))
+
+    def after_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+        if raw:
+            return
+        if update_fields is not None and not watched & set(update_fields):
+            return
+        old = instance.__dict__.pop(_STATE_ATTR, None)
+        if created:
+            old = None
+        new = _state(label, instance)
+        if old != new:
+            deltas = {new: 1}
+            if old is not None:
+                deltas[old] = deltas.get(old, 0) - 1
+            adjust(label, deltas)
+
+    def after_delete(sender, instance, **kwargs):
+        # 记录已被并发请求删除时旧状态为 None，不再重复 -1
+        state = instance.__dict__.pop(_STATE_ATTR, None)
+        if state is not None:
+            adjust(label, {state: -1})
+
+    return before_save, after_save, before_delete, after_delete
+
+
+_receivers = []
+
+
+def connect_signals():
+    """状态变化时维护计数"""
+    for label in TRACKED_MODELS:
+        model = apps.get_model(label)
+        before_save, after_save, before_delete, after_delete = receivers = _make_receivers(label)
+        _receivers.append(receivers)  # 信号默认弱引用，保留引用
+        pre_save.connect(before_save, sender=model, dispatch_uid=f'status_counter_pre_save_{label}')
+        post_save.connect(after_save, sender=model, dispatch_uid=f'status_counter_save_{label}')
+        pre_delete.connect(before_delete, sender=model, dispatch_uid=f'status_counter_pre_delete_{label}')
+        post_delete.connect(after_delete, sender=model, dispatch_uid=f'status_counter_delete_{label}')
+
+
+def rebuild():
+    """按当前数据重建全部计数，返回 {单据类型: 计数行数}"""
+    result = {}
+    with transaction.atomic():
+        StatusCounter.objects.all().delete()
+        for label in TRACKED_MODELS:
+            fields = _fields(label)
+            rows = apps.get_model(label)._default_manager.values(*fields).annotate(total=Count('pk')).order_by()
+            counters = [
+                StatusCounter(
+                    model=label,
+                    status=row['status'],
+                    salesperson_id=(row[fields[1]] or 0) if len(fields) > 1 else 0,
+                    count=row['total'],
+                )
+                for row in rows
+            ]
+            StatusCounter.objects.bulk_create(counters)
+            result[label] = len(counters)
+    return result
+
+
+def load_counts():
+    """全部计数 {(单据类型, 状态, 销售员ID): 数量}，一条查询"""
+    return {
+        (model, status, salesperson_id): count
+        for model, status, salesperson_id, count in StatusCounter.objects.values_list(
+            'model', 'status', 'salesperson_id', 'count',
+        )
+    }
+
+
+def count_of(counts, label, statuses=None, salesperson_id=None):
+    """从 load_counts 的结果中汇总：statuses 为 None 时为全部状态，salesperson_id 为 None 时为全部销售员"""
+    return sum(
+        count for (model, status, owner), count in counts.items()
+        if model == label and (statuses is None or status in statuses)
+        and (salesperson_id is None or owner == salesperson_id)
+    )
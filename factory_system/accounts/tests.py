@@ -1,3 +1,193 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from inventory.allocation import change_quantity
+from inventory.models import Customer, Inventory, Material
+from sales.models import SalesOrder
+
+from . import dashboard, status_counters
+from .models import DashboardSnapshot, Permission, UserProfile
+
+
+class StatusCounterTests(TestCase):
+    """单据状态计数：增量维护的计数与 COUNT(*) 一致"""
+
+    label = 'sales.SalesOrder'
+
+    def setUp(self):
+        self.salesperson = User.objects.create_user('sales1')
+        self.customer = Customer.objects.create(name='测试客户', contact_person='张三', phone='123', address='地址')
+        self.order = SalesOrder.objects.create(
+            order_no='SO-TEST-1', customer=self.customer, salesperson=self.salesperson, status='in_production',
+        )
+
+    def count(self, status):
+        return status_counters.count_of(status_counters.load_counts(), self.label, [status])
+
+    def assert_counters_match_rebuild(self):
+        out = StringIO()
+        call_command('rebuild_status_counters', check=True, stdout=out)
+        self.assertIn('状态计数与当前数据一致', out.getvalue())
+
+    def test_create_and_status_change(self):
+        self.assertEqual(self.count('in_production'), 1)
+        self.order.status = 'ready_to_ship'
+        self.order.save()
+        self.assertEqual(self.count('in_production'), 0)
+        self.assertEqual(self.count('ready_to_ship'), 1)
+        self.assert_counters_match_rebuild()
+
+    def test_stale_instances_saved_twice(self):
+        """同一单据的两个过期实例先后保存为同一状态（重复提交审批），只移出旧状态一次"""
+        first = SalesOrder.objects.get(pk=self.order.pk)
+        second = SalesOrder.objects.get(pk=self.order.pk)
+        first.status = 'approved'
+        first.save()
+        second.status = 'approved'
+        second.save()
+        self.assertEqual(self.count('in_production'), 0)
+        self.assertEqual(self.count('approved'), 1)
+        self.assert_counters_match_rebuild()
+
+    def test_stale_instance_saved_to_other_status(self):
+        first = SalesOrder.objects.get(pk=self.order.pk)
+        second = SalesOrder.objects.get(pk=self.order.pk)
+        first.status = 'approved'
+        first.save()
+        second.status = 'rejected'
+        second.save()
+        self.assertEqual(self.count('approved'), 0)
+        self.assertEqual(self.count('rejected'), 1)
+        self.assert_counters_match_rebuild()
+
+    def test_update_fields_and_deferred_status(self):
+        order = SalesOrder.objects.only('pk', 'remark').get(pk=self.order.pk)
+        order.remark = '备注'
+        order.save(update_fields=['remark'])
+        self.assertEqual(self.count('in_production'), 1)
+        order = SalesOrder.objects.defer('status').get(pk=self.order.pk)
+        order.status = 'shipped'
+        order.save(update_fields=['status'])
+        self.assertEqual(self.count('shipped'), 1)
+        self.assert_counters_match_rebuild()
+
+    def test_delete_stale_instances(self):
+        first = SalesOrder.objects.get(pk=self.order.pk)
+        second = SalesOrder.objects.get(pk=self.order.pk)
+        first.delete()
+        second.delete()
+        self.assertEqual(self.count('in_production'), 0)
+        self.assert_counters_match_rebuild()
+
+    def test_salesperson_change(self):
+        other = User.objects.create_user('sales2')
+        self.order.salesperson = other
+        self.order.save(update_fields=['salesperson'])
+        counts = status_counters.load_counts()
+        self.assertEqual(status_counters.count_of(counts, self.label, salesperson_id=self.salesperson.pk), 0)
+        self.assertEqual(status_counters.count_of(counts, self.label, salesperson_id=other.pk), 1)
+        self.assert_counters_match_rebuild()
+
+
+class PermissionCacheTests(TestCase):
+    """有效权限集合：跨请求缓存命中不查询，额外权限、角色、权限定义变化提交后版本号递增"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sales1')
+        self.profile = UserProfile.objects.create(user=self.user, role='sales')
+        self.permission = Permission.objects.create(code='sales.report.view', name='查看销售报表', category='sales')
+
+    def fresh_profile(self):
+        return UserProfile.objects.get(pk=self.profile.pk)
+
+    def test_cached_across_instances(self):
+        self.assertTrue(self.fresh_profile().has_permission('sales.order.view'))
+        profile = self.fresh_profile()
+        with self.assertNumQueries(0):
+            self.assertFalse(profile.has_permission('sales.report.view'))
+            self.assertFalse(profile.has_permission('inventory.view'))
+
+    def test_extra_permission_change(self):
+        self.assertFalse(self.fresh_profile().has_permission('sales.report.view'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.permissions.add(self.permission)
+        # 同一实例上记住的权限集合同时清除
+        self.assertTrue(self.profile.has_permission('sales.report.view'))
+        self.assertTrue(self.fresh_profile().has_permission('sales.report.view'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.permission.delete()
+        self.assertFalse(self.fresh_profile().has_permission('sales.report.view'))
+
+    def test_role_change(self):
+        self.assertFalse(self.fresh_profile().has_permission('inventory.view'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.role = 'warehouse'
+            self.profile.save()
+        profile = self.fresh_profile()
+        self.assertTrue(profile.has_permission('inventory.view'))
+        self.assertFalse(profile.has_permission('sales.order.view'))
+
+
+class DashboardSnapshotTests(TestCase):
+    """仪表板快照：业务数据变化提交后标记待刷新，回滚不标记，刷新命令重新计算"""
+
+    def setUp(self):
+        material = Material.objects.create(sku='M-C', name='水泥', unit='kg')
+        self.inventory = Inventory.objects.create(
+            inventory_type='material', material=material, quantity=Decimal('20'), unit='kg',
+        )
+        self.snapshot = dashboard.refresh_snapshot(dashboard.GROUP_INVENTORY)
+        self.purchase = dashboard.refresh_snapshot(dashboard.GROUP_PURCHASE)
+
+    def reload(self, snapshot):
+        return DashboardSnapshot.objects.get(pk=snapshot.pk)
+
+    def change_stock(self, quantity):
+        with transaction.atomic():
+            change_quantity(self.inventory, Decimal(quantity))
+
+    def test_stock_change_marks_group_dirty(self):
+        self.assertFalse(self.snapshot.dirty)
+        self.assertEqual(Decimal(self.snapshot.data['total_quantity']), 20)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change_stock(5)
+            self.change_stock(5)
+        snapshot = self.reload(self.snapshot)
+        self.assertTrue(snapshot.dirty)
+        # 同一事务内多次变动合并为一次标记
+        self.assertEqual(snapshot.generation, self.snapshot.generation + 1)
+        self.assertFalse(self.reload(self.purchase).dirty)
+
+        out = StringIO()
+        call_command('refresh_dashboard_snapshots', stdout=out)
+        snapshot = self.reload(self.snapshot)
+        self.assertFalse(snapshot.dirty)
+        self.assertEqual(Decimal(snapshot.data['total_quantity']), 30)
+
+    def test_rollback_does_not_mark(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    change_quantity(self.inventory, Decimal('5'))
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(self.reload(self.snapshot).dirty)
+
+    def test_change_during_refresh_stays_dirty(self):
+        stale = self.reload(self.snapshot)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change_stock(5)
+        # 计算开始时读到的 generation 已过期：写入结果但保持待刷新
+        snapshot = dashboard.refresh_snapshot(dashboard.GROUP_INVENTORY, snapshot=stale)
+        self.assertTrue(snapshot.dirty)
+        self.assertEqual(Decimal(snapshot.data['total_quantity']), 25)
+        self.assertFalse(dashboard.refresh_snapshot(dashboard.GROUP_INVENTORY, snapshot=snapshot).dirty)
@@ -5,7 +5,6 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
 from django.conf import settings
-from django.db import models
 from .models import UserProfile, Permission
 
 
@@ -89,14 +88,12 @@ def login_view(request):
 
 @login_required
 def dashboard(request):
-    """仪表板 - 根据角色显示不同内容"""
-    from django.utils import timezone
-    from datetime import timedelta, date
-    from decimal import Decimal
-    from sales.models import SalesOrder, ShippingNotice
-    from inventory.models import Inventory, Material, Product, BOM, StockTransaction
-    from production.models import ProductionTask, MaterialRequisition
-    from logistics.models import Shipment
+    """仪表板 - 根据角色显示不同内容，指标读取预先计算的快照（见 accounts.dashboard）"""
+    from .dashboard import (
+        GROUP_ALERTS, GROUP_INVENTORY, GROUP_LOGISTICS, GROUP_ORDERS, GROUP_PRODUCTION, GROUP_PURCHASE,
+        build_alerts, live_counts, load_snapshots,
+    )
+    from .status_counters import load_counts
     
     try:
         profile = request.user.profile
@@ -109,14 +106,6 @@ def dashboard(request):
         'user': request.user,
     }
     
-    today = timezone.now().date()
-    # 临近交期天数配置（默认7天）
-    near_delivery_days = 7
-    # 呆滞库存天数配置（默认90天）
-    idle_inventory_days = 90
-    # 长时间未推进天数配置（默认48小时，转换为天数）
-    no_progress_days = 2
-    
     # 检查权限
     try:
         profile = request.user.profile
@@ -135,314 +124,46 @@ def dashboard(request):
         has_logistics_permission = (role in ['logistics', 'ceo'])
     
     has_ceo_permission = (role == 'ceo')
-    
-    # 获取时间范围参数（用于订单和采购态势）
-    date_from = request.GET.get('date_from', None)
-    date_to = request.GET.get('date_to', None)
-    salesperson_filter = request.GET.get('salesperson', None)
-    customer_filter = request.GET.get('customer', None)
-    
-    # 一、订单态势
-    if has_sales_permission:
-        orders = SalesOrder.objects.all()
-        
-        # 应用筛选
-        if date_from:
-            orders = orders.filter(created_at__gte=date_from)
-        if date_to:
-            orders = orders.filter(created_at__lte=date_to)
-        if salesperson_filter:
-            orders = orders.filter(salesperson_id=salesperson_filter)
-        if customer_filter:
-            orders = orders.filter(customer_id=customer_filter)
-        
-        # 1. 订单总数（不包括已终结订单）
-        total_orders = orders.exclude(status='terminated').count()
-        
-        # 2. 订单总金额（不包括已终结订单）
-        total_order_amount = orders.exclude(status='terminated').aggregate(
-            total=models.Sum('total_amount')
-        )['total'] or Decimal('0')
-        
-        # 3. 待审批订单数
-        pending_approval_orders = orders.filter(status='pending').count()
-        
-        # 4. 本期新增订单数（默认本月）
-        if not date_from:
-            month_start = today.replace(day=1)
-            new_orders = orders.filter(created_at__gte=month_start).count()
-        else:
-            new_orders = orders.filter(created_at__gte=date_from).count()
-        
-        # 5. 临近交期订单数（未来N天内）
-        near_delivery_date = today + timedelta(days=near_delivery_days)
-        near_delivery_orders = orders.filter(
-            delivery_date__gte=today,
-            delivery_date__lte=near_delivery_date,
-            status__in=['in_production', 'ready_to_ship']
-        ).count()
-        
-        # 6. 已逾期未交付订单数
-        overdue_orders = orders.filter(
-            delivery_date__lt=today,
-            status__in=['pending', 'approved', 'ceo_pending', 'ceo_approved', 'in_production', 'ready_to_ship']
-        ).count()
-        
-        context['order_status'] = {
-            'total_orders': total_orders,
-            'total_order_amount': total_order_amount,
-            'pending_approval_orders': pending_approval_orders,
-            'new_orders': new_orders,
-            'near_delivery_orders': near_delivery_orders,
-            'overdue_orders': overdue_orders,
-        }
-    
-    # 二、生产态势
-    if has_production_permission:
-        # 1. 生产任务总数
-        total_tasks = ProductionTask.objects.count()
-        
-        # 2. 进行中生产任务数
-        active_tasks = ProductionTask.objects.filter(
-            status__in=['received', 'material_preparing', 'in_production', 'qc_checking']
-        ).count()
-        
-        # 3. 已延期生产任务数
-        overdue_tasks = ProductionTask.objects.filter(
-            planned_completion_date__lt=today,
-            status__in=['received', 'material_preparing', 'in_production', 'qc_checking']
-        ).count()
-        
-        context['production_status'] = {
-            'total_tasks': total_tasks,
-            'active_tasks': active_tasks,
-            'overdue_tasks': overdue_tasks,
-        }
-    
-    # 三、库存态势
-    if has_inventory_permission:
-        # 1. 库存物料总数
-        total_materials = Inventory.objects.filter(inventory_type='material').count()
-        
-        # 2. 库存总数量
-        total_quantity = Inventory.objects.aggregate(
-            total=models.Sum('quantity')
-        )['total'] or Decimal('0')
-        
-        # 3. 库存总金额（需要计算，这里简化处理）
-        total_inventory_value = Decimal('0')
-        for inv in Inventory.objects.all():
-            if inv.inventory_type == 'material' and inv.material:
-                total_inventory_value += inv.quantity * inv.material.unit_price
-            elif inv.inventory_type == 'product' and inv.product:
-                # 成品库存价值可以用售价或成本价计算，这里用售价
-                total_inventory_value += inv.quantity * inv.product.sale_price
-        
-        # 4. 低于安全库存物料数
-        low_stock_materials = 0
-        for inv in Inventory.objects.filter(inventory_type='material'):
-            if inv.check_safety_stock():
-                low_stock_materials += 1
-        
-        # 5. 缺料物料数（需要检查已排产任务的需求）
-        shortage_materials = set()
-        active_requisitions = MaterialRequisition.objects.filter(
-            status__in=['pending', 'approved']
-        )
-        for req in active_requisitions:
-            for item in req.items.all():
-                try:
-                    inv = Inventory.objects.get(
-                        inventory_type='material',
-                        material=item.material
-                    )
-                    if inv.quantity < item.required_quantity:
-                        shortage_materials.add(item.material.id)
-                except Inventory.DoesNotExist:
-                    shortage_materials.add(item.material.id)
-        
-        # 6. 呆滞库存物料数（90天无出入库记录）
-        idle_date = today - timedelta(days=idle_inventory_days)
-        idle_materials = []
-        idle_value = Decimal('0')
-        for inv in Inventory.objects.filter(inventory_type='material'):
-            last_transaction = StockTransaction.objects.filter(
-                inventory=inv
-            ).order_by('-created_at').first()
-            if not last_transaction or last_transaction.created_at.date() < idle_date:
-                idle_materials.append(inv.id)
-                if inv.material:
-                    idle_value += inv.quantity * inv.material.unit_price
-        
-        context['inventory_status'] = {
-            'total_materials': total_materials,
-            'total_quantity': total_quantity,
-            'total_inventory_value': total_inventory_value,
-            'low_stock_materials': low_stock_materials,
-            'shortage_materials': len(shortage_materials),
-            'idle_materials': len(idle_materials),
-            'idle_value': idle_value,
-        }
-    
-    # 四、采购态势（库存管理员和总经理）
+    # 采购态势（库存管理员和总经理）
     has_purchase_permission = (role in ['warehouse', 'ceo'])
-    if has_purchase_permission:
-        try:
-            from purchase.models import PurchaseTask
-            
-            # 1. 采购任务数量
-            total_purchase_tasks = PurchaseTask.objects.count()
-            
-            # 2. 采购总金额
-            total_purchase_amount = PurchaseTask.objects.aggregate(
-                total=models.Sum('total_amount')
-            )['total'] or Decimal('0')
-            
-            # 3. 本期采购金额（默认本月）
-            if not date_from:
-                month_start = today.replace(day=1)
-                current_month_purchases = PurchaseTask.objects.filter(created_at__date__gte=month_start)
-            else:
-                current_month_purchases = PurchaseTask.objects.filter(created_at__gte=date_from)
-            current_month_amount = current_month_purchases.aggregate(
-                total=models.Sum('total_amount')
-            )['total'] or Decimal('0')
-            
-            context['purchase_status'] = {
-                'total_tasks': total_purchase_tasks,
-                'total_amount': total_purchase_amount,
-                'current_month_amount': current_month_amount,
-            }
-        except ImportError:
-            # 如果purchase应用还未迁移，跳过
-            pass
     
-    # 五、物流态势
-    if has_logistics_permission:
-        # 1. 待发货订单数
-        pending_ship_orders = SalesOrder.objects.filter(
-            status='ready_to_ship'
-        ).count()
-        
-        # 2. 今日待发货订单数（简化处理，使用ready_to_ship状态）
-        today_pending_ship = pending_ship_orders  # 简化：实际应该根据计划发货日期
-        
-        # 3. 已发货未签收订单数
-        shipped_not_delivered = Shipment.objects.filter(
-            status='shipped'
-        ).count()
-        
-        # 4. 逾期未发货订单数
-        overdue_ship_orders = SalesOrder.objects.filter(
-            delivery_date__lt=today,
-            status__in=['ready_to_ship']
-        ).count()
-        
-        context['logistics_status'] = {
-            'pending_ship_orders': pending_ship_orders,
-            'today_pending_ship': today_pending_ship,
-            'shipped_not_delivered': shipped_not_delivered,
-            'overdue_ship_orders': overdue_ship_orders,
-        }
+    # 获取时间范围等筛选参数（用于订单和采购态势）
+    filters = {
+        'date_from': request.GET.get('date_from', None),
+        'date_to': request.GET.get('date_to', None),
+        'salesperson': request.GET.get('salesperson', None),
+        'customer': request.GET.get('customer', None),
+    }
     
-    # 六、异常预警（仅总经理）
+    # 一至五：订单、生产、库存、采购、物流态势；六：异常预警（仅总经理）
+    sections = [
+        (has_sales_permission, GROUP_ORDERS, 'order_status'),
+        (has_production_permission, GROUP_PRODUCTION, 'production_status'),
+        (has_inventory_permission, GROUP_INVENTORY, 'inventory_status'),
+        (has_purchase_permission, GROUP_PURCHASE, 'purchase_status'),
+        (has_logistics_permission, GROUP_LOGISTICS, 'logistics_status'),
+        (has_ceo_permission, GROUP_ALERTS, None),
+    ]
+    groups = [group for allowed, group, _name in sections if allowed]
+    # “刷新数据”按钮带 refresh=1，立即重新计算
+    snapshots = load_snapshots(groups, filters, force=request.GET.get('refresh') == '1')
+    
+    # 按状态的数量用最新的状态计数覆盖（一条查询）
+    live = live_counts(filters, load_counts()) if groups else {}
+    for allowed, group, name in sections:
+        if allowed and name:
+            context[name] = {**snapshots[group].data, **live.get(name, {})}
     if has_ceo_permission:
-        alerts = []
-        
-        # 1. 订单交期冲突预警（简化：检查临近交期但未完成生产的订单）
-        conflict_orders = SalesOrder.objects.filter(
-            delivery_date__lte=today + timedelta(days=near_delivery_days),
-            delivery_date__gte=today,
-            status__in=['in_production']
-        )
-        for order in conflict_orders:
-            tasks = order.production_tasks.filter(
-                status__in=['pending', 'received', 'material_preparing', 'in_production', 'qc_checking']
-            )
-            if tasks.exists():
-                alerts.append({
-                    'type': 'order_delivery_conflict',
-                    'message': f'订单 {order.order_no} 交期临近但生产未完成',
-                    'level': 'warning',
-                })
-        
-        # 2. 临期未排产订单数
-        near_unplanned = SalesOrder.objects.filter(
-            delivery_date__lte=today + timedelta(days=near_delivery_days),
-            delivery_date__gte=today,
-            production_tasks__isnull=True,
-            status__in=['ceo_approved']
-        ).distinct().count()
-        if near_unplanned > 0:
-            alerts.append({
-                'type': 'near_unplanned_orders',
-                'count': near_unplanned,
-                'message': f'有 {near_unplanned} 个临期订单未排产',
-                'level': 'danger',
-            })
-        
-        # 3. 已逾期未交付订单数（已在订单态势中计算）
-        if context.get('order_status', {}).get('overdue_orders', 0) > 0:
-            alerts.append({
-                'type': 'overdue_orders',
-                'count': context['order_status']['overdue_orders'],
-                'message': f'有 {context["order_status"]["overdue_orders"]} 个订单已逾期未交付',
-                'level': 'danger',
-            })
-        
-        # 5. 生产任务延期预警
-        if context.get('production_status', {}).get('overdue_tasks', 0) > 0:
-            alerts.append({
-                'type': 'overdue_tasks',
-                'count': context['production_status']['overdue_tasks'],
-                'message': f'有 {context["production_status"]["overdue_tasks"]} 个生产任务已延期',
-                'level': 'warning',
-            })
-        
-        # 6. 生产任务长时间未推进
-        no_progress_date = today - timedelta(days=no_progress_days)
-        no_progress_tasks = ProductionTask.objects.filter(
-            status__in=['received', 'material_preparing', 'in_production', 'qc_checking'],
-            updated_at__lt=no_progress_date
-        ).count()
-        if no_progress_tasks > 0:
-            alerts.append({
-                'type': 'no_progress_tasks',
-                'count': no_progress_tasks,
-                'message': f'有 {no_progress_tasks} 个生产任务长时间未推进',
-                'level': 'warning',
-            })
-        
-        # 9. 关键物料缺料预警
-        if context.get('inventory_status', {}).get('shortage_materials', 0) > 0:
-            alerts.append({
-                'type': 'material_shortage',
-                'count': context['inventory_status']['shortage_materials'],
-                'message': f'有 {context["inventory_status"]["shortage_materials"]} 种物料缺料',
-                'level': 'danger',
-            })
-        
-        # 10. 安全库存跌破预警
-        if context.get('inventory_status', {}).get('low_stock_materials', 0) > 0:
-            alerts.append({
-                'type': 'low_stock',
-                'count': context['inventory_status']['low_stock_materials'],
-                'message': f'有 {context["inventory_status"]["low_stock_materials"]} 种物料低于安全库存',
-                'level': 'warning',
-            })
-        
-        # 13. 逾期未发货预警
-        if context.get('logistics_status', {}).get('overdue_ship_orders', 0) > 0:
-            alerts.append({
-                'type': 'overdue_shipment',
-                'count': context['logistics_status']['overdue_ship_orders'],
-                'message': f'有 {context["logistics_status"]["overdue_ship_orders"]} 个订单逾期未发货',
-                'level': 'warning',
-            })
-        
-        context['alerts'] = alerts
+        context['alerts'] = build_alerts(context, snapshots[GROUP_ALERTS].data)
+    
+    if snapshots:
+        context['snapshot_refreshed_at'] = min(snapshot.computed_at for snapshot in snapshots.values())
+        context['snapshot_dirty'] = any(snapshot.dirty for snapshot in snapshots.values())
+    refresh_params = request.GET.copy()
+    refresh_params['refresh'] = '1'
+    context['refresh_query'] = refresh_params.urlencode()
     
-    # 添加缓存控制头，确保数据实时更新
+    # 添加缓存控制头，浏览器不缓存页面，每次打开都读取最新快照
     response = render(request, 'accounts/dashboard.html', context)
     response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response['Pragma'] = 'no-cache'
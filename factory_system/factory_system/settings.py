@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'accounts.middleware.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -67,6 +68,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'accounts.context_processors.navigation',
             ],
         },
     },
@@ -99,6 +101,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# BOM缓存等依赖缓存版本号在进程间保持一致，多进程部署（gunicorn 多 worker）需改用共享后端
+
+# Redis配置（生产环境使用）
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379/1',
+#     }
+# }
+
+# 本地内存配置（开发环境使用）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'factory-system',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -144,6 +167,31 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 库存计价方法：fifo（先进先出）或 moving_average（移动加权平均）
+INVENTORY_COSTING_METHOD = 'fifo'
+
+# 出库批次分配策略：fifo（先进先出）或 fefo（先到期先出）
+INVENTORY_ISSUE_STRATEGY = 'fifo'
+
+# 呆滞库存天数阈值：超过该天数无出入库记录的库存视为呆滞
+IDLE_INVENTORY_DAYS = 90
+
+# 单据编号：每个进程每次从数据库预留的流水号数量（见 inventory.numbering）
+DOCUMENT_NUMBER_BLOCK_SIZE = 20
+
+# BOM配方缓存在共享缓存中的有效期（秒），BOM变化时通过版本号立即失效（见 inventory.bom_cache）
+BOM_CACHE_TIMEOUT = 60 * 60 * 24
+
+# 可承诺量快照的有效期（秒），库存和预占变化时按产品立即失效，到期重算以更新历史生产周期（见 sales.atp）
+ATP_SNAPSHOT_TIMEOUT = 60 * 60
+
+# 没有历史生产记录时估算交付日期使用的生产周期（天）
+ATP_DEFAULT_LEAD_DAYS = 3
+
+# 仪表板快照待刷新后仍可直接使用的秒数，超过后打开仪表板时现场重新计算（见 accounts.dashboard）；
+# 定时执行 refresh_dashboard_snapshots 时快照通常在此之前已刷新
+DASHBOARD_SNAPSHOT_MAX_AGE = 5 * 60
+
 # 登录URL配置
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
@@ -152,7 +200,13 @@ LOGOUT_REDIRECT_URL = '/accounts/login/'
 # Session配置 - 支持多账号同时登录
 SESSION_COOKIE_NAME = 'factory_system_sessionid'
 SESSION_COOKIE_AGE = 86400  # 24小时
-SESSION_SAVE_EVERY_REQUEST = True  # 每次请求都保存session
+# Session存储：cached_db 读取走缓存、保存时写数据库和缓存；
+# 也可改为 'django.contrib.sessions.backends.signed_cookies'（不写数据库，数据存放在签名cookie中）
+# 或 'django.contrib.sessions.backends.cache'（需配置共享缓存，缓存淘汰后需重新登录）
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_SAVE_EVERY_REQUEST = False  # 不再每次请求都保存session，由 SessionRefreshMiddleware 按需刷新过期时间
+# 距上次刷新超过 SESSION_COOKIE_AGE 的该比例时才保存session顺延过期时间（见 accounts.middleware）
+SESSION_REFRESH_FRACTION = 0.1
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # 浏览器关闭后不立即过期
 SESSION_COOKIE_HTTPONLY = True  # 防止XSS攻击
 SESSION_COOKIE_SAMESITE = 'Lax'  # CSRF保护
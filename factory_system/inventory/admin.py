@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, MaterialCategory, Material, Product, BOM, Inventory, StockTransaction
+from .models import Customer, MaterialCategory, Material, Product, BOM, Inventory, StockTransaction, DocumentSequence
 # PurchaseOrder, PurchaseOrderItem 已废弃，使用 purchase.PurchaseTask 替代
 
 
@@ -30,13 +30,14 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(BOM)
 class BOMAdmin(admin.ModelAdmin):
-    list_display = ['product', 'material', 'quantity', 'unit']
+    # 保存、删除都会经 inventory.signals 递增BOM缓存版本号；循环BOM在 BOM.clean() 中校验
+    list_display = ['product', 'material', 'component_product', 'quantity', 'unit']
     list_filter = ['product']
 
 
 @admin.register(Inventory)
 class InventoryAdmin(admin.ModelAdmin):
-    list_display = ['inventory_type', 'get_item_name', 'quantity', 'unit', 'updated_at']
+    list_display = ['inventory_type', 'get_item_name', 'quantity', 'unit', 'cost_value', 'updated_at']
     list_filter = ['inventory_type']
     
     def get_item_name(self, obj):
@@ -46,7 +47,7 @@ class InventoryAdmin(admin.ModelAdmin):
 
 @admin.register(StockTransaction)
 class StockTransactionAdmin(admin.ModelAdmin):
-    list_display = ['transaction_type', 'inventory', 'quantity', 'operator', 'created_at']
+    list_display = ['transaction_type', 'inventory', 'quantity', 'unit_cost', 'total_cost', 'operator', 'created_at']
     list_filter = ['transaction_type', 'created_at']
     readonly_fields = ['created_at']
 
@@ -66,3 +67,10 @@ class StockTransactionAdmin(admin.ModelAdmin):
 #     list_display = ['order', 'material', 'quantity', 'unit_price', 'subtotal', 'received_quantity']
 #     list_filter = ['order__status']
 #     search_fields = ['order__order_no', 'material__name']
+
+
+@admin.register(DocumentSequence)
+class DocumentSequenceAdmin(admin.ModelAdmin):
+    list_display = ['prefix', 'date', 'last_value', 'updated_at']
+    list_filter = ['prefix']
+    readonly_fields = ['prefix', 'date', 'last_value', 'updated_at']
@@ -0,0 +1,251 @@
+"""
+批次出入库
+
+库存数量变动的统一入口，库存总数量（Inventory.quantity）一律在同一事务中按差额用 F() 更新，
+不再汇总全部批次重算：
+- issue_stock: 按批次出库（生产领料、销售发货等）
+  1. 锁定库存行和候选批次（select_for_update），防止并发审批重复消耗同一批次
+  2. 在内存中按策略计算分配方案
+  3. bulk_update 批次数量，bulk_create 库存变动记录，库存总数量按差额更新
+- receive_stock: 新建批次入库（采购入库、生产完工入库）
+- adjust_stock: 库存调整、退回（启用批次的库存同步增减批次）
+
+分配策略：
+- fifo: 先进先出（批次日期、入库时间）
+- fefo: 先到期先出（过期日期，无过期日期的排在最后），其余同FIFO
+- pinned: 先按指定批次数量分配，剩余部分FIFO
+任何策略都可以传入 pinned 指定批次，指定部分总是优先分配。
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .costing import apply_transaction_cost
+from .models import Batch, Inventory, StockTransaction
+from .signals import stock_changed
+
+
+STRATEGY_FIFO = 'fifo'
+STRATEGY_FEFO = 'fefo'
+STRATEGY_PINNED = 'pinned'
+
+STRATEGY_CHOICES = [
+    (STRATEGY_FIFO, '先进先出'),
+    (STRATEGY_FEFO, '先到期先出'),
+    (STRATEGY_PINNED, '指定批次优先，其余先进先出'),
+]
+
+_BATCH_ORDERING = {
+    STRATEGY_FIFO: ('batch_date', 'created_at', 'pk'),
+    STRATEGY_PINNED: ('batch_date', 'created_at', 'pk'),
+    STRATEGY_FEFO: (F('expiry_date').asc(nulls_last=True), 'batch_date', 'created_at', 'pk'),
+}
+
+
+def get_issue_strategy():
+    """默认出库分配策略（settings.INVENTORY_ISSUE_STRATEGY，默认FIFO）"""
+    strategy = getattr(settings, 'INVENTORY_ISSUE_STRATEGY', STRATEGY_FIFO)
+    if strategy not in _BATCH_ORDERING:
+        raise ValueError(f'未知的出库分配策略: {strategy}')
+    return strategy
+
+
+class AllocationResult:
+    """出库分配结果"""
+
+    def __init__(self, lines, unbatched_quantity, shortfall, transactions):
+        self.lines = lines  # [(batch, 数量)]
+        self.unbatched_quantity = unbatched_quantity  # 未落到批次、直接从库存总数量扣减的数量
+        self.shortfall = shortfall  # 未能分配的数量
+        self.transactions = transactions
+
+    @property
+    def issued_quantity(self):
+        return sum((quantity for _batch, quantity in self.lines), Decimal('0')) + self.unbatched_quantity
+
+
+def plan_allocation(batches, quantity, pinned=None, own_reserved=None, respect_reservations=False):
+    """计算分配方案（不访问数据库）
+
+    batches: 已按策略排序的候选批次
+    pinned: {batch_id: 数量}，优先从这些批次分配（不超过批次数量）
+    respect_reservations: 为True时先只使用未被其它订单预占的数量（批次可用数量 + own_reserved 中本单的预占），
+        仍不足再使用其余在库数量
+    返回 ([(batch, 数量)], 剩余未分配数量)
+    """
+    pinned = pinned or {}
+    own_reserved = own_reserved or {}
+    allocated = {}
+    remaining = Decimal(quantity)
+
+    batches_by_id = {batch.pk: batch for batch in batches}
+    for batch_id, pinned_qty in pinned.items():
+        batch = batches_by_id.get(batch_id)
+        if batch is None or remaining <= 0:
+            continue
+        take = min(Decimal(pinned_qty), batch.quantity, remaining)
+        if take > 0:
+            allocated[batch_id] = take
+            remaining -= take
+
+    passes = (True, False) if respect_reservations else (False,)
+    for reserved_only in passes:
+        for batch in batches:
+            if remaining <= 0:
+                break
+            if reserved_only:
+                limit = min(batch.available_quantity + own_reserved.get(batch.pk, 0), batch.quantity)
+            else:
+                limit = batch.quantity
+            free = limit - allocated.get(batch.pk, 0)
+            if free > 0:
+                take = min(free, remaining)
+                allocated[batch.pk] = allocated.get(batch.pk, 0) + take
+                remaining -= take
+
+    lines = [(batch, allocated[batch.pk]) for batch in batches if allocated.get(batch.pk, 0) > 0]
+    return lines, remaining
+
+
+def create_stock_transactions(stock_transactions):
+    """批量写入库存变动记录：逐条计算成本（调用方已计算的跳过）后 bulk_create，并更新库存最近出入库时间"""
+    if not stock_transactions:
+        return []
+    for stock_transaction in stock_transactions:
+        if stock_transaction.total_cost is None:
+            apply_transaction_cost(stock_transaction)
+    created = StockTransaction.objects.bulk_create(stock_transactions)
+    last_movement_at = max(stock_transaction.created_at for stock_transaction in created)
+    inventory_ids = {stock_transaction.inventory_id for stock_transaction in created}
+    Inventory.objects.filter(pk__in=inventory_ids).update(last_movement_at=last_movement_at)
+    for stock_transaction in created:
+        stock_transaction.inventory.last_movement_at = last_movement_at
+    return created
+
+
+def change_quantity(inventory, delta, now=None):
+    """库存总数量按差额原子更新，并同步内存中的库存对象"""
+    if not delta:
+        return
+    Inventory.objects.filter(pk=inventory.pk).update(
+        quantity=F('quantity') + delta, updated_at=now or timezone.now(),
+    )
+    inventory.quantity += delta
+    stock_changed.send(sender=Inventory, inventory=inventory)
+
+
+def _consume_batches(inventory, quantity, strategy=None, pinned=None, own_reserved=None,
+                     respect_reservations=False, allow_unbatched=False):
+    """锁定并扣减批次，库存总数量按实际扣减数量减少
+
+    返回 (分配明细, 未落到批次的扣减数量, 未能分配的数量)
+    """
+    strategy = strategy or get_issue_strategy()
+    if strategy not in _BATCH_ORDERING:
+        raise ValueError(f'未知的出库分配策略: {strategy}')
+
+    # 锁定库存行和候选批次
+    locked = Inventory.objects.select_for_update().only('quantity').get(pk=inventory.pk)
+    inventory.quantity = locked.quantity
+    batches = list(
+        Batch.objects.select_for_update().filter(inventory=inventory, quantity__gt=0).order_by(*_BATCH_ORDERING[strategy])
+    )
+
+    lines, remaining = plan_allocation(
+        batches, quantity, pinned=pinned, own_reserved=own_reserved, respect_reservations=respect_reservations,
+    )
+
+    unbatched_quantity = Decimal('0')
+    if allow_unbatched and remaining > 0:
+        unbatched_stock = inventory.quantity - sum((batch.quantity for batch in batches), Decimal('0'))
+        unbatched_quantity = max(min(remaining, unbatched_stock), Decimal('0'))
+        remaining -= unbatched_quantity
+
+    now = timezone.now()
+    for batch, batch_qty in lines:
+        batch.quantity -= batch_qty
+        batch.updated_at = now
+    Batch.objects.bulk_update([batch for batch, _qty in lines], ['quantity', 'updated_at'])
+
+    issued = sum((batch_qty for _batch, batch_qty in lines), Decimal('0')) + unbatched_quantity
+    change_quantity(inventory, -issued, now)
+    return lines, unbatched_quantity, remaining
+
+
+def issue_stock(inventory, quantity, *, transaction_type, operator, reference_no='', unit=None, remark='',
+                strategy=None, pinned=None, own_reserved=None, respect_reservations=False, allow_unbatched=False):
+    """按批次出库，需在事务中调用
+
+    allow_unbatched: 批次不足时，允许从库存总数量中未落到批次的部分扣减（记录不关联批次）
+    返回 AllocationResult
+    """
+    lines, unbatched_quantity, remaining = _consume_batches(
+        inventory, quantity, strategy=strategy, pinned=pinned, own_reserved=own_reserved,
+        respect_reservations=respect_reservations, allow_unbatched=allow_unbatched,
+    )
+
+    common = {
+        'transaction_type': transaction_type,
+        'inventory': inventory,
+        'unit': unit or inventory.unit,
+        'reference_no': reference_no,
+        'remark': remark,
+        'operator': operator,
+    }
+    stock_transactions = [StockTransaction(batch=batch, quantity=batch_qty, **common) for batch, batch_qty in lines]
+    for stock_transaction in stock_transactions:
+        apply_transaction_cost(stock_transaction)
+    if unbatched_quantity > 0:
+        unbatched_transaction = StockTransaction(batch=None, quantity=unbatched_quantity, **common)
+        apply_transaction_cost(unbatched_transaction, unbatched=True)
+        stock_transactions.append(unbatched_transaction)
+    created = create_stock_transactions(stock_transactions)
+
+    return AllocationResult(lines, unbatched_quantity, remaining, created)
+
+
+def receive_stock(inventory, quantity, **batch_fields):
+    """新建批次入库，库存总数量按入库数量增加，返回新批次（库存变动记录由调用方创建）"""
+    batch = Batch.objects.create(inventory=inventory, quantity=quantity, **batch_fields)
+    change_quantity(inventory, quantity)
+    return batch
+
+
+def adjust_stock(inventory, delta, *, operator, reference_no='', unit=None, remark='', **transaction_fields):
+    """库存调整/退回，需在事务中调用，返回库存变动记录（transaction_type='adjustment'，数量带正负号）
+
+    启用了批次的库存：增加时新建调整批次，减少时按出库策略扣减批次，保持批次合计与库存总数量一致；
+    未启用批次的库存只调整库存总数量。
+    transaction_fields: 库存变动记录的其它字段（如 adjustment_request、old_unit_price）
+    """
+    delta = Decimal(delta)
+    stock_transaction = StockTransaction(
+        transaction_type='adjustment',
+        inventory=inventory,
+        quantity=delta,
+        unit=unit or inventory.unit,
+        reference_no=reference_no,
+        remark=remark,
+        operator=operator,
+        **transaction_fields,
+    )
+    if delta > 0:
+        if Batch.objects.filter(inventory=inventory).exists():
+            stock_transaction.batch = receive_stock(
+                inventory, delta, batch_no=reference_no or f'ADJ-{timezone.localdate():%Y%m%d}',
+                batch_date=timezone.localdate(), remark=remark,
+            )
+        else:
+            change_quantity(inventory, delta)
+        stock_transaction.save()
+    elif delta < 0:
+        # 先记录再扣减批次，FIFO 发出成本按扣减前的在库批次计算
+        stock_transaction.save()
+        _lines, _unbatched, remaining = _consume_batches(inventory, -delta, allow_unbatched=True)
+        # 超出在库数量的部分仍然扣减库存总数量（出现负库存，由库存健康检查预警）
+        change_quantity(inventory, -remaining)
+    else:
+        stock_transaction.save()
+    return stock_transaction
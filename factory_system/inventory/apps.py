@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
+
+    def ready(self):
+        from . import signals  # noqa: F401 注册BOM缓存失效信号
+        from django.core import checks
+        from . import search_index
+        search_index.connect_signals()
+        checks.register(search_index.check_pinyin)
@@ -0,0 +1,190 @@
+"""
+原料齐套检查
+
+一次检查多个 (产品, 数量) 需求：
+1. 从BOM缓存（inventory.bom_cache）读取所有产品展开到原料的配方（多级BOM的半成品已逐层展开），未命中时按层批量查询补齐
+2. 一条 IN 查询读取涉及的原料，一条 IN 查询读取这些原料的库存
+3. 在内存中计算每个需求的原料缺口，以及按原料汇总后的总缺口
+
+视图和后台任务共用：结果对象可直接用于模板（属性访问），as_dict() 转为可JSON序列化的结构。
+"""
+from decimal import Decimal
+
+from .bom_cache import get_exploded_lines
+from .models import Inventory, Material
+
+
+ZERO = Decimal('0')
+
+
+def _float(value):
+    return float(value) if value is not None else 0.0
+
+
+class MaterialLine:
+    """单个需求对一种原料的需求（多级BOM展开后按原料合并）"""
+
+    def __init__(self, material, unit, bom_quantity, required, available):
+        self.material = material
+        self.unit = unit
+        self.bom_quantity = bom_quantity  # 单位产品用量（含半成品折算）
+        self.required = required  # 需求量 = BOM用量 × 需求数量
+        self.available = available  # 当前库存
+
+    @property
+    def shortage(self):
+        return max(self.required - self.available, ZERO)
+
+    @property
+    def sufficient(self):
+        return self.required <= self.available
+
+    def as_dict(self):
+        return {
+            'material_id': self.material.pk,
+            'material_name': self.material.name,
+            'unit': self.unit,
+            'bom_quantity': _float(self.bom_quantity),
+            'required': _float(self.required),
+            'available': _float(self.available),
+            'shortage': _float(self.shortage),
+        }
+
+
+class ProductRequirement:
+    """一个 (产品, 数量) 需求的检查结果，lines 为该产品各BOM行的原料需求"""
+
+    def __init__(self, product_id, quantity, lines):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.lines = lines
+
+    @property
+    def has_bom(self):
+        return bool(self.lines)
+
+    @property
+    def sufficient(self):
+        """单独生产该需求时原料是否充足（不考虑同批其它需求的占用）"""
+        return all(line.sufficient for line in self.lines)
+
+    @property
+    def shortages(self):
+        return [line for line in self.lines if not line.sufficient]
+
+    def as_dict(self):
+        return {
+            'product_id': self.product_id,
+            'quantity': _float(self.quantity),
+            'sufficient': self.sufficient,
+            'lines': [line.as_dict() for line in self.lines],
+        }
+
+
+class MaterialTotal:
+    """按原料汇总的需求"""
+
+    def __init__(self, material, unit, available):
+        self.material = material
+        self.unit = unit
+        self.required = ZERO
+        self.available = available
+
+    @property
+    def shortage(self):
+        return max(self.required - self.available, ZERO)
+
+    @property
+    def sufficient(self):
+        return self.required <= self.available
+
+    def as_dict(self):
+        return {
+            'material_id': self.material.pk,
+            'material_name': self.material.name,
+            'unit': self.unit,
+            'required': _float(self.required),
+            'available': _float(self.available),
+            'shortage': _float(self.shortage),
+        }
+
+
+class AvailabilityResult:
+    """齐套检查结果
+
+    items: 与请求顺序一致的 ProductRequirement 列表
+    materials: {material_id: MaterialTotal}，全部需求按原料汇总
+    """
+
+    def __init__(self, items, materials):
+        self.items = items
+        self.materials = materials
+
+    @property
+    def sufficient(self):
+        """全部需求同时生产时原料是否充足"""
+        return all(total.sufficient for total in self.materials.values())
+
+    @property
+    def shortages(self):
+        return [total for total in self.materials.values() if not total.sufficient]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def as_dict(self):
+        return {
+            'sufficient': self.sufficient,
+            'items': [item.as_dict() for item in self.items],
+            'materials': [total.as_dict() for total in self.materials.values()],
+        }
+
+
+def material_quantities(material_ids):
+    """原料当前库存 {material_id: 数量}，一条 IN 查询"""
+    quantities = {}
+    rows = Inventory.objects.filter(
+        inventory_type='material', material_id__in=set(material_ids),
+    ).values_list('material_id', 'quantity')
+    for material_id, quantity in rows:
+        quantities[material_id] = quantities[material_id] + quantity if material_id in quantities else quantity
+    return quantities
+
+
+def check_material_availability(requirements):
+    """检查多个 (产品或产品ID, 数量) 需求的原料齐套情况，返回 AvailabilityResult
+
+    无论需求多少，BOM缓存命中时只执行两条查询（原料、原料库存）
+    """
+    requirements = [
+        (getattr(product, 'pk', product), Decimal(quantity)) for product, quantity in requirements
+    ]
+    bom_lines = get_exploded_lines(product_id for product_id, _quantity in requirements)
+
+    material_ids = {material_id for lines in bom_lines.values() for material_id, _qty, _unit in lines}
+    if material_ids:
+        materials_by_id = Material.objects.in_bulk(material_ids)
+        available = material_quantities(material_ids)
+    else:
+        materials_by_id, available = {}, {}
+
+    items = []
+    materials = {}
+    for product_id, quantity in requirements:
+        lines = []
+        for material_id, bom_quantity, unit in bom_lines.get(product_id, ()):
+            material = materials_by_id[material_id]
+            material_available = available.get(material_id, ZERO)
+            required = bom_quantity * quantity
+            lines.append(MaterialLine(material, unit, bom_quantity, required, material_available))
+
+            total = materials.get(material_id)
+            if total is None:
+                total = materials[material_id] = MaterialTotal(material, unit, material_available)
+            total.required += required
+        items.append(ProductRequirement(product_id, quantity, lines))
+
+    return AvailabilityResult(items, materials)
@@ -0,0 +1,181 @@
+"""
+BOM配方缓存
+
+按产品缓存BOM，每个产品两条紧凑记录：
+- 直接配方：((material_id, component_product_id, 单位用量, 单位), ...)，原料和半成品二选一，另一项为 None
+- 展开结果：((material_id, 单位用量, 单位), ...)，半成品逐层展开为原料并按原料合并（多级BOM）
+
+两级缓存，由全局版本号保持多进程一致：
+- 全局版本号存放在 Django 共享缓存（settings.CACHES）中，BOM 新增、修改、删除（信号）、
+  初始化命令执行后递增版本号；各进程的缓存键都带版本号，版本变化后旧记录自然失效
+- 进程内缓存：版本号未变时直接命中，不访问共享缓存中的配方记录
+- 共享缓存：进程内未命中时按 get_many 批量读取，仍未命中的产品一条查询读取后 set_many 回填
+
+多进程部署时 CACHES 需配置为进程间共享的后端（Redis、Memcached、数据库缓存），
+默认的本地内存缓存只在单进程内有效。
+"""
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import BOM
+
+
+VERSION_KEY = 'inventory:bom:version'
+
+QUANTITY_PLACES = Decimal('0.0001')
+
+_local = threading.local()
+
+
+def get_cache_timeout():
+    """共享缓存中配方记录的有效期（settings.BOM_CACHE_TIMEOUT，默认1天）"""
+    return getattr(settings, 'BOM_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _initial_version():
+    # 以毫秒时间戳作为初始版本号：版本号被缓存淘汰后重新初始化，也不会与旧版本的缓存键重复
+    return int(time.time() * 1000)
+
+
+def get_bom_version():
+    """当前BOM版本号"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_bom_version():
+    """递增BOM版本号，使所有进程的BOM缓存失效"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, _initial_version(), timeout=None)
+
+
+def bump_bom_version_on_commit():
+    """事务提交后再递增版本号，避免其它进程在提交前按新版本号缓存旧数据"""
+    transaction.on_commit(bump_bom_version)
+
+
+def _entry_key(version, product_id, kind='direct'):
+    return f'inventory:bom:{version}:{kind}:{product_id}'
+
+
+def _local_entries(version):
+    """本线程对应版本的进程内缓存（每个线程一份，避免并发修改同一个字典）"""
+    if getattr(_local, 'version', None) != version:
+        _local.version = version
+        _local.entries = {'direct': {}, 'exploded': {}}
+    return _local.entries
+
+
+def _get_entries(product_ids, kind, load, version=None):
+    """按 进程内缓存 -> 共享缓存 -> load(未命中的产品ID) 的顺序读取记录"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+
+    version = version or get_bom_version()
+    entries = _local_entries(version)[kind]
+    result = {product_id: entries[product_id] for product_id in product_ids if product_id in entries}
+
+    missing = product_ids - result.keys()
+    if missing:
+        keys = {_entry_key(version, product_id, kind): product_id for product_id in missing}
+        for key, lines in cache.get_many(keys).items():
+            result[keys[key]] = lines
+        missing -= result.keys()
+
+    if missing:
+        loaded = load(missing, version)
+        cache.set_many(
+            {_entry_key(version, product_id, kind): lines for product_id, lines in loaded.items()},
+            timeout=get_cache_timeout(),
+        )
+        result.update(loaded)
+
+    entries.update(result)
+    return result
+
+
+def _load_direct(product_ids, version):
+    loaded = {product_id: [] for product_id in product_ids}
+    rows = BOM.objects.filter(product_id__in=product_ids).order_by('pk').values_list(
+        'product_id', 'material_id', 'component_product_id', 'quantity', 'unit'
+    )
+    for product_id, material_id, component_product_id, quantity, unit in rows:
+        loaded[product_id].append((material_id, component_product_id, quantity, unit))
+    return {product_id: tuple(lines) for product_id, lines in loaded.items()}
+
+
+def get_bom_lines(product_ids, version=None):
+    """多个产品的直接配方 {product_id: ((material_id, component_product_id, 单位用量, 单位), ...)}
+
+    没有BOM的产品对应空元组
+    """
+    return _get_entries(product_ids, 'direct', _load_direct, version)
+
+
+def _load_exploded(product_ids, version):
+    """展开多个产品的多级BOM
+
+    按层批量读取直接配方（每层最多一次查询），再自底向上记忆化展开，
+    同一半成品被多个成品共用时只展开一次。保存时已拒绝循环BOM，这里仍做防护。
+    """
+    direct = {}
+    level = set(product_ids)
+    while level:
+        lines = get_bom_lines(level, version)
+        direct.update(lines)
+        level = {
+            component_id
+            for product_lines in lines.values()
+            for _material_id, component_id, _quantity, _unit in product_lines
+            if component_id is not None and component_id not in direct
+        }
+
+    memo = {}
+    visiting = set()
+
+    def explode(product_id):
+        if product_id in memo:
+            return memo[product_id]
+        if product_id in visiting:
+            raise ValueError(f'BOM存在循环引用（成品ID {product_id}）')
+        visiting.add(product_id)
+        merged = {}
+        for material_id, component_id, quantity, unit in direct.get(product_id, ()):
+            if component_id is None:
+                parts = ((material_id, quantity, unit),)
+            else:
+                # 折算到本成品的用量保持BOM用量的精度（4位小数）
+                parts = ((sub_material_id, (sub_quantity * quantity).quantize(QUANTITY_PLACES), sub_unit)
+                         for sub_material_id, sub_quantity, sub_unit in explode(component_id))
+            for part_material_id, part_quantity, part_unit in parts:
+                if part_material_id in merged:
+                    merged[part_material_id][0] += part_quantity
+                else:
+                    merged[part_material_id] = [part_quantity, part_unit]
+        visiting.discard(product_id)
+        memo[product_id] = tuple(
+            (material_id, quantity, unit) for material_id, (quantity, unit) in merged.items()
+        )
+        return memo[product_id]
+
+    return {product_id: explode(product_id) for product_id in product_ids}
+
+
+def get_exploded_lines(product_ids):
+    """多个产品展开到原料的配方 {product_id: ((material_id, 单位用量, 单位), ...)}
+
+    单级BOM的展开结果与直接配方相同；没有BOM的产品对应空元组
+    """
+    version = get_bom_version()
+    return _get_entries(product_ids, 'exploded', _load_exploded, version)
@@ -0,0 +1,161 @@
+"""
+库存成本核算
+
+每条库存变动记录写入时增量计算成本，不回读全部批次：
+- 入库（采购入库、生产完工入库、正数调整）：按批次单价（无批次单价时按基础单价）增加库存成本
+- 出库（销售出库、生产领料出库、负数调整）：按计价方法计算发出成本，记录在 StockTransaction 上
+
+计价方法由 settings.INVENTORY_COSTING_METHOD 配置：
+- fifo: 先进先出，按出库批次的批次单价计价；未指定批次时按在库批次FIFO顺序逐层消耗；
+  从未落到批次的库存出库（issue_stock 的 unbatched 部分）不属于任何批次成本层，按平均成本计价
+- moving_average: 移动加权平均，按库存当前平均成本计价
+
+Inventory.cost_quantity / cost_value 为计价数量和账面成本的累计值，
+月末销售成本、库存成本只需对 StockTransaction.total_cost / Inventory.cost_value 求和。
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import Batch, Inventory, StockTransaction
+
+
+METHOD_FIFO = 'fifo'
+METHOD_MOVING_AVERAGE = 'moving_average'
+
+METHOD_CHOICES = [
+    (METHOD_FIFO, '先进先出'),
+    (METHOD_MOVING_AVERAGE, '移动加权平均'),
+]
+
+# 出库类型（发出成本）与入库类型（增加成本），调整按数量正负区分
+ISSUE_TRANSACTION_TYPES = ('sale_out', 'production_out')
+RECEIPT_TRANSACTION_TYPES = ('purchase_in', 'production_in')
+
+UNIT_COST_PLACES = Decimal('0.0001')
+AMOUNT_PLACES = Decimal('0.01')
+
+
+def get_costing_method():
+    """当前计价方法"""
+    method = getattr(settings, 'INVENTORY_COSTING_METHOD', METHOD_FIFO)
+    if method not in dict(METHOD_CHOICES):
+        raise ValueError(f'未知的计价方法: {method}')
+    return method
+
+
+def _standard_unit_price(inventory):
+    return Decimal(inventory.get_unit_price() or 0)
+
+
+def _average_unit_cost(cost_quantity, cost_value, inventory):
+    """当前平均成本，计价数量为0时回退到基础单价"""
+    if cost_quantity > 0:
+        return cost_value / cost_quantity
+    return _standard_unit_price(inventory)
+
+
+def _fifo_issue_cost(inventory, quantity, batch, average_cost):
+    """先进先出的发出成本：指定批次按该批次单价；否则按在库批次顺序逐层消耗"""
+    if batch is not None:
+        unit_cost = batch.unit_price if batch.unit_price is not None else average_cost
+        return quantity * unit_cost
+
+    total_cost = Decimal('0')
+    remaining = quantity
+    # 只读取覆盖出库数量所需的前几个批次
+    layers = Batch.objects.filter(inventory=inventory, quantity__gt=0).order_by(
+        'batch_date', 'created_at'
+    ).values_list('quantity', 'unit_price')
+    for layer_quantity, layer_price in layers.iterator(chunk_size=20):
+        if remaining <= 0:
+            break
+        take = min(remaining, layer_quantity)
+        total_cost += take * (layer_price if layer_price is not None else average_cost)
+        remaining -= take
+    if remaining > 0:
+        total_cost += remaining * average_cost
+    return total_cost
+
+
+def apply_transaction_cost(stock_transaction, method=None, unbatched=False):
+    """计算一条尚未保存的库存变动记录的成本，并增量更新库存的计价数量和账面成本
+
+    由 StockTransaction.save() 在新建记录时调用，需在事务中执行。
+    unbatched: 出库数量来自库存总数量中未落到批次的部分，按平均成本计价
+    （此时同一次出库已扣减了批次，在库批次不是这部分数量的成本层）
+    """
+    method = method or get_costing_method()
+    inventory = stock_transaction.inventory
+    quantity = Decimal(stock_transaction.quantity)
+    transaction_type = stock_transaction.transaction_type
+
+    if transaction_type in ISSUE_TRANSACTION_TYPES:
+        is_issue = True
+    elif transaction_type in RECEIPT_TRANSACTION_TYPES:
+        is_issue = False
+    else:
+        # 库存调整：负数为出库，正数为入库
+        is_issue = quantity < 0
+        quantity = abs(quantity)
+
+    if not quantity:
+        stock_transaction.unit_cost = Decimal('0')
+        stock_transaction.total_cost = Decimal('0')
+        return
+
+    # 锁定库存行读取当前累计值，只按本条记录的数量增量更新
+    cost_quantity, cost_value = Inventory.objects.select_for_update().filter(
+        pk=inventory.pk
+    ).values_list('cost_quantity', 'cost_value').get()
+    average_cost = _average_unit_cost(cost_quantity, cost_value, inventory)
+
+    if is_issue:
+        if method == METHOD_FIFO and not unbatched:
+            total_cost = _fifo_issue_cost(inventory, quantity, stock_transaction.batch, average_cost)
+        else:
+            total_cost = quantity * average_cost
+        if quantity >= cost_quantity:
+            # 发出全部计价数量：账面成本全部转出，超出部分按平均成本计价
+            total_cost = cost_value + (quantity - cost_quantity) * average_cost
+        quantity_delta, value_delta = -quantity, -total_cost
+    else:
+        batch = stock_transaction.batch
+        if batch is not None and batch.unit_price is not None:
+            unit_cost = batch.unit_price
+        else:
+            unit_cost = _standard_unit_price(inventory)
+        total_cost = quantity * unit_cost
+        quantity_delta, value_delta = quantity, total_cost
+
+    total_cost = total_cost.quantize(AMOUNT_PLACES, rounding=ROUND_HALF_UP)
+    stock_transaction.total_cost = total_cost
+    stock_transaction.unit_cost = (total_cost / quantity).quantize(UNIT_COST_PLACES, rounding=ROUND_HALF_UP)
+
+    if is_issue and quantity >= cost_quantity:
+        # 全部发出：直接清零，避免舍入误差残留
+        new_quantity, new_value = Decimal('0'), Decimal('0')
+    else:
+        new_quantity = cost_quantity + quantity_delta
+        new_value = (cost_value + value_delta).quantize(AMOUNT_PLACES, rounding=ROUND_HALF_UP)
+    Inventory.objects.filter(pk=inventory.pk).update(cost_quantity=new_quantity, cost_value=new_value)
+    # 同步内存中的库存对象，避免调用方随后 inventory.save() 写回旧值
+    inventory.cost_quantity = new_quantity
+    inventory.cost_value = new_value
+
+
+def cost_of_goods_sold(date_from=None, date_to=None):
+    """期间销售成本（销售出库的发出成本合计）"""
+    transactions = StockTransaction.objects.filter(transaction_type='sale_out')
+    if date_from:
+        transactions = transactions.filter(created_at__date__gte=date_from)
+    if date_to:
+        transactions = transactions.filter(created_at__date__lte=date_to)
+    return transactions.aggregate(total=Sum('total_cost'))['total'] or Decimal('0')
+
+
+def inventory_cost_value(queryset=None):
+    """库存账面成本合计"""
+    queryset = Inventory.objects.all() if queryset is None else queryset
+    return queryset.aggregate(total=Sum('cost_value'))['total'] or Decimal('0')
@@ -0,0 +1,103 @@
+"""
+库存记录（出入库 + 库存调整）统一查询
+
+所有记录都来自 StockTransaction，在数据库中完成带符号数量、物品名称和调整明细的计算，
+并使用 (created_at, id) 游标分页，翻到第N页与第1页的开销相同。
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Case, CharField, DecimalField, F, Q, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import StockTransaction
+
+
+# 出库类型显示为负数，其余（入库、调整）按记录数量显示
+OUTBOUND_TRANSACTION_TYPES = ('sale_out', 'production_out')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def ledger_queryset():
+    """库存记录查询集（未排序、未分页）"""
+    return StockTransaction.objects.select_related('inventory', 'operator').annotate(
+        signed_quantity=Case(
+            When(transaction_type__in=OUTBOUND_TRANSACTION_TYPES, then=-F('quantity')),
+            default=F('quantity'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        item_name=Coalesce(
+            Case(
+                When(inventory__inventory_type='product', then=F('inventory__product__name')),
+                When(inventory__inventory_type='material', then=F('inventory__material__name')),
+                When(inventory__inventory_type='other', then=F('inventory__other_name')),
+                output_field=CharField(),
+            ),
+            Value('-'),
+        ),
+        # 调整记录通过外键关联调整申请，与主查询一起 JOIN
+        adj_current_quantity=F('adjustment_request__current_quantity'),
+        adj_new_quantity=F('adjustment_request__new_quantity'),
+    )
+
+
+def encode_cursor(record):
+    """将记录的 (created_at, id) 编码为游标字符串"""
+    micros = (record.created_at - _EPOCH) // timedelta(microseconds=1)
+    return f'{micros}.{record.pk}'
+
+
+def decode_cursor(cursor):
+    """解析游标字符串，格式不正确时返回None"""
+    try:
+        micros, pk = cursor.split('.', 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+class LedgerPage:
+    """游标分页结果"""
+
+    def __init__(self, records, has_next, has_previous):
+        self.records = records
+        self.has_next = has_next and bool(records)
+        self.has_previous = has_previous and bool(records)
+        self.next_cursor = encode_cursor(records[-1]) if self.has_next else ''
+        self.previous_cursor = encode_cursor(records[0]) if self.has_previous else ''
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def paginate_ledger(queryset, after=None, before=None, page_size=20):
+    """按 created_at、id 倒序分页
+
+    after: 上一页最后一条记录的游标，返回更早的记录（下一页）
+    before: 当前页第一条记录的游标，返回更新的记录（上一页）
+    """
+    before_key = decode_cursor(before) if before else None
+    if before_key:
+        created_at, pk = before_key
+        rows = list(queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+        ).order_by('created_at', 'id')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return LedgerPage(rows, has_next=True, has_previous=has_previous)
+
+    after_key = decode_cursor(after) if after else None
+    if after_key:
+        created_at, pk = after_key
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    has_next = len(rows) > page_size
+    return LedgerPage(rows[:page_size], has_next=has_next, has_previous=after_key is not None)
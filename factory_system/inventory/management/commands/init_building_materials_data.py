@@ -3,6 +3,7 @@ from django.db import transaction
 from inventory.models import (
     Customer, MaterialCategory, Material, Product, BOM, Inventory
 )
+from inventory.bom_cache import bump_bom_version
 from logistics.models import Driver, Vehicle
 
 
@@ -453,6 +454,8 @@ class Command(BaseCommand):
                 )
                 bom_count += 1
         
+        # 使各进程的BOM缓存失效
+        transaction.on_commit(bump_bom_version)
         self.stdout.write(f'  创建了 {bom_count} 条BOM配方记录')
 
     def create_inventory(self):
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from inventory.bom_cache import bump_bom_version
 from inventory.models import Product, BOM, Material
 
 
@@ -62,6 +63,9 @@ class Command(BaseCommand):
                         )
                     )
         
+        # 使各进程的BOM缓存失效
+        bump_bom_version()
+        
         self.stdout.write('')
         self.stdout.write(self.style.SUCCESS(
             f'BOM配方初始化完成！'
@@ -0,0 +1,24 @@
+"""
+重建搜索索引（SearchEntry）：批量导入数据（不经过模型保存）或修改检索键生成规则后执行，初始索引由迁移生成
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import search_index
+
+
+class Command(BaseCommand):
+    help = '重建成品、原料、客户、供应商的搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help='只重建这些类型：product、material、customer、supplier（默认全部）')
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or None
+        unknown = set(kinds or ()) - set(search_index.SOURCES)
+        if unknown:
+            raise CommandError(f'未知类型：{", ".join(sorted(unknown))}')
+        
+        counts = search_index.rebuild(kinds)
+        for kind, count in counts.items():
+            self.stdout.write(f'  {kind}：{count} 条检索键')
+        self.stdout.write(self.style.SUCCESS('搜索索引重建完成'))
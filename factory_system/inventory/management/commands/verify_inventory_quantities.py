@@ -0,0 +1,54 @@
+"""
+核对命令：库存总数量（Inventory.quantity）按差额增量维护，定期与批次数量合计核对，报告或修复偏差
+
+库存总数量可以多于批次合计（未落到批次的期初库存等），只有少于批次合计时才是偏差，修复时补齐到批次合计
+
+修复不经过 allocation.change_quantity，逐个发送 stock_changed，使可承诺量快照、产品选项缓存等按库存失效
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.models import Inventory
+from inventory.signals import stock_changed
+from inventory.stock_health import batch_quantity_mismatches
+
+
+class Command(BaseCommand):
+    help = '核对库存总数量不少于批次数量合计（未启用批次的库存不检查）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='将少于批次数量合计的库存总数量补齐到批次数量合计')
+
+    def handle(self, *args, **options):
+        repair = options['repair']
+        
+        with transaction.atomic():
+            mismatches = list(batch_quantity_mismatches())
+            if repair and mismatches:
+                # 分组查询不能加锁：锁定有偏差的库存行后重新核对，避免覆盖并发的出入库
+                ids = [inventory.pk for inventory in mismatches]
+                list(Inventory.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+                mismatches = list(batch_quantity_mismatches().filter(pk__in=ids))
+            
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS('库存总数量均不少于批次数量合计'))
+                return
+            
+            now = timezone.now()
+            for inventory in mismatches:
+                self.stdout.write(
+                    f'  {inventory}：总数量 {inventory.quantity}，批次合计 {inventory.batch_total}'
+                    f'（{inventory.batch_count} 个批次），差额 {inventory.difference}'
+                )
+                inventory.quantity = inventory.batch_total
+                inventory.updated_at = now
+            
+            if not repair:
+                self.stdout.write(self.style.WARNING(f'发现 {len(mismatches)} 个库存总数量少于批次合计（未修改，使用 --repair 修复）'))
+                return
+            
+            Inventory.objects.bulk_update(mismatches, ['quantity', 'updated_at'])
+            for inventory in mismatches:
+                stock_changed.send(sender=Inventory, inventory=inventory)
+            self.stdout.write(self.style.SUCCESS(f'已修复 {len(mismatches)} 个库存的总数量'))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_alter_inventory_unique_together_inventory_other_name_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['created_at', 'id'], name='inventory_s_created_33a470_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_adjustment_request(apps, schema_editor):
+    """按关联单号回填调整记录对应的调整申请"""
+    StockTransaction = apps.get_model('inventory', 'StockTransaction')
+    InventoryAdjustmentRequest = apps.get_model('inventory', 'InventoryAdjustmentRequest')
+    StockTransaction.objects.filter(transaction_type='adjustment').update(
+        adjustment_request=models.Subquery(
+            InventoryAdjustmentRequest.objects.filter(
+                request_no=models.OuterRef('reference_no')
+            ).values('pk')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_stocktransaction_created_at_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='adjustment_request',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='inventory.inventoryadjustmentrequest', verbose_name='调整申请'),
+        ),
+        migrations.RunPython(backfill_adjustment_request, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:32
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def init_inventory_costs(apps, schema_editor):
+    """期初成本：在库批次按批次单价，未落到批次的数量按基础单价"""
+    Inventory = apps.get_model('inventory', 'Inventory')
+    Batch = apps.get_model('inventory', 'Batch')
+    batches_by_inventory = {}
+    for batch in Batch.objects.filter(quantity__gt=0):
+        batches_by_inventory.setdefault(batch.inventory_id, []).append(batch)
+    for inventory in Inventory.objects.select_related('product', 'material'):
+        if inventory.inventory_type == 'product' and inventory.product:
+            standard_price = inventory.product.unit_price or Decimal('0')
+        elif inventory.inventory_type == 'material' and inventory.material:
+            standard_price = inventory.material.unit_price or Decimal('0')
+        else:
+            standard_price = Decimal('0')
+        value = Decimal('0')
+        batch_quantity = Decimal('0')
+        for batch in batches_by_inventory.get(inventory.pk, []):
+            price = batch.unit_price if batch.unit_price is not None else standard_price
+            value += batch.quantity * price
+            batch_quantity += batch.quantity
+        value += max(inventory.quantity - batch_quantity, Decimal('0')) * standard_price
+        inventory.cost_quantity = max(inventory.quantity, batch_quantity)
+        inventory.cost_value = value.quantize(Decimal('0.01'))
+        inventory.save(update_fields=['cost_quantity', 'cost_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_stocktransaction_adjustment_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='cost_quantity',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='计价数量'),
+        ),
+        migrations.AddField(
+            model_name='inventory',
+            name='cost_value',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='账面成本'),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='total_cost',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True, verbose_name='成本金额'),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True, verbose_name='成本单价'),
+        ),
+        migrations.RunPython(init_inventory_costs, migrations.RunPython.noop),
+    ]
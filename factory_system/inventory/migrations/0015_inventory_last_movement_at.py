@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_last_movement_at(apps, schema_editor):
+    """按库存变动记录回填最近出入库时间"""
+    Inventory = apps.get_model('inventory', 'Inventory')
+    StockTransaction = apps.get_model('inventory', 'StockTransaction')
+    Inventory.objects.update(
+        last_movement_at=models.Subquery(
+            StockTransaction.objects.filter(
+                inventory=models.OuterRef('pk')
+            ).order_by('-created_at').values('created_at')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_inventory_costing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='last_movement_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最近出入库时间'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['inventory_type', 'last_movement_at'], name='inventory_i_invento_366af0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['inventory', 'created_at'], name='inventory_s_invento_545f27_idx'),
+        ),
+        migrations.RunPython(backfill_last_movement_at, migrations.RunPython.noop),
+    ]
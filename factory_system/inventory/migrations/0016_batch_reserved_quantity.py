@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_inventory_last_movement_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='reserved_quantity',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='预占数量'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_batch_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=10, verbose_name='单号前缀')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='已分配到')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '单据编号计数器',
+                'verbose_name_plural': '单据编号计数器',
+                'ordering': ['-date', 'prefix'],
+                'unique_together': {('prefix', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_document_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bom',
+            name='component_product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='used_in_boms', to='inventory.product', verbose_name='半成品'),
+        ),
+        migrations.AlterField(
+            model_name='bom',
+            name='material',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='inventory.material', verbose_name='原料'),
+        ),
+        migrations.AddConstraint(
+            model_name='bom',
+            constraint=models.UniqueConstraint(condition=models.Q(('component_product__isnull', False)), fields=('product', 'component_product'), name='unique_bom_component_product'),
+        ),
+        migrations.AddConstraint(
+            model_name='bom',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('component_product__isnull', True), ('material__isnull', False)), models.Q(('component_product__isnull', False), ('material__isnull', True)), _connector='OR'), name='bom_material_xor_component_product'),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:58
+
+import unicodedata
+
+from django.db import migrations, models
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 系统检查 inventory.E001 报告；安装后执行 rebuild_search_index 补齐拼音检索键
+    lazy_pinyin = None
+
+
+# 以下为本迁移时 inventory.search_index 生成检索键规则的副本，之后修改规则不影响本迁移
+KEY_MAX_LENGTH = 100
+SUFFIX_MAX_LENGTH = 40
+RANK_PREFIX = 0
+RANK_INNER = 1
+
+SOURCES = {
+    'product': ('inventory', 'Product', ('name',), ('sku',)),
+    'material': ('inventory', 'Material', ('name',), ('sku',)),
+    'customer': ('inventory', 'Customer', ('name', 'contact_person'), ('phone',)),
+    'supplier': ('purchase', 'Supplier', ('name', 'contact_person'), ('contact_phone',)),
+}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(ch for ch in text if ch.isalnum())
+
+
+def suffix_keys(text, keys):
+    keys.add((text[:KEY_MAX_LENGTH], RANK_PREFIX))
+    for start in range(1, min(len(text), SUFFIX_MAX_LENGTH)):
+        keys.add((text[start:start + KEY_MAX_LENGTH], RANK_INNER))
+
+
+def pinyin_keys(text, keys):
+    if lazy_pinyin is None or text.isascii():
+        return
+    full = normalize(''.join(lazy_pinyin(text, errors='default')))
+    if full:
+        keys.add((full[:KEY_MAX_LENGTH], RANK_PREFIX))
+    initials = normalize(''.join(lazy_pinyin(text, style=Style.FIRST_LETTER, errors='default')))
+    if initials:
+        suffix_keys(initials, keys)
+
+
+def entry_keys(obj, name_fields, code_fields):
+    keys = set()
+    for field in name_fields + code_fields:
+        text = normalize(getattr(obj, field, ''))
+        if not text:
+            continue
+        suffix_keys(text, keys)
+        if field in name_fields:
+            pinyin_keys(text, keys)
+    best = {}
+    for key, rank in keys:
+        if key and (key not in best or rank < best[key]):
+            best[key] = rank
+    return best
+
+
+def backfill_search_index(apps, schema_editor):
+    """为现有成品、原料、客户、供应商生成检索键，列表搜索改走索引后迁移完即可使用"""
+    SearchEntry = apps.get_model('inventory', 'SearchEntry')
+    for kind, (app_label, model_name, name_fields, code_fields) in SOURCES.items():
+        model = apps.get_model(app_label, model_name)
+        last_pk = 0
+        while True:
+            chunk = list(model.objects.filter(pk__gt=last_pk).order_by('pk')[:1000])
+            if not chunk:
+                break
+            entries = []
+            for obj in chunk:
+                sku = getattr(obj, 'sku', '')
+                label = (f"{obj.name} ({sku})" if sku else obj.name)[:300]
+                entries.extend(
+                    SearchEntry(kind=kind, object_id=obj.pk, key=key, rank=rank, label=label)
+                    for key, rank in entry_keys(obj, name_fields, code_fields).items()
+                )
+            SearchEntry.objects.bulk_create(entries, batch_size=1000)
+            last_pk = chunk[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_bom_sub_assemblies'),
+        ('purchase', '0003_supplier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', '成品'), ('material', '原料'), ('customer', '客户'), ('supplier', '供应商')], max_length=20, verbose_name='类型')),
+                ('object_id', models.PositiveIntegerField(verbose_name='对象ID')),
+                ('key', models.CharField(max_length=100, verbose_name='检索键')),
+                ('rank', models.PositiveSmallIntegerField(default=0, verbose_name='匹配优先级')),
+                ('label', models.CharField(max_length=300, verbose_name='显示名称')),
+            ],
+            options={
+                'verbose_name': '搜索索引',
+                'verbose_name_plural': '搜索索引',
+                'indexes': [models.Index(fields=['kind', 'key'], name='search_kind_key_idx'), models.Index(fields=['rank', 'key'], name='search_rank_key_idx'), models.Index(fields=['kind', 'object_id'], name='search_kind_object_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
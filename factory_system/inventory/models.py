@@ -154,9 +154,14 @@ class Product(models.Model):
 
 
 class BOM(models.Model):
-    """BOM配方库 - 定义1个成品由哪些原料组成"""
+    """BOM配方库 - 定义1个成品由哪些原料（或半成品）组成
+
+    每行的组成部分二选一：原料，或另一个成品作为半成品（如多个成品共用的预拌砂浆），
+    半成品按其自身的BOM继续展开，展开结果见 inventory.bom_cache.get_exploded_lines
+    """
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='bom_items', verbose_name='成品')
-    material = models.ForeignKey(Material, on_delete=models.PROTECT, verbose_name='原料')
+    material = models.ForeignKey(Material, on_delete=models.PROTECT, null=True, blank=True, verbose_name='原料')
+    component_product = models.ForeignKey(Product, on_delete=models.PROTECT, null=True, blank=True, related_name='used_in_boms', verbose_name='半成品')
     quantity = models.DecimalField(max_digits=10, decimal_places=4, validators=[MinValueValidator(0.0001)], verbose_name='用量')
     unit = models.CharField(max_length=20, verbose_name='单位')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
@@ -166,9 +171,68 @@ class BOM(models.Model):
         verbose_name_plural = 'BOM配方'
         unique_together = ['product', 'material']
         ordering = ['product', 'material']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'component_product'],
+                condition=models.Q(component_product__isnull=False),
+                name='unique_bom_component_product',
+            ),
+            models.CheckConstraint(
+                condition=(
+                    models.Q(material__isnull=False, component_product__isnull=True)
+                    | models.Q(material__isnull=True, component_product__isnull=False)
+                ),
+                name='bom_material_xor_component_product',
+            ),
+        ]
     
     def __str__(self):
-        return f"{self.product.name} -> {self.material.name} ({self.quantity}{self.unit})"
+        return f"{self.product.name} -> {self.component.name} ({self.quantity}{self.unit})"
+    
+    @property
+    def is_sub_assembly(self):
+        return self.component_product_id is not None
+    
+    @property
+    def component(self):
+        """组成部分：原料或半成品"""
+        return self.component_product if self.is_sub_assembly else self.material
+    
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if bool(self.material_id) == bool(self.component_product_id):
+            raise ValidationError('原料和半成品必须且只能选择一项')
+        self.check_cycle()
+    
+    def check_cycle(self):
+        """半成品不能直接或间接包含本成品，否则BOM展开会无限循环"""
+        from django.core.exceptions import ValidationError
+        if not self.component_product_id:
+            return
+        if self.component_product_id == self.product_id:
+            raise ValidationError('成品不能作为自身的半成品')
+        
+        # 一次读取所有半成品关系，在内存中从该半成品向下查找是否能回到本成品
+        children = {}
+        edges = BOM.objects.filter(component_product__isnull=False).exclude(pk=self.pk).values_list(
+            'product_id', 'component_product_id'
+        )
+        for product_id, component_id in edges:
+            children.setdefault(product_id, set()).add(component_id)
+        
+        stack, seen = [self.component_product_id], set()
+        while stack:
+            current = stack.pop()
+            if current == self.product_id:
+                raise ValidationError(f'半成品 {self.component_product} 的BOM中（直接或间接）包含 {self.product}，形成循环')
+            if current not in seen:
+                seen.add(current)
+                stack.extend(children.get(current, ()))
+    
+    def save(self, *args, **kwargs):
+        # 命令、视图等不经过表单校验的保存路径同样拒绝循环BOM
+        self.check_cycle()
+        super().save(*args, **kwargs)
 
 
 class Inventory(models.Model):
@@ -185,11 +249,19 @@ class Inventory(models.Model):
     other_name = models.CharField(max_length=200, blank=True, verbose_name='其它物品名称')
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)], verbose_name='数量')
     unit = models.CharField(max_length=20, verbose_name='单位')
+    # 成本核算累计值，由 inventory.costing 在写入库存变动记录时增量维护
+    cost_quantity = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='计价数量')
+    cost_value = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='账面成本')
+    # 最近一次出入库时间，写入库存变动记录时同步更新，用于呆滞库存判断
+    last_movement_at = models.DateTimeField(null=True, blank=True, verbose_name='最近出入库时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     
     class Meta:
         verbose_name = '库存'
         verbose_name_plural = '库存'
+        indexes = [
+            models.Index(fields=['inventory_type', 'last_movement_at']),  # 呆滞库存范围查询
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['inventory_type', 'product'],
@@ -244,22 +316,18 @@ class Inventory(models.Model):
         return 0
     
     def get_total_value(self):
-        """计算总价值（单价 * 数量）"""
-        from decimal import Decimal
-        unit_price = Decimal(str(self.get_unit_price()))
-        quantity = Decimal(str(self.quantity))
-        return float(unit_price * quantity)
+        """计算总价值（单价 * 数量），汇总估值请使用 inventory.valuation"""
+        return self.quantity * self.get_unit_price()
     
     def get_batches(self):
         """获取所有批次"""
         return Batch.objects.filter(inventory=self).order_by('batch_date', 'created_at')
     
-    def update_quantity_from_batches(self):
-        """从批次汇总更新总数量"""
-        from django.db.models import Sum
-        total = self.get_batches().aggregate(total=Sum('quantity'))['total'] or 0
-        self.quantity = total
-        self.save(update_fields=['quantity'])
+    def get_live_batches(self):
+        """获取在库批次（数量>0，FIFO顺序），优先使用 live_batches_prefetch() 预加载的结果"""
+        if hasattr(self, 'live_batches'):
+            return self.live_batches
+        return list(self.get_batches().filter(quantity__gt=0))
 
 
 class Batch(models.Model):
@@ -268,6 +336,8 @@ class Batch(models.Model):
     inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='batches', verbose_name='库存')
     batch_date = models.DateField(verbose_name='批次日期')
     quantity = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name='数量')
+    # 有效的预占订单分配到本批次的数量合计，由 sales.reservations 随订单和批次分配变化同步维护
+    reserved_quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='预占数量')
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='批次单价')
     expiry_date = models.DateField(null=True, blank=True, verbose_name='过期日期')
     supplier = models.CharField(max_length=200, blank=True, verbose_name='供应商')
@@ -287,6 +357,11 @@ class Batch(models.Model):
         item_name = self.inventory.product.name if self.inventory.inventory_type == 'product' else self.inventory.material.name
         return f"{item_name} - {self.batch_no} ({self.quantity}{self.inventory.unit})"
     
+    @property
+    def available_quantity(self):
+        """可用数量 = 批次数量 - 已预占数量（不小于0）"""
+        return max(self.quantity - self.reserved_quantity, 0)
+    
     def is_expired(self):
         """检查是否过期"""
         if self.expiry_date:
@@ -295,6 +370,15 @@ class Batch(models.Model):
         return False
 
 
+def live_batches_prefetch(lookup='batches'):
+    """在库批次（数量>0，FIFO顺序）的Prefetch，结果存放在 live_batches 属性上"""
+    return models.Prefetch(
+        lookup,
+        queryset=Batch.objects.filter(quantity__gt=0).order_by('batch_date', 'created_at'),
+        to_attr='live_batches',
+    )
+
+
 class StockTransaction(models.Model):
     """库存变动记录"""
     TRANSACTION_TYPE_CHOICES = [
@@ -312,7 +396,10 @@ class StockTransaction(models.Model):
     unit = models.CharField(max_length=20, verbose_name='单位')
     old_unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='调整前单价')
     new_unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='调整后单价')
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True, verbose_name='成本单价')
+    total_cost = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True, verbose_name='成本金额')
     reference_no = models.CharField(max_length=100, blank=True, verbose_name='关联单号')
+    adjustment_request = models.ForeignKey('InventoryAdjustmentRequest', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions', verbose_name='调整申请')
     remark = models.TextField(blank=True, verbose_name='备注')
     operator = models.ForeignKey('auth.User', on_delete=models.PROTECT, verbose_name='操作人')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
@@ -321,9 +408,25 @@ class StockTransaction(models.Model):
         verbose_name = '库存变动记录'
         verbose_name_plural = '库存变动记录'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),  # 库存记录游标分页
+            models.Index(fields=['inventory', 'created_at']),  # 单个库存的出入库记录
+        ]
     
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.inventory} - {self.quantity}{self.unit}"
+    
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        # 新建记录时按计价方法计算成本，并增量更新库存账面成本
+        if is_new and self.total_cost is None:
+            from .costing import apply_transaction_cost
+            apply_transaction_cost(self)
+        super().save(*args, **kwargs)
+        if is_new:
+            # 同步库存的最近出入库时间（同时更新内存中的库存对象，避免调用方随后 save() 写回旧值）
+            Inventory.objects.filter(pk=self.inventory_id).update(last_movement_at=self.created_at)
+            self.inventory.last_movement_at = self.created_at
 
 
 class InventoryAdjustmentRequest(models.Model):
@@ -422,3 +525,51 @@ class PurchaseOrderItem(models.Model):
         return f"{self.order.order_no} - {self.material.name} x {self.quantity}"
 
 
+
+
+class DocumentSequence(models.Model):
+    """单据编号计数器：每个前缀每天一行，由 inventory.numbering 按号段分配"""
+    prefix = models.CharField(max_length=10, verbose_name='单号前缀')
+    date = models.DateField(verbose_name='日期')
+    last_value = models.PositiveIntegerField(default=0, verbose_name='已分配到')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    
+    class Meta:
+        verbose_name = '单据编号计数器'
+        verbose_name_plural = '单据编号计数器'
+        unique_together = ['prefix', 'date']
+        ordering = ['-date', 'prefix']
+    
+    def __str__(self):
+        return f"{self.prefix}{self.date.strftime('%Y%m%d')} - {self.last_value}"
+
+
+class SearchEntry(models.Model):
+    """搜索索引：每个对象的每个检索键一行，由 inventory.search_index 维护
+
+    检索键已规范化（小写、去空白和标点），按前缀范围查询走 (kind, key) 索引
+    """
+    KIND_CHOICES = [
+        ('product', '成品'),
+        ('material', '原料'),
+        ('customer', '客户'),
+        ('supplier', '供应商'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='类型')
+    object_id = models.PositiveIntegerField(verbose_name='对象ID')
+    key = models.CharField(max_length=100, verbose_name='检索键')
+    rank = models.PositiveSmallIntegerField(default=0, verbose_name='匹配优先级')  # 0: 从开头匹配，1: 从中间匹配
+    label = models.CharField(max_length=300, verbose_name='显示名称')
+    
+    class Meta:
+        verbose_name = '搜索索引'
+        verbose_name_plural = '搜索索引'
+        indexes = [
+            models.Index(fields=['kind', 'key'], name='search_kind_key_idx'),
+            models.Index(fields=['rank', 'key'], name='search_rank_key_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_kind_object_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.label} - {self.key}"
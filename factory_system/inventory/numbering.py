@@ -0,0 +1,154 @@
+"""
+单据编号分配
+
+所有业务单号统一为 前缀 + 日期(YYYYMMDD) + 当日流水号（至少4位），如 SO202401150001。
+每个前缀每天一个计数器（DocumentSequence），进程一次从数据库预留一个号段（settings.DOCUMENT_NUMBER_BLOCK_SIZE），
+号段用完前只在内存中取号，不访问数据库：
+- 预留号段是对计数器行的一条 F() 自增 UPDATE，SQLite 和 PostgreSQL 上都由行锁/写锁串行化，多进程不会拿到重叠的号段
+- 在调用方事务中预留的号段立即放入本线程的待提交缓存，同一事务后续取号直接使用，不再访问计数器行；
+  事务提交后剩余部分转入进程缓存供其它线程使用。事务（或预留所在的保存点）回滚时计数器随之回滚，
+  其它进程可能重新预留这段号，本线程也不再使用（判断依据：提交回调已被 Django 丢弃）
+- 进程重启或跨日时未用完的号段作废，流水号可能不连续，但不会重复
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DocumentSequence
+
+
+# 单据类型前缀
+PREFIX_SALES_ORDER = 'SO'            # 销售订单
+PREFIX_SHIPPING_NOTICE = 'SN'        # 发货通知单
+PREFIX_PRODUCTION_TASK = 'PT'        # 生产任务（订单生产、备货生产）
+PREFIX_REQUISITION = 'MR'            # 领料单
+PREFIX_PRODUCT_INBOUND = 'IN'        # 成品入库单
+PREFIX_SHIPMENT = 'SH'               # 发货单
+PREFIX_PURCHASE_TASK = 'PUR'         # 采购任务（原与生产任务同用 PT，易混淆）
+PREFIX_ADJUSTMENT_REQUEST = 'IAR'    # 库存调整申请
+
+SEQUENCE_DIGITS = 4
+
+_lock = threading.Lock()
+_blocks = {}  # {(prefix, date): [下一个可用值, 号段最后一个值]}
+_local = threading.local()  # pending: 本线程事务中预留、尚未提交的号段 {(prefix, date): (号段, 提交回调)}
+
+
+def get_block_size():
+    """每次从数据库预留的号段大小（settings.DOCUMENT_NUMBER_BLOCK_SIZE，默认20）"""
+    return max(int(getattr(settings, 'DOCUMENT_NUMBER_BLOCK_SIZE', 20)), 1)
+
+
+def format_number(prefix, date, value):
+    return f"{prefix}{date.strftime('%Y%m%d')}{value:0{SEQUENCE_DIGITS}d}"
+
+
+def _reserve_block(prefix, date, size):
+    """在数据库中预留 size 个流水号，返回 (起始值, 结束值)
+
+    先执行自增 UPDATE 再读取：事务的第一条语句就是写操作，SQLite 直接申请写锁（按 busy timeout 等待），
+    不会因为读锁升级写锁而报 database is locked；PostgreSQL 上该行被锁定到事务结束
+    """
+    sequences = DocumentSequence.objects.filter(prefix=prefix, date=date)
+    with transaction.atomic():
+        updated = sequences.update(last_value=F('last_value') + size, updated_at=timezone.now())
+        if not updated:
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(prefix=prefix, date=date, last_value=size)
+            except IntegrityError:
+                # 其它进程同时创建了当天的计数器
+                sequences.update(last_value=F('last_value') + size, updated_at=timezone.now())
+        end = sequences.values_list('last_value', flat=True).get()
+    return end - size + 1, end
+
+
+def _take_cached(key):
+    block = _blocks.get(key)
+    if block and block[0] <= block[1]:
+        value = block[0]
+        block[0] += 1
+        return value
+    return None
+
+
+def _cache_block(key, start, end):
+    with _lock:
+        block = _blocks.get(key)
+        if block and block[0] <= block[1]:
+            # 已有未用完的号段（并发线程预留），多出的这段作废
+            return
+        _blocks[key] = [start, end]
+
+
+def _pending_blocks():
+    if not hasattr(_local, 'pending'):
+        _local.pending = {}
+    return _local.pending
+
+
+def _hold_pending(key, connection, start, end):
+    """事务中预留的剩余号段：本事务内继续使用，提交后转入进程缓存"""
+    block = [start, end]
+
+    def publish():
+        pending = _pending_blocks()
+        if pending.get(key, (None,))[0] is block:
+            del pending[key]
+        if block[0] <= block[1]:
+            _cache_block(key, block[0], block[1])
+
+    _pending_blocks()[key] = (block, publish)
+    connection.on_commit(publish)
+
+
+def _take_pending(key, connection):
+    pending = _pending_blocks()
+    entry = pending.get(key)
+    if entry is None:
+        return None
+    block, publish = entry
+    # 回滚（包括保存点回滚）时 Django 丢弃对应的提交回调，回调仍在即号段的预留仍然有效
+    if not any(callback is publish for _sids, callback, _robust in connection.run_on_commit):
+        del pending[key]
+        return None
+    if block[0] <= block[1]:
+        value = block[0]
+        block[0] += 1
+        return value
+    return None
+
+
+def next_number(prefix):
+    """分配一个新的单据编号"""
+    date = timezone.localdate()
+    key = (prefix, date)
+    connection = transaction.get_connection()
+    in_transaction = connection.in_atomic_block
+    
+    pending = _pending_blocks()
+    for stale_key in [k for k in pending if k[1] != date]:
+        del pending[stale_key]
+    if in_transaction:
+        value = _take_pending(key, connection)
+        if value is not None:
+            return format_number(prefix, date, value)
+    
+    with _lock:
+        # 跨日后清理前一天的号段
+        for stale_key in [k for k in _blocks if k[1] != date]:
+            del _blocks[stale_key]
+        value = _take_cached(key)
+    if value is not None:
+        return format_number(prefix, date, value)
+    
+    start, end = _reserve_block(prefix, date, get_block_size())
+    if end > start:
+        if in_transaction:
+            _hold_pending(key, connection, start + 1, end)
+        else:
+            _cache_block(key, start + 1, end)
+    return format_number(prefix, date, start)
@@ -0,0 +1,217 @@
+"""
+成品、原料、客户、供应商的搜索索引（SearchEntry）
+
+每个对象按以下检索键各存一行，查询时按 key 的前缀范围（key >= q AND key < q + U+FFFF）走 (kind, key) 索引，
+不再对多个字段做 icontains 全表扫描：
+- 名称类字段（名称、联系人）：规范化后的全文（从开头匹配），以及每个后缀（从中间匹配，等价于包含查询），
+  再加全拼和拼音首字母（如 普通水泥 -> putongshuini、ptsn）及首字母后缀
+- 编码类字段（SKU、电话）：规范化后的全文和每个后缀
+规范化：NFKC、小写、去掉空白和标点。
+
+对象保存、删除时由信号重建该对象的检索键（connect_signals，在 InventoryConfig.ready 中注册），
+rebuild_search_index 命令重建全部索引。迁移 0019 中的初始索引使用生成规则的副本，修改这里的规则后需执行该命令。
+
+pypinyin 是必需依赖，未安装时系统检查报错（check_pinyin，inventory.E001），不会静默地只按原文检索。
+"""
+import unicodedata
+
+from django.apps import apps
+from django.core import checks
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 由系统检查报告，见 check_pinyin
+    lazy_pinyin = None
+
+from .models import SearchEntry
+
+
+KEY_MAX_LENGTH = 100
+# 名称超过该长度时只为前面部分生成后缀，控制每个对象的索引行数
+SUFFIX_MAX_LENGTH = 40
+RANK_PREFIX = 0
+RANK_INNER = 1
+
+# 类型 -> (模型, 名称类字段, 编码类字段)
+SOURCES = {
+    'product': ('inventory.Product', ('name',), ('sku',)),
+    'material': ('inventory.Material', ('name',), ('sku',)),
+    'customer': ('inventory.Customer', ('name', 'contact_person'), ('phone',)),
+    'supplier': ('purchase.Supplier', ('name', 'contact_person'), ('contact_phone',)),
+}
+
+
+def normalize(text):
+    """规范化检索文本：NFKC、小写，去掉空白和标点"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(ch for ch in text if ch.isalnum())
+
+
+def _suffix_keys(text, keys):
+    keys.add((text[:KEY_MAX_LENGTH], RANK_PREFIX))
+    for start in range(1, min(len(text), SUFFIX_MAX_LENGTH)):
+        keys.add((text[start:start + KEY_MAX_LENGTH], RANK_INNER))
+
+
+def _pinyin_keys(text, keys):
+    if lazy_pinyin is None or text.isascii():
+        return
+    syllables = lazy_pinyin(text, errors='default')
+    full = normalize(''.join(syllables))
+    if full:
+        keys.add((full[:KEY_MAX_LENGTH], RANK_PREFIX))
+    initials = normalize(''.join(lazy_pinyin(text, style=Style.FIRST_LETTER, errors='default')))
+    if initials:
+        _suffix_keys(initials, keys)
+
+
+def entry_keys(kind, obj):
+    """对象的全部 (检索键, 优先级)，同一键取最高优先级"""
+    _model, name_fields, code_fields = SOURCES[kind]
+    keys = set()
+    for field in name_fields + code_fields:
+        text = normalize(getattr(obj, field, ''))
+        if not text:
+            continue
+        _suffix_keys(text, keys)
+        if field in name_fields:
+            _pinyin_keys(text, keys)
+
+    best = {}
+    for key, rank in keys:
+        if key and (key not in best or rank < best[key]):
+            best[key] = rank
+    return best
+
+
+def entry_label(kind, obj):
+    sku = getattr(obj, 'sku', '')
+    return f"{obj.name} ({sku})" if sku else obj.name
+
+
+def get_model(kind):
+    return apps.get_model(SOURCES[kind][0])
+
+
+def build_entries(kind, objects):
+    """这些对象的检索键行（未保存）"""
+    return [
+        SearchEntry(kind=kind, object_id=obj.pk, key=key, rank=rank, label=entry_label(kind, obj)[:300])
+        for obj in objects
+        for key, rank in entry_keys(kind, obj).items()
+    ]
+
+
+def index_objects(kind, objects):
+    """重建这些对象的检索键"""
+    objects = list(objects)
+    if not objects:
+        return 0
+    entries = build_entries(kind, objects)
+    with transaction.atomic():
+        SearchEntry.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objects]).delete()
+        SearchEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def remove_objects(kind, object_ids):
+    SearchEntry.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def rebuild(kinds=None, chunk_size=1000):
+    """重建指定类型（默认全部）的索引，返回 {类型: 索引行数}"""
+    counts = {}
+    for kind in kinds or SOURCES:
+        model = get_model(kind)
+        with transaction.atomic():
+            SearchEntry.objects.filter(kind=kind).delete()
+            total = 0
+            queryset = model.objects.order_by('pk')
+            last_pk = 0
+            while True:
+                chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    break
+                total += index_objects(kind, chunk)
+                last_pk = chunk[-1].pk
+        counts[kind] = total
+    return counts
+
+
+def _key_range(query):
+    """前缀范围查询条件（任何数据库都能使用B树索引，不依赖 LIKE 的大小写规则）"""
+    query = normalize(query)[:KEY_MAX_LENGTH]
+    if not query:
+        return None
+    return {'key__gte': query, 'key__lt': query + '\uffff'}
+
+
+def matching_ids(kind, query):
+    """匹配查询的对象ID子查询，用于列表页：queryset.filter(pk__in=matching_ids(...))"""
+    key_range = _key_range(query)
+    if key_range is None:
+        return SearchEntry.objects.none().values('object_id')
+    return SearchEntry.objects.filter(kind=kind, **key_range).values('object_id')
+
+
+def search(query, kinds=None, limit=20):
+    """前缀检索，返回 [{'kind', 'id', 'label'}]，从开头匹配的排在前面
+
+    按优先级分别取前若干行（rank + key 范围走 (rank, key) 索引并按 key 顺序截断），不对整个匹配范围排序
+    """
+    key_range = _key_range(query)
+    if key_range is None:
+        return []
+
+    results, seen = [], set()
+    for rank in (RANK_PREFIX, RANK_INNER):
+        entries = SearchEntry.objects.filter(rank=rank, **key_range)
+        if kinds:
+            entries = entries.filter(kind__in=kinds)
+        # 同一对象可能有多个键匹配，多取一些行再去重
+        rows = entries.order_by('key').values_list('kind', 'object_id', 'label')[:limit * 4]
+        matched = []
+        for kind, object_id, label in rows:
+            if (kind, object_id) not in seen:
+                seen.add((kind, object_id))
+                matched.append({'kind': kind, 'id': object_id, 'label': label})
+        results.extend(sorted(matched, key=lambda item: item['label']))
+        if len(results) >= limit:
+            break
+    return results[:limit]
+
+
+def _make_receivers(kind):
+    def reindex(sender, instance, **kwargs):
+        index_objects(kind, [instance])
+
+    def unindex(sender, instance, **kwargs):
+        remove_objects(kind, [instance.pk])
+
+    return reindex, unindex
+
+
+_receivers = []
+
+
+def check_pinyin(app_configs, **kwargs):
+    """系统检查：未安装 pypinyin 时拼音检索（如 ptsn 找到 普通水泥）不可用"""
+    if lazy_pinyin is not None:
+        return []
+    return [checks.Error(
+        '未安装 pypinyin，搜索索引无法生成拼音和拼音首字母检索键',
+        hint='执行 pip install -r requirements.txt，然后执行 python manage.py rebuild_search_index',
+        id='inventory.E001',
+    )]
+
+
+def connect_signals():
+    """对象保存、删除时维护索引"""
+    for kind in SOURCES:
+        model = get_model(kind)
+        reindex, unindex = _make_receivers(kind)
+        _receivers.append((reindex, unindex))  # 信号默认弱引用，保留引用
+        post_save.connect(reindex, sender=model, dispatch_uid=f'search_index_save_{kind}')
+        post_delete.connect(unindex, sender=model, dispatch_uid=f'search_index_delete_{kind}')
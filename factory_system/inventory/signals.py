@@ -0,0 +1,20 @@
+"""
+BOM配方变化时递增BOM缓存版本号（见 inventory.bom_cache），后台编辑、视图、命令都经过这里
+
+stock_changed: 库存总数量变化后发送（inventory.allocation.change_quantity），参数 inventory，
+供依赖库存的快照（如 sales.atp 可承诺量）按库存增量失效
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .bom_cache import bump_bom_version_on_commit
+from .models import BOM
+
+
+stock_changed = Signal()
+
+
+@receiver(post_save, sender=BOM)
+@receiver(post_delete, sender=BOM)
+def invalidate_bom_cache(sender, instance, **kwargs):
+    bump_bom_version_on_commit()
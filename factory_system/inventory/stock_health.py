@@ -0,0 +1,121 @@
+"""
+库存健康状况查询
+
+每项检查都是一条基于索引的集合查询，不逐个库存读取关联记录。
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Inventory, Material
+from .valuation import BASIS_STANDARD, annotate_stock_value
+
+
+# 未完成的领料单状态：其需求计入缺料判断
+OPEN_REQUISITION_STATUSES = ('pending', 'approved')
+
+_QUANTITY_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def below_safety_stock(inventory_type='material'):
+    """低于安全库存的库存（数量 < 对应成品/原料的安全库存）"""
+    inventories = Inventory.objects.select_related('product', 'material').annotate(
+        safety_stock=Case(
+            When(inventory_type='product', then=F('product__safety_stock')),
+            When(inventory_type='material', then=F('material__safety_stock')),
+            default=Value(Decimal('0')),
+            output_field=_QUANTITY_FIELD,
+        ),
+    ).filter(quantity__lt=F('safety_stock'))
+    if inventory_type:
+        inventories = inventories.filter(inventory_type=inventory_type)
+    return inventories.order_by('inventory_type', 'pk')
+
+
+def negative_stock():
+    """数量为负的库存（扣减超出实际库存）"""
+    return Inventory.objects.select_related('product', 'material').filter(quantity__lt=0).order_by('quantity')
+
+
+def requisition_shortages():
+    """未完成领料单的原料需求按原料汇总后，仍大于当前库存的原料
+
+    每行带有 required（需求合计）、available（当前库存）、shortage（缺口）注解
+    """
+    available = Inventory.objects.filter(
+        inventory_type='material', material=OuterRef('pk'),
+    ).values('quantity')[:1]
+    return Material.objects.filter(
+        materialrequisitionitem__requisition__status__in=OPEN_REQUISITION_STATUSES,
+    ).annotate(
+        required=Sum('materialrequisitionitem__required_quantity'),
+        available=Coalesce(Subquery(available, output_field=_QUANTITY_FIELD), Value(Decimal('0'))),
+    ).annotate(
+        shortage=F('required') - F('available'),
+    ).filter(shortage__gt=0).order_by('-shortage')
+
+
+def batch_quantity_mismatches():
+    """库存总数量少于批次数量合计的库存（一次分组查询）
+
+    库存总数量中可以有未落到批次的部分（期初库存、issue_stock(allow_unbatched=True) 从中扣减），
+    总数量多于批次合计不算偏差；批次合计为0时的负数量是超额扣减，由 negative_stock 预警。
+    每行带有 batch_total（批次数量合计）、batch_count（批次数）、difference（差额，为负数）注解
+    """
+    return Inventory.objects.select_related('product', 'material').annotate(
+        batch_total=Coalesce(Sum('batches__quantity'), Value(Decimal('0')), output_field=_QUANTITY_FIELD),
+        batch_count=Count('batches'),
+    ).filter(batch_total__gt=0, quantity__lt=F('batch_total')).annotate(
+        difference=F('quantity') - F('batch_total'),
+    ).order_by('inventory_type', 'pk')
+
+
+def get_idle_inventory_days():
+    """呆滞库存天数阈值（settings.IDLE_INVENTORY_DAYS，默认90天）"""
+    return getattr(settings, 'IDLE_INVENTORY_DAYS', 90)
+
+
+def idle_cutoff(days=None):
+    """呆滞判定时间点：N天前的零点，之前没有出入库记录即为呆滞"""
+    if days is None:
+        days = get_idle_inventory_days()
+    today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today_start - timedelta(days=days)
+
+
+class IdleStock:
+    """呆滞库存查询结果"""
+
+    def __init__(self, items, days):
+        self.items = items
+        self.days = days
+        self.count = len(items)
+        self.value = sum((item.stock_value or Decimal('0') for item in items), Decimal('0'))
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return self.count
+
+
+def idle_stock(days=None, inventory_type='material', basis=BASIS_STANDARD):
+    """呆滞库存：超过N天无出入库记录（从未出入库的也算）的库存
+
+    基于 Inventory.last_movement_at 的一次范围查询，同时得到数量、金额和明细
+    """
+    if days is None:
+        days = get_idle_inventory_days()
+    inventories = Inventory.objects.filter(
+        Q(last_movement_at__lt=idle_cutoff(days)) | Q(last_movement_at__isnull=True),
+    )
+    if inventory_type:
+        inventories = inventories.filter(inventory_type=inventory_type)
+    inventories = annotate_stock_value(
+        inventories.select_related('product', 'material'), basis
+    ).order_by('last_movement_at', 'pk')
+    return IdleStock(list(inventories), days)
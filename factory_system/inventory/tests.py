@@ -1,3 +1,378 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import bom_cache, numbering, search_index
+from .allocation import (
+    STRATEGY_FEFO, STRATEGY_FIFO, STRATEGY_PINNED, adjust_stock, issue_stock, plan_allocation, receive_stock,
+)
+from .models import BOM, Batch, DocumentSequence, Inventory, Material, Product, StockTransaction
+from .signals import stock_changed
+
+
+def create_material_inventory(sku='M-TEST', quantity=0, **fields):
+    material = Material.objects.create(sku=sku, name=f'原料{sku}', unit='kg', **fields)
+    return Inventory.objects.create(inventory_type='material', material=material, quantity=quantity, unit='kg')
+
+
+def receive_batch(inventory, quantity, unit_price, batch_date, operator):
+    """采购入库一个批次（批次 + 入库记录，入库记录保存时计入账面成本）"""
+    batch = receive_stock(
+        inventory, Decimal(quantity), batch_no=f'B{batch_date:%m%d}', batch_date=batch_date, unit_price=Decimal(unit_price),
+    )
+    StockTransaction.objects.create(
+        transaction_type='purchase_in', inventory=inventory, batch=batch, quantity=Decimal(quantity),
+        unit=inventory.unit, operator=operator,
+    )
+    return batch
+
+
+@override_settings(INVENTORY_COSTING_METHOD='fifo', INVENTORY_ISSUE_STRATEGY='fifo')
+class CostingTests(TestCase):
+    """发出成本：FIFO 按批次成本层，未落到批次的部分按平均成本"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('keeper')
+        self.inventory = create_material_inventory()
+        self.old = receive_batch(self.inventory, 10, '1.00', date(2026, 1, 1), self.user)
+        self.new = receive_batch(self.inventory, 10, '2.00', date(2026, 2, 1), self.user)
+
+    def issue(self, quantity, **kwargs):
+        with transaction.atomic():
+            return issue_stock(
+                self.inventory, Decimal(quantity), transaction_type='production_out', operator=self.user, **kwargs,
+            )
+
+    def test_receipts_accumulate_cost(self):
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('20'))
+        self.assertEqual(self.inventory.cost_quantity, Decimal('20'))
+        self.assertEqual(self.inventory.cost_value, Decimal('30.00'))
+
+    def test_fifo_issue_consumes_oldest_layers(self):
+        result = self.issue(15)
+        self.assertEqual([(batch.pk, quantity) for batch, quantity in result.lines], [(self.old.pk, 10), (self.new.pk, 5)])
+        self.assertEqual(sum(t.total_cost for t in result.transactions), Decimal('20.00'))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('5'))
+        self.assertEqual(self.inventory.cost_quantity, Decimal('5'))
+        self.assertEqual(self.inventory.cost_value, Decimal('10.00'))
+
+    def test_negative_adjustment_costs_layers_before_consumption(self):
+        with transaction.atomic():
+            stock_transaction = adjust_stock(self.inventory, Decimal('-15'), operator=self.user)
+        self.assertEqual(stock_transaction.total_cost, Decimal('20.00'))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('5'))
+        self.assertEqual(self.inventory.cost_value, Decimal('10.00'))
+
+    def test_unbatched_remainder_costs_at_average(self):
+        # 期初库存 10 未落到批次，成本 8.00
+        Inventory.objects.filter(pk=self.inventory.pk).update(
+            quantity=30, cost_quantity=30, cost_value=Decimal('38.00'),
+        )
+        self.inventory.refresh_from_db()
+        result = self.issue(25, allow_unbatched=True)
+        self.assertEqual(result.unbatched_quantity, Decimal('5'))
+        batched = [t.total_cost for t in result.transactions if t.batch is not None]
+        unbatched = [t.total_cost for t in result.transactions if t.batch is None]
+        self.assertEqual(sum(batched), Decimal('30.00'))
+        # 批次成本层发出后剩余 10 件、成本 8.00，平均 0.80
+        self.assertEqual(unbatched, [Decimal('4.00')])
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('5'))
+        self.assertEqual(self.inventory.cost_value, Decimal('4.00'))
+
+    @override_settings(INVENTORY_COSTING_METHOD='moving_average')
+    def test_moving_average_issue(self):
+        result = self.issue(15)
+        self.assertEqual(sum(t.total_cost for t in result.transactions), Decimal('22.50'))
+
+
+class AllocationTests(TestCase):
+    """批次出库分配：FIFO/FEFO/指定批次、预占、数量不足"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('keeper')
+        self.inventory = create_material_inventory()
+        # 入库顺序与到期顺序相反：FIFO 先出 early，FEFO 先出 late
+        self.early = receive_stock(
+            self.inventory, Decimal('10'), batch_no='EARLY', batch_date=date(2026, 1, 1), expiry_date=date(2026, 12, 31),
+        )
+        self.late = receive_stock(
+            self.inventory, Decimal('10'), batch_no='LATE', batch_date=date(2026, 2, 1), expiry_date=date(2026, 6, 30),
+        )
+
+    def issue(self, quantity, **kwargs):
+        with transaction.atomic():
+            return issue_stock(
+                self.inventory, Decimal(quantity), transaction_type='production_out', operator=self.user, **kwargs,
+            )
+
+    def allocated(self, result):
+        return [(batch.batch_no, quantity) for batch, quantity in result.lines]
+
+    def test_fifo(self):
+        result = self.issue(12, strategy=STRATEGY_FIFO)
+        self.assertEqual(self.allocated(result), [('EARLY', 10), ('LATE', 2)])
+        self.assertEqual(Batch.objects.get(pk=self.early.pk).quantity, Decimal('0'))
+        self.assertEqual(Batch.objects.get(pk=self.late.pk).quantity, Decimal('8'))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('8'))
+        self.assertEqual(len(result.transactions), 2)
+
+    def test_fefo(self):
+        result = self.issue(12, strategy=STRATEGY_FEFO)
+        self.assertEqual(self.allocated(result), [('LATE', 10), ('EARLY', 2)])
+
+    def test_pinned_batch_first(self):
+        result = self.issue(12, strategy=STRATEGY_PINNED, pinned={self.late.pk: 5})
+        self.assertEqual(self.allocated(result), [('EARLY', 7), ('LATE', 5)])
+
+    def test_shortfall_is_reported_not_issued(self):
+        result = self.issue(25)
+        self.assertEqual(result.shortfall, Decimal('5'))
+        self.assertEqual(result.issued_quantity, Decimal('20'))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('0'))
+
+    def test_reservations_respected_before_reserved_stock(self):
+        self.early.reserved_quantity = Decimal('8')
+        batches = [self.early, self.late]
+        lines, remaining = plan_allocation(batches, Decimal('12'), respect_reservations=True)
+        self.assertEqual([(batch.batch_no, quantity) for batch, quantity in lines], [('EARLY', 2), ('LATE', 10)])
+        self.assertEqual(remaining, 0)
+        # 本单自己的预占可以使用
+        lines, _remaining = plan_allocation(
+            batches, Decimal('12'), own_reserved={self.early.pk: Decimal('8')}, respect_reservations=True,
+        )
+        self.assertEqual([(batch.batch_no, quantity) for batch, quantity in lines], [('EARLY', 10), ('LATE', 2)])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            self.issue(1, strategy='lifo')
+
+
+class QuantityMaintenanceTests(TestCase):
+    """库存总数量按差额维护：不回读批次，内存对象同步，每次变化发送 stock_changed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('keeper')
+        self.inventory = create_material_inventory(quantity=5)
+        self.changed = []
+        stock_changed.connect(self.on_stock_changed)
+        self.addCleanup(stock_changed.disconnect, self.on_stock_changed)
+
+    def on_stock_changed(self, sender, inventory, **kwargs):
+        self.changed.append(inventory.quantity)
+
+    def adjust(self, delta):
+        with transaction.atomic():
+            return adjust_stock(self.inventory, Decimal(delta), operator=self.user)
+
+    def test_adjust_without_batches_changes_header_only(self):
+        self.adjust(3)
+        self.adjust(-2)
+        self.assertEqual(self.inventory.quantity, Decimal('6'))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('6'))
+        self.assertFalse(Batch.objects.exists())
+        self.assertEqual(self.changed, [Decimal('8'), Decimal('6')])
+
+    def test_adjust_with_batches_keeps_batches_in_step(self):
+        receive_stock(self.inventory, Decimal('10'), batch_no='B1', batch_date=date(2026, 1, 1))
+        stock_transaction = self.adjust(4)
+        self.assertIsNotNone(stock_transaction.batch)
+        self.assertEqual(stock_transaction.batch.quantity, Decimal('4'))
+        self.adjust(-12)
+        self.inventory.refresh_from_db()
+        # 期初 5 未落到批次：批次先扣减 12，未落到批次的部分保持不变
+        self.assertEqual(self.inventory.quantity, Decimal('7'))
+        self.assertEqual(sum(Batch.objects.values_list('quantity', flat=True)), Decimal('2'))
+
+    def test_over_issue_goes_negative(self):
+        self.adjust(-8)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('-3'))
+
+    def test_stale_instance_does_not_overwrite(self):
+        """两个内存对象先后入库，数量按差额累加，不会用旧值覆盖"""
+        other = Inventory.objects.get(pk=self.inventory.pk)
+        receive_stock(self.inventory, Decimal('10'), batch_no='B1', batch_date=date(2026, 1, 1))
+        receive_stock(other, Decimal('10'), batch_no='B2', batch_date=date(2026, 1, 2))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('25'))
+
+
+class BOMCacheTests(TestCase):
+    """BOM缓存：命中时不查询，BOM变化提交后递增版本号使缓存失效"""
+
+    def setUp(self):
+        cache.clear()
+        bom_cache._local.__dict__.clear()
+        self.product = Product.objects.create(sku='P-BOM', name='砂浆', sale_price=Decimal('10'))
+        self.cement = Material.objects.create(sku='M-C', name='水泥', unit='kg')
+        self.sand = Material.objects.create(sku='M-S', name='砂', unit='kg')
+        with self.captureOnCommitCallbacks(execute=True):
+            BOM.objects.create(product=self.product, material=self.cement, quantity=Decimal('2'), unit='kg')
+
+    def exploded(self):
+        return {
+            material_id: quantity
+            for material_id, quantity, _unit in bom_cache.get_exploded_lines([self.product.pk])[self.product.pk]
+        }
+
+    def test_cache_hit_without_queries(self):
+        self.assertEqual(self.exploded(), {self.cement.pk: Decimal('2')})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.exploded(), {self.cement.pk: Decimal('2')})
+
+    def test_change_invalidates_after_commit(self):
+        self.exploded()
+        version = bom_cache.get_bom_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            line = BOM.objects.create(product=self.product, material=self.sand, quantity=Decimal('3'), unit='kg')
+            # 提交前版本号不变，其它进程不会按新版本号缓存未提交的数据
+            self.assertEqual(bom_cache.get_bom_version(), version)
+        self.assertTrue(callbacks)
+        self.assertGreater(bom_cache.get_bom_version(), version)
+        self.assertEqual(self.exploded(), {self.cement.pk: Decimal('2'), self.sand.pk: Decimal('3')})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            line.delete()
+        self.assertEqual(self.exploded(), {self.cement.pk: Decimal('2')})
+
+    def test_shared_cache_survives_process_cache_loss(self):
+        """进程内缓存丢失（其它进程）时从共享缓存读取，不查询数据库"""
+        self.exploded()
+        bom_cache._local.__dict__.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.exploded(), {self.cement.pk: Decimal('2')})
+
+
+class VerifyInventoryQuantitiesTests(TestCase):
+    """verify_inventory_quantities：库存总数量不少于批次数量合计"""
+
+    def setUp(self):
+        # 期初库存 100 未落到批次，之后采购入库一个批次 20
+        self.inventory = create_material_inventory(quantity=100)
+        receive_stock(self.inventory, Decimal('20'), batch_no='B1', batch_date=date(2026, 1, 1))
+
+    def verify(self, repair=False):
+        out = StringIO()
+        call_command('verify_inventory_quantities', repair=repair, stdout=out)
+        return out.getvalue()
+
+    def test_unbatched_opening_stock_is_not_drift(self):
+        self.assertIn('库存总数量均不少于批次数量合计', self.verify(repair=True))
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('120'))
+
+    def test_repair_shortfall_sends_stock_changed(self):
+        Inventory.objects.filter(pk=self.inventory.pk).update(quantity=5)
+        changed = []
+
+        def receiver(sender, inventory, **kwargs):
+            changed.append((inventory.pk, inventory.quantity))
+
+        stock_changed.connect(receiver)
+        try:
+            output = self.verify(repair=True)
+        finally:
+            stock_changed.disconnect(receiver)
+        self.assertIn('已修复 1 个库存的总数量', output)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('20'))
+        self.assertEqual(changed, [(self.inventory.pk, Decimal('20'))])
+
+    def test_report_only_does_not_modify(self):
+        Inventory.objects.filter(pk=self.inventory.pk).update(quantity=5)
+        self.assertIn('未修改', self.verify())
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, Decimal('5'))
+
+
+@override_settings(DOCUMENT_NUMBER_BLOCK_SIZE=20)
+class NumberingTests(TestCase):
+    """单据编号：号段预留与事务"""
+
+    def setUp(self):
+        numbering._blocks.clear()
+        numbering._pending_blocks().clear()
+        self.addCleanup(numbering._blocks.clear)
+        self.addCleanup(numbering._pending_blocks().clear)
+        self.today = timezone.localdate()
+
+    def number(self, value):
+        return numbering.format_number('SO', self.today, value)
+
+    def last_value(self):
+        return DocumentSequence.objects.get(prefix='SO', date=self.today).last_value
+
+    def test_one_block_per_transaction(self):
+        """同一事务中连续取号只预留一次号段"""
+        with transaction.atomic():
+            self.assertEqual(numbering.next_number('SO'), self.number(1))
+            with self.assertNumQueries(0):
+                self.assertEqual(numbering.next_number('SO'), self.number(2))
+                self.assertEqual(numbering.next_number('SO'), self.number(3))
+        self.assertEqual(self.last_value(), 20)
+
+    def test_leftover_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                numbering.next_number('SO')
+                numbering.next_number('SO')
+        self.assertEqual(numbering._blocks[('SO', self.today)], [3, 20])
+        with self.assertNumQueries(0):
+            self.assertEqual(numbering.next_number('SO'), self.number(3))
+
+    def test_rollback_discards_reserved_block(self):
+        """预留号段的保存点回滚后，计数器回滚，剩余号段不再使用"""
+        try:
+            with transaction.atomic():
+                self.assertEqual(numbering.next_number('SO'), self.number(1))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(DocumentSequence.objects.filter(prefix='SO', date=self.today).exists())
+        self.assertEqual(numbering.next_number('SO'), self.number(1))
+        self.assertEqual(numbering.next_number('SO'), self.number(2))
+        self.assertEqual(self.last_value(), 20)
+
+
+class SearchIndexTests(TestCase):
+    """搜索索引：保存、删除时维护检索键"""
+
+    def setUp(self):
+        self.product = Product.objects.create(sku='PC-425', name='普通水泥 P.O 42.5', sale_price=Decimal('400'))
+
+    def found(self, query):
+        return [item['id'] for item in search_index.search(query, kinds=['product'])]
+
+    def test_prefix_inner_and_code_match(self):
+        self.assertEqual(self.found('普通'), [self.product.pk])
+        self.assertEqual(self.found('水泥'), [self.product.pk])
+        self.assertEqual(self.found('pc425'), [self.product.pk])
+        self.assertEqual(self.found('砂浆'), [])
+
+    def test_save_and_delete_update_index(self):
+        self.product.name = '白水泥'
+        self.product.save()
+        self.assertEqual(self.found('普通'), [])
+        self.assertEqual(self.found('白水泥'), [self.product.pk])
+        self.product.delete()
+        self.assertEqual(self.found('白水泥'), [])
+
+    @skipUnless(search_index.lazy_pinyin, '未安装 pypinyin')
+    def test_pinyin_initials(self):
+        self.assertEqual(self.found('ptsn'), [self.product.pk])
+        self.assertEqual(self.found('putong'), [self.product.pk])
@@ -6,6 +6,8 @@ app_name = 'inventory'
 urlpatterns = [
     path('', views.inventory_list, name='inventory_list'),
     path('transactions/', views.stock_transactions, name='stock_transactions'),
+    path('stock-health/api/', views.stock_health_api, name='stock_health_api'),
+    path('search/', views.search_api, name='search_api'),
     path('<int:pk>/', views.inventory_detail, name='inventory_detail'),
     path('customers/', views.customer_list, name='customer_list'),
     path('customers/create/', views.customer_create, name='customer_create'),
@@ -0,0 +1,121 @@
+"""
+库存估值
+
+在数据库中按指定计价基准一次聚合出库存总金额及分类金额，不再逐行读取库存、成品、原料。
+
+计价基准：
+- standard: 基础单价（成品、原料的 unit_price）
+- sale: 成品按售价、原料按基础单价
+- batch_cost: 在库批次按批次单价（Batch.unit_price）计价，批次未填单价或库存数量未落到批次的部分按基础单价计价
+- book: 成本核算维护的账面成本（Inventory.cost_value，见 inventory.costing）
+"""
+from decimal import Decimal
+
+from django.db.models import Case, CharField, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Batch, Inventory
+
+
+BASIS_STANDARD = 'standard'
+BASIS_SALE = 'sale'
+BASIS_BATCH_COST = 'batch_cost'
+BASIS_BOOK = 'book'
+
+BASIS_CHOICES = [
+    (BASIS_STANDARD, '基础单价'),
+    (BASIS_SALE, '售价'),
+    (BASIS_BATCH_COST, '批次成本'),
+    (BASIS_BOOK, '账面成本'),
+]
+
+VALUE_FIELD = DecimalField(max_digits=20, decimal_places=4)
+
+ZERO = Value(Decimal('0'), output_field=VALUE_FIELD)
+
+
+def _unit_price_expression(basis, prefix=''):
+    """库存对应物品的单价表达式，prefix 为从查询模型到 Inventory 的路径（如 'inventory__'）"""
+    product_price = 'sale_price' if basis == BASIS_SALE else 'unit_price'
+    return Case(
+        When(**{f'{prefix}inventory_type': 'product', 'then': F(f'{prefix}product__{product_price}')}),
+        When(**{f'{prefix}inventory_type': 'material', 'then': F(f'{prefix}material__unit_price')}),
+        default=ZERO,
+        output_field=VALUE_FIELD,
+    )
+
+
+def _category_expression():
+    """库存对应物品的分类名称表达式"""
+    return Coalesce(
+        Case(
+            When(inventory_type='product', then=F('product__category__name')),
+            When(inventory_type='material', then=F('material__category__name')),
+            output_field=CharField(),
+        ),
+        Value('未分类'),
+    )
+
+
+def annotate_stock_value(queryset, basis=BASIS_STANDARD):
+    """为库存查询集加上 stock_value（库存金额）注解"""
+    if basis not in dict(BASIS_CHOICES):
+        raise ValueError(f'未知的计价基准: {basis}')
+
+    if basis == BASIS_BOOK:
+        queryset = queryset.annotate(stock_value=F('cost_value'))
+    elif basis == BASIS_BATCH_COST:
+        # 在库批次按批次单价（缺省回退基础单价）计价；库存数量中未落到批次的部分按基础单价计价
+        live_batches = Batch.objects.filter(inventory=OuterRef('pk'), quantity__gt=0).values('inventory')
+        batch_value = live_batches.annotate(
+            value=Sum(F('quantity') * Coalesce(
+                F('unit_price'), _unit_price_expression(BASIS_STANDARD, 'inventory__'), output_field=VALUE_FIELD
+            ), output_field=VALUE_FIELD),
+        ).values('value')
+        batch_quantity = live_batches.annotate(total=Sum('quantity')).values('total')
+        queryset = queryset.annotate(
+            batch_value=Coalesce(Subquery(batch_value, output_field=VALUE_FIELD), ZERO),
+            batch_quantity=Coalesce(Subquery(batch_quantity, output_field=VALUE_FIELD), ZERO),
+        ).annotate(
+            stock_value=F('batch_value') + Greatest(F('quantity') - F('batch_quantity'), ZERO) * _unit_price_expression(BASIS_STANDARD),
+        )
+    else:
+        queryset = queryset.annotate(
+            stock_value=F('quantity') * _unit_price_expression(basis),
+        )
+    return queryset
+
+
+def stock_valuation(basis=BASIS_STANDARD, queryset=None):
+    """库存总金额及按库存类型（成品/原料/其它）的金额，一次聚合查询
+
+    queryset: 需要估值的库存范围（如呆滞库存），默认全部库存
+    返回 {'total': Decimal, 'product': Decimal, 'material': Decimal, 'other': Decimal}
+    """
+    queryset = annotate_stock_value(Inventory.objects.all() if queryset is None else queryset, basis)
+    aggregates = {'total': Sum('stock_value', output_field=VALUE_FIELD)}
+    for inventory_type, _label in Inventory.INVENTORY_TYPE_CHOICES:
+        aggregates[inventory_type] = Sum(
+            'stock_value',
+            filter=Q(inventory_type=inventory_type),
+            output_field=VALUE_FIELD,
+        )
+    result = queryset.aggregate(**aggregates)
+    return {key: value or Decimal('0') for key, value in result.items()}
+
+
+def stock_value_by_category(basis=BASIS_STANDARD, queryset=None):
+    """按库存类型 + 物品分类汇总库存金额，一次分组查询
+
+    返回 [{'inventory_type', 'category', 'value'}, ...]，按金额从高到低排序
+    """
+    queryset = annotate_stock_value(Inventory.objects.all() if queryset is None else queryset, basis)
+    rows = queryset.annotate(
+        category=_category_expression(),
+    ).values('inventory_type', 'category').annotate(
+        value=Sum('stock_value', output_field=VALUE_FIELD),
+    ).order_by('-value')
+    return [
+        {'inventory_type': row['inventory_type'], 'category': row['category'], 'value': row['value'] or Decimal('0')}
+        for row in rows
+    ]
@@ -1,13 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
 from django.db import transaction
 from django.utils import timezone
 from django.core.paginator import Paginator
 from decimal import Decimal
-from accounts.decorators import role_required, permission_required, role_or_permission_required
-from .models import Inventory, StockTransaction, Product, Material, Customer, ProductCategory, MaterialCategory, InventoryAdjustmentRequest, BOM, CustomerTransfer, CustomerTransfer
+from accounts.decorators import role_required, permission_required, role_or_permission_required, session_readonly
+from .models import Inventory, StockTransaction, Product, Material, Customer, ProductCategory, MaterialCategory, InventoryAdjustmentRequest, BOM, CustomerTransfer, CustomerTransfer, live_batches_prefetch
+from .allocation import adjust_stock
+from .ledger import ledger_queryset, paginate_ledger
+from .numbering import next_number, PREFIX_ADJUSTMENT_REQUEST
+from .valuation import stock_valuation
+from . import search_index
+from .stock_health import below_safety_stock, negative_stock, requisition_shortages
 
 
 @login_required
@@ -16,121 +22,16 @@ def inventory_list(request):
     """库存列表"""
     inventory_type = request.GET.get('type', '')
     
-    # 合并两类记录，创建一个统一的记录列表
-    all_records = []
-    
-    # 添加库存变动记录（排除调整类型，因为调整记录会单独处理）
-    stock_transactions = StockTransaction.objects.filter(
-        ~Q(transaction_type='adjustment')
-    ).select_related('inventory', 'operator').order_by('-created_at')
-    
-    for trans in stock_transactions:
-        # 根据transaction_type判断是入库还是出库
-        # 出库类型：sale_out, production_out 显示负数
-        # 入库类型：production_in, purchase_in 显示正数
-        if trans.transaction_type in ['sale_out', 'production_out']:
-            display_quantity = -trans.quantity  # 出库显示负数
-        else:
-            display_quantity = trans.quantity  # 入库显示正数
-        
-        # 获取物品名称
-        if trans.inventory.inventory_type == 'product':
-            item_name = trans.inventory.product.name if trans.inventory.product else '-'
-        elif trans.inventory.inventory_type == 'material':
-            item_name = trans.inventory.material.name if trans.inventory.material else '-'
-        elif trans.inventory.inventory_type == 'other':
-            item_name = trans.inventory.other_name if trans.inventory.other_name else '-'
-        else:
-            item_name = '-'
-        
-        all_records.append({
-            'type': 'transaction',
-            'record_type': '出入库',
-            'transaction_type': trans.get_transaction_type_display(),
-            'item_name': item_name,
-            'item_type': trans.inventory.get_inventory_type_display(),
-            'quantity': display_quantity,  # 使用带符号的数量
-            'unit': trans.unit,
-            'reference_no': trans.reference_no,
-            'operator': trans.operator.username,
-            'created_at': trans.created_at,
-            'remark': trans.remark,
-        })
-    
-    # 添加库存调整记录（从StockTransaction中获取，因为已经记录了价格变动）
-    adjustment_transactions = StockTransaction.objects.filter(
-        transaction_type='adjustment'
-    ).select_related('inventory', 'operator').order_by('-created_at')
-    
-    for trans in adjustment_transactions:
-        # 查找对应的调整申请以获取详细信息
-        try:
-            adj = InventoryAdjustmentRequest.objects.get(request_no=trans.reference_no)
-            # 获取物品名称
-            if trans.inventory.inventory_type == 'product':
-                item_name = trans.inventory.product.name if trans.inventory.product else '-'
-            elif trans.inventory.inventory_type == 'material':
-                item_name = trans.inventory.material.name if trans.inventory.material else '-'
-            elif trans.inventory.inventory_type == 'other':
-                item_name = trans.inventory.other_name if trans.inventory.other_name else '-'
-            else:
-                item_name = '-'
-            
-            all_records.append({
-                'type': 'adjustment',
-                'record_type': '库存调整',
-                'transaction_type': '库存调整',
-                'item_name': item_name,
-                'item_type': trans.inventory.get_inventory_type_display(),
-                'quantity': trans.quantity,
-                'unit': trans.unit,
-                'reference_no': trans.reference_no,
-                'operator': trans.operator.username,
-                'created_at': trans.created_at,
-                'remark': trans.remark,
-                'old_unit_price': trans.old_unit_price,
-                'new_unit_price': trans.new_unit_price,
-                'current_quantity': adj.current_quantity if hasattr(adj, 'current_quantity') else None,
-                'new_quantity': adj.new_quantity if hasattr(adj, 'new_quantity') else None,
-            })
-        except InventoryAdjustmentRequest.DoesNotExist:
-            # 如果找不到对应的调整申请，仍然显示记录
-            # 获取物品名称
-            if trans.inventory.inventory_type == 'product':
-                item_name = trans.inventory.product.name if trans.inventory.product else '-'
-            elif trans.inventory.inventory_type == 'material':
-                item_name = trans.inventory.material.name if trans.inventory.material else '-'
-            elif trans.inventory.inventory_type == 'other':
-                item_name = trans.inventory.other_name if trans.inventory.other_name else '-'
-            else:
-                item_name = '-'
-            
-            all_records.append({
-                'type': 'adjustment',
-                'record_type': '库存调整',
-                'transaction_type': '库存调整',
-                'item_name': item_name,
-                'item_type': trans.inventory.get_inventory_type_display(),
-                'quantity': trans.quantity,
-                'unit': trans.unit,
-                'reference_no': trans.reference_no,
-                'operator': trans.operator.username,
-                'created_at': trans.created_at,
-                'remark': trans.remark,
-                'old_unit_price': trans.old_unit_price,
-                'new_unit_price': trans.new_unit_price,
-            })
-    
-    # 按时间倒序排序
-    all_records.sort(key=lambda x: x['created_at'], reverse=True)
-    
-    # 分页处理
-    paginator = Paginator(all_records, 20)  # 每页20条记录
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # 库存记录（出入库 + 库存调整）：数据库中合并排序，按 (created_at, id) 游标分页
+    ledger_page = paginate_ledger(
+        ledger_queryset(),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        page_size=20,  # 每页20条记录
+    )
     
     # 获取库存列表
-    inventories = Inventory.objects.select_related('product', 'material').prefetch_related('batches').all()
+    inventories = Inventory.objects.select_related('product', 'material').prefetch_related(live_batches_prefetch()).all()
     
     if inventory_type == 'product':
         inventories = inventories.filter(inventory_type='product')
@@ -139,10 +40,6 @@ def inventory_list(request):
     elif inventory_type == 'other':
         inventories = inventories.filter(inventory_type='other')
     
-    # 为每个库存获取批次信息
-    for inv in inventories:
-        inv.batches_list = inv.get_batches().filter(quantity__gt=0)
-    
     # 为每个库存查询是否有待审批的调整申请
     # 只对总经理显示审批选项
     can_approve = request.user.profile.role == 'ceo' or request.user.profile.has_permission('inventory.adjustment.approve')
@@ -157,15 +54,18 @@ def inventory_list(request):
                 pending_adjustments[inv_id] = []
             pending_adjustments[inv_id].append(adj)
     
-    # 将待审批的调整申请信息附加到每个库存对象上，并获取批次信息
+    # 当前筛选范围内的库存总价值（按基础单价，与列表中每行的总价值一致）
+    inventory_valuation = stock_valuation(queryset=inventories)
+    
+    # 将待审批的调整申请信息附加到每个库存对象上（在库批次已通过预加载一次查询）
     inventories_list = list(inventories)
     for inv in inventories_list:
         inv.pending_adjustments = pending_adjustments.get(inv.pk, [])
-        inv.batches_list = inv.get_batches().filter(quantity__gt=0)
     
     context = {
-        'page_obj': page_obj,  # 分页的记录
+        'ledger_page': ledger_page,  # 分页的记录
         'inventories': inventories_list,
+        'inventory_valuation': inventory_valuation,
         'inventory_type': inventory_type,
         'can_approve': can_approve,
     }
@@ -189,6 +89,81 @@ def stock_transactions(request):
     return render(request, 'inventory/stock_transactions.html', context)
 
 
+@session_readonly
+@login_required
+@role_or_permission_required('warehouse', 'production', 'ceo', permission_code='inventory.view')
+def stock_health_api(request):
+    """库存健康状况API：低于安全库存、领料缺料、负库存"""
+    def inventory_data(inv):
+        item = inv.get_item()
+        return {
+            'inventory_id': inv.pk,
+            'inventory_type': inv.inventory_type,
+            'name': item.name if item else inv.other_name,
+            'quantity': float(inv.quantity),
+            'unit': inv.unit,
+        }
+    
+    low_stock = []
+    for inv in below_safety_stock(inventory_type=request.GET.get('type', 'material')):
+        data = inventory_data(inv)
+        data['safety_stock'] = float(inv.safety_stock)
+        low_stock.append(data)
+    
+    shortages = [
+        {
+            'material_id': material.pk,
+            'sku': material.sku,
+            'name': material.name,
+            'unit': material.unit,
+            'required': float(material.required),
+            'available': float(material.available),
+            'shortage': float(material.shortage),
+        }
+        for material in requisition_shortages()
+    ]
+    
+    return JsonResponse({
+        'low_stock': low_stock,
+        'requisition_shortages': shortages,
+        'negative_stock': [inventory_data(inv) for inv in negative_stock()],
+    })
+
+
+@session_readonly
+@login_required
+def search_api(request):
+    """联想搜索API：按名称、SKU、联系人、电话及拼音前缀检索成品、原料、客户、供应商
+
+    参数 q 为关键字，kind 为逗号分隔的类型（默认成品和原料），limit 为返回条数（最多50）
+    """
+    query = request.GET.get('q', '').strip()
+    kinds = [kind for kind in request.GET.get('kind', 'product,material').split(',') if kind in search_index.SOURCES]
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    
+    profile = request.user.profile
+    if 'supplier' in kinds and profile.role not in ['warehouse', 'ceo']:
+        kinds.remove('supplier')
+    if 'customer' in kinds and profile.role not in ['sales', 'sales_mgr', 'ceo'] \
+            and not profile.has_permission('inventory.customer.view'):
+        kinds.remove('customer')
+    if not query or not kinds:
+        return JsonResponse({'results': []})
+    
+    results = search_index.search(query, kinds=kinds, limit=limit)
+    # 客户按可见范围过滤
+    customer_ids = [item['id'] for item in results if item['kind'] == 'customer']
+    if customer_ids:
+        visible = set(
+            _visible_customers(request.user, Customer.objects.filter(pk__in=customer_ids)).values_list('pk', flat=True)
+        )
+        results = [item for item in results if item['kind'] != 'customer' or item['id'] in visible]
+    return JsonResponse({'results': results})
+
+
 @login_required
 @role_or_permission_required('warehouse', 'production', 'ceo', permission_code='inventory.view')
 def inventory_detail(request, pk):
@@ -205,8 +180,8 @@ def inventory_detail(request, pk):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    # 获取批次信息
-    batches = inventory.get_batches().order_by('-batch_date', '-created_at')
+    # 获取批次信息（包括已用完的历史批次，一次查询加载）
+    batches = list(inventory.get_batches().order_by('-batch_date', '-created_at'))
     
     context = {
         'inventory': inventory,
@@ -216,29 +191,25 @@ def inventory_detail(request, pk):
     return render(request, 'inventory/inventory_detail.html', context)
 
 
+def _visible_customers(user, customers):
+    """按角色限制可见的客户"""
+    # 销售经理和总经理可以看到所有客户
+    if user.profile.role in ['sales_mgr', 'ceo'] or user.profile.has_permission('inventory.customer.manage'):
+        return customers
+    # 销售员及其他有查看权限的角色（如仓库管理员）只能看到自己负责的客户
+    return customers.filter(created_by=user)
+
+
 @login_required
 @role_or_permission_required('sales', 'sales_mgr', 'ceo', permission_code='inventory.customer.view')
 def customer_list(request):
     """客户列表"""
-    customers = Customer.objects.select_related('created_by').all()
-    
-    # 权限控制：销售员只能看到自己负责的客户
-    if request.user.profile.role == 'sales' and not request.user.profile.has_permission('inventory.customer.manage'):
-        customers = customers.filter(created_by=request.user)
-    # 销售经理和总经理可以看到所有客户
-    elif request.user.profile.role in ['sales_mgr', 'ceo'] or request.user.profile.has_permission('inventory.customer.manage'):
-        pass  # 显示所有客户
-    # 其他角色（如仓库管理员）如果有查看权限，也只能看到自己负责的
-    elif not request.user.profile.has_permission('inventory.customer.manage'):
-        customers = customers.filter(created_by=request.user)
+    customers = _visible_customers(request.user, Customer.objects.select_related('created_by').all())
     
     search = request.GET.get('search', '')
     if search:
-        customers = customers.filter(
-            Q(name__icontains=search) | 
-            Q(contact_person__icontains=search) |
-            Q(phone__icontains=search)
-        )
+        # 按搜索索引前缀匹配（名称、联系人、电话，含拼音和拼音首字母）
+        customers = customers.filter(pk__in=search_index.matching_ids('customer', search))
     
     # 分页处理
     paginator = Paginator(customers, 20)  # 每页20条
@@ -634,10 +605,7 @@ def product_list(request):
     
     search = request.GET.get('search', '')
     if search:
-        products = products.filter(
-            Q(sku__icontains=search) | 
-            Q(name__icontains=search)
-        )
+        products = products.filter(pk__in=search_index.matching_ids('product', search))
     
     # 分页处理
     paginator = Paginator(products, 20)  # 每页20条
@@ -727,7 +695,7 @@ def inventory_adjustment_create(request, inventory_pk):
             adjustment.current_quantity = inventory.quantity
             adjustment.current_unit_price = inventory.get_unit_price()
             adjustment.applicant = request.user
-            adjustment.request_no = f"IAR{timezone.now().strftime('%Y%m%d%H%M%S')}"
+            adjustment.request_no = next_number(PREFIX_ADJUSTMENT_REQUEST)
             
             # 根据调整类型处理数量和单价
             adjustment_type = form.cleaned_data.get('adjustment_type')
@@ -820,10 +788,7 @@ def adjustment_approve(request, pk):
                 adjustment.approved_at = timezone.now()
                 adjustment.save()
                 
-                # 执行库存调整
                 inventory = adjustment.inventory
-                inventory.quantity = adjustment.new_quantity
-                inventory.save()
                 
                 # 执行单价调整（如果调整了单价）
                 price_adjusted = False
@@ -834,21 +799,21 @@ def adjustment_approve(request, pk):
                         item.save()
                         price_adjusted = True
                 
-                # 创建库存变动记录
+                # 执行库存调整并创建库存变动记录：按调整数量增减（同步增减批次），
+                # 不直接写入申请时的新数量，避免覆盖申请后发生的出入库
                 remark_parts = [f"库存调整：{adjustment.reason}"]
                 if price_adjusted:
                     remark_parts.append(f"单价从¥{adjustment.current_unit_price}调整为¥{adjustment.new_unit_price}")
                 
-                StockTransaction.objects.create(
-                    transaction_type='adjustment',
-                    inventory=inventory,
-                    quantity=adjustment.adjust_quantity,
-                    unit=inventory.unit,
-                    old_unit_price=adjustment.current_unit_price if price_adjusted else None,
-                    new_unit_price=adjustment.new_unit_price if price_adjusted else None,
+                adjust_stock(
+                    inventory,
+                    adjustment.adjust_quantity,
+                    operator=request.user,
                     reference_no=adjustment.request_no,
                     remark="；".join(remark_parts),
-                    operator=request.user,
+                    old_unit_price=adjustment.current_unit_price if price_adjusted else None,
+                    new_unit_price=adjustment.new_unit_price if price_adjusted else None,
+                    adjustment_request=adjustment,
                 )
                 
                 adjustment.status = 'completed'
@@ -881,7 +846,7 @@ def adjustment_approve(request, pk):
 @role_or_permission_required('production', 'ceo', permission_code='inventory.bom.view')
 def bom_list(request):
     """BOM配方列表"""
-    boms = BOM.objects.select_related('product', 'material').all()
+    boms = BOM.objects.select_related('product', 'material', 'component_product').all()
     
     # 按产品筛选
     product_filter = request.GET.get('product', '')
@@ -7,7 +7,8 @@ from django.core.paginator import Paginator
 from accounts.decorators import role_required
 from .models import Shipment, Driver, Vehicle, ShipmentImage
 from sales.models import ShippingNotice, SalesOrder
-from inventory.models import Inventory, StockTransaction
+from inventory.models import Inventory, live_batches_prefetch
+from inventory.numbering import next_number, PREFIX_SHIPMENT
 
 
 @login_required
@@ -89,7 +90,7 @@ def shipment_create(request, notice_pk):
         
         with transaction.atomic():
             shipment = Shipment.objects.create(
-                shipment_no=f"SH{timezone.now().strftime('%Y%m%d%H%M%S')}",
+                shipment_no=next_number(PREFIX_SHIPMENT),
                 shipping_notice=notice,
                 order=notice.order,
                 driver=driver,
@@ -140,26 +141,36 @@ def shipment_ship(request, pk):
     
     if request.method == 'POST':
         with transaction.atomic():
-            from inventory.models import Batch
             from sales.models import SalesOrderItemBatch
-            from decimal import Decimal
-            # 扣减成品库存（按批次）
-            for item in shipment.order.items.all():
-                inventory = Inventory.objects.get(inventory_type='product', product=item.product)
-                remaining_qty = item.quantity
+            from decimal import Decimal, InvalidOperation
+            from inventory.allocation import issue_stock
+            from sales.reservations import is_reserving
+            order_items = list(shipment.order.items.select_related('product'))
+            order_reserving = is_reserving(shipment.order.reserve_inventory, shipment.order.status)
+            # 一次查询加载订单涉及的成品库存及其在库批次
+            product_inventories = {
+                inv.product_id: inv
+                for inv in Inventory.objects.filter(
+                    inventory_type='product',
+                    product_id__in=[item.product_id for item in order_items],
+                ).prefetch_related(live_batches_prefetch())
+            }
+            # 扣减成品库存（按批次）：订单/表单指定的批次优先，其余按出库策略自动分配
+            allocations_by_item = {}
+            for order_batch in SalesOrderItemBatch.objects.filter(order_item__order=shipment.order):
+                allocations_by_item.setdefault(order_batch.order_item_id, {})[order_batch.batch_id] = order_batch.quantity
+            shortages = []
+            for item in order_items:
+                inventory = product_inventories.get(item.product_id)
+                if inventory is None:
+                    raise Inventory.DoesNotExist(f'产品 {item.product.name} 没有库存记录')
                 
-                # 首先从订单中获取已保存的批次分配作为默认值
-                batch_allocations = {}
-                order_batch_allocations = SalesOrderItemBatch.objects.filter(order_item=item)
-                for order_batch in order_batch_allocations:
-                    if order_batch.batch.quantity > 0:
-                        # 使用订单中保存的分配数量，但不超过当前可用数量
-                        allocate_qty = min(order_batch.quantity, order_batch.batch.quantity)
-                        if allocate_qty > 0:
-                            batch_allocations[order_batch.batch.id] = allocate_qty
+                # 首先使用订单中已保存的批次分配作为默认值
+                order_batch_allocations = allocations_by_item.get(item.pk, {})
+                pinned = dict(order_batch_allocations)
                 
                 # 然后从表单获取用户调整后的数量（以订单分配为指导，但允许调整）
-                for batch in inventory.get_batches().filter(quantity__gt=0).order_by('batch_date', 'created_at'):
+                for batch in inventory.get_live_batches():
                     batch_qty_key = f'batch_quantity_{item.product.id}_{batch.id}'
                     batch_qty_str = request.POST.get(batch_qty_key, '')
                     if batch_qty_str:
@@ -167,45 +178,31 @@ def shipment_ship(request, pk):
                             batch_qty = Decimal(batch_qty_str)
                             if batch_qty > 0 and batch_qty <= batch.quantity:
                                 # 使用表单中提交的数量（用户可能调整了订单中的分配）
-                                batch_allocations[batch.id] = batch_qty
-                        except:
+                                pinned[batch.id] = batch_qty
+                        except InvalidOperation:
                             pass
                 
-                # 重新计算已分配总量
-                total_allocated = sum(batch_allocations.values())
-                remaining_qty = item.quantity - total_allocated
-                
-                # 如果仍然不足，使用FIFO自动分配
-                if remaining_qty > 0:
-                    for batch in inventory.get_batches().filter(quantity__gt=0).order_by('batch_date', 'created_at'):
-                        if remaining_qty <= 0:
-                            break
-                        available = batch.quantity - batch_allocations.get(batch.id, 0)
-                        if available > 0:
-                            allocate_qty = min(remaining_qty, available)
-                            batch_allocations[batch.id] = batch_allocations.get(batch.id, 0) + allocate_qty
-                            remaining_qty -= allocate_qty
-                
-                # 按批次扣减库存
-                for batch_id, batch_qty in batch_allocations.items():
-                    if batch_qty > 0:
-                        batch = Batch.objects.get(pk=batch_id)
-                        batch.quantity -= batch_qty
-                        batch.save()
-                
-                # 记录库存变动
-                StockTransaction.objects.create(
+                # 仍然不足时自动分配：先用未被其它订单预占的数量，仍不足再动用其余在库数量
+                result = issue_stock(
+                    inventory,
+                    item.quantity,
                     transaction_type='sale_out',
-                    inventory=inventory,
-                            batch=batch,
-                            quantity=batch_qty,
-                    unit=item.product.unit,
-                    reference_no=shipment.shipment_no,
                     operator=request.user,
+                    reference_no=shipment.shipment_no,
+                    unit=item.product.unit,
+                    pinned=pinned,
+                    own_reserved=order_batch_allocations if order_reserving else None,
+                    respect_reservations=True,
+                    allow_unbatched=True,
                 )
-                
-                # 更新库存总数量
-                inventory.update_quantity_from_batches()
+                if result.shortfall > 0:
+                    shortages.append(f'{item.product.name} 缺 {result.shortfall}{item.product.unit}')
+            
+            if shortages:
+                # 库存不足时整体回滚，不做部分发货
+                transaction.set_rollback(True)
+                messages.error(request, f'成品库存不足，无法发货：{"；".join(shortages)}')
+                return redirect('logistics:shipment_ship', pk=pk)
             
             shipment.status = 'shipped'
             shipment.shipped_at = timezone.now()
@@ -224,17 +221,26 @@ def shipment_ship(request, pk):
     # 获取每个产品的可用批次，构建更友好的数据结构
     from sales.models import SalesOrderItemBatch
     order_items_with_batches = []
-    for item in shipment.order.items.all():
-        try:
-            inventory = Inventory.objects.get(inventory_type='product', product=item.product)
-            batches = inventory.get_batches().filter(quantity__gt=0).order_by('batch_date', 'created_at')
-        except Inventory.DoesNotExist:
-            batches = []
+    order_items = list(shipment.order.items.select_related('product'))
+    # 一次查询加载订单涉及的成品库存及其在库批次
+    product_inventories = {
+        inv.product_id: inv
+        for inv in Inventory.objects.filter(
+            inventory_type='product',
+            product_id__in=[item.product_id for item in order_items],
+        ).prefetch_related(live_batches_prefetch())
+    }
+    # 一次查询加载订单中已保存的批次分配
+    allocations_by_item = {}
+    for order_batch in SalesOrderItemBatch.objects.filter(order_item__order=shipment.order):
+        allocations_by_item.setdefault(order_batch.order_item_id, {})[order_batch.batch_id] = float(order_batch.quantity)
+    
+    for item in order_items:
+        inventory = product_inventories.get(item.product_id)
+        batches = inventory.get_live_batches() if inventory else []
         
         # 获取订单中已保存的批次分配
-        order_batch_allocations = {}
-        for order_batch in SalesOrderItemBatch.objects.filter(order_item=item):
-            order_batch_allocations[order_batch.batch.id] = float(order_batch.quantity)
+        order_batch_allocations = allocations_by_item.get(item.pk, {})
         
         order_items_with_batches.append({
             'item': item,
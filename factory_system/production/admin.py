@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ProductionTask, MaterialRequisition, MaterialRequisitionItem, QCRecord, FinishedProductInbound
+from .models import ProductionTask, MaterialRequisition, MaterialRequisitionItem, QCRecord, FinishedProductInbound, TaskMaterialBlock
 
 
 class MaterialRequisitionItemInline(admin.TabularInline):
@@ -31,3 +31,10 @@ class QCRecordAdmin(admin.ModelAdmin):
 class FinishedProductInboundAdmin(admin.ModelAdmin):
     list_display = ['inbound_no', 'task', 'quantity', 'operator', 'created_at']
     list_filter = ['created_at']
+
+
+@admin.register(TaskMaterialBlock)
+class TaskMaterialBlockAdmin(admin.ModelAdmin):
+    list_display = ['task', 'material', 'shortage', 'created_at']
+    search_fields = ['task__task_no', 'material__name']
+    readonly_fields = ['task', 'material', 'shortage', 'created_at']
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProductionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'production'
+
+    def ready(self):
+        from . import signals  # noqa: F401 注册原料入库后释放原料不足任务的信号
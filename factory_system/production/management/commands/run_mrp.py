@@ -0,0 +1,54 @@
+"""
+MRP净需求计算命令：汇总全部未开工需求，输出原料净需求和可行任务
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from production.mrp import run_mrp, apply_task_statuses
+
+
+class Command(BaseCommand):
+    help = '按交付日期优先级计算全部未开工需求的原料净需求，可选按结果更新生产任务状态'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--apply',
+            action='store_true',
+            help='按计算结果更新任务状态（可行的原料不足任务改为待接收，不可行的待接收任务改为原料不足）',
+        )
+        parser.add_argument(
+            '--python',
+            action='store_true',
+            help='不使用 NumPy，按纯 Python 方式计算',
+        )
+
+    def handle(self, *args, **options):
+        result = run_mrp(use_numpy=False if options['python'] else None)
+
+        feasible = sum(1 for demand in result.demands if demand.feasible)
+        self.stdout.write(
+            f'需求 {len(result.demands)} 条，可行 {feasible} 条，'
+            f'计算方式 {result.engine}，耗时 {result.elapsed * 1000:.1f} ms'
+        )
+        for demand in result.demands:
+            if not demand.feasible:
+                kind = '生产任务' if demand.kind == 'task' else '订单缺口'
+                self.stdout.write(f'  不可行: {kind} {demand.number}（数量 {demand.quantity}）')
+
+        shortages = result.shortages
+        if shortages:
+            self.stdout.write('原料净需求：')
+            for plan in shortages:
+                self.stdout.write(
+                    f'  {plan.material.name}: 需求 {plan.required}，在库 {plan.on_hand}，'
+                    f'已承诺 {plan.committed}，净需求 {plan.net_requirement}{plan.material.unit}'
+                )
+        else:
+            self.stdout.write('原料充足，无净需求')
+
+        if options['apply']:
+            with transaction.atomic():
+                released, blocked = apply_task_statuses(result)
+            self.stdout.write(self.style.SUCCESS(f'已将 {released} 个任务改为待接收，{blocked} 个任务改为原料不足'))
+        else:
+            self.stdout.write(self.style.SUCCESS('计算完成（未更新任务状态，使用 --apply 更新）'))
@@ -0,0 +1,154 @@
+"""
+原料不足任务的缺料索引（TaskMaterialBlock）
+
+任务置为原料不足时记录缺哪些原料（block_tasks）；原料采购入库或库存调增后，
+只取出等待这些原料的任务，按优先级依次重新检查，原料齐套的任务批量改为待接收（release_tasks_for_materials）：
+- 优先级与MRP一致：交付日期（备货任务按计划完成日期，无日期的排最后），再按创建时间
+- 可用量 = 原料库存 - 待审核领料单未发数量 - 已是待接收的任务的需求（接收时才发料，先到先得），
+  前面的任务释放后占用的原料从可用量中扣除，不会把同一批原料重复分给多个任务
+- 仍不足的任务按本次检查结果重建缺料记录
+
+库存变动记录（StockTransaction）保存后由信号登记变动的原料，事务提交后合并处理一次（见 production.signals）。
+"""
+import threading
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+
+from accounts.dashboard import mark_dirty as mark_dashboard_dirty
+from accounts.status_counters import adjust_status
+from inventory.availability import material_quantities
+from inventory.bom_cache import get_exploded_lines
+
+from .models import ProductionTask, TaskMaterialBlock
+
+
+ZERO = Decimal('0')
+
+_pending = threading.local()
+
+
+def block_tasks(shortages_by_task):
+    """写入缺料记录 {task_id: {material_id: 缺口数量}}，覆盖这些任务原有的记录"""
+    if not shortages_by_task:
+        return
+    TaskMaterialBlock.objects.filter(task_id__in=shortages_by_task.keys()).delete()
+    TaskMaterialBlock.objects.bulk_create([
+        TaskMaterialBlock(task_id=task_id, material_id=material_id, shortage=shortage)
+        for task_id, shortages in shortages_by_task.items()
+        for material_id, shortage in shortages.items()
+    ])
+
+
+def block_task(task, availability):
+    """按齐套检查结果记录单个任务的缺料
+
+    availability: inventory.availability 的 AvailabilityResult 或 ProductRequirement，
+    其 shortages 中每项有 material 和 shortage
+    """
+    block_tasks({task.pk: {line.material.pk: line.shortage for line in availability.shortages}})
+
+
+def clear_blocks(task_ids):
+    """任务不再等待原料（已接收、终结等）时删除缺料记录"""
+    TaskMaterialBlock.objects.filter(task_id__in=task_ids).delete()
+
+
+def _priority(due_date, created_at, pk):
+    return (due_date is None, due_date or date.max, created_at, pk)
+
+
+def _requirements(rows):
+    """[(task_id, product_id, 数量)] -> {task_id: {material_id: 需求量}}"""
+    exploded = get_exploded_lines({product_id for _task_id, product_id, _quantity in rows})
+    requirements = {}
+    for task_id, product_id, quantity in rows:
+        needs = requirements[task_id] = {}
+        for material_id, bom_quantity, _unit in exploded.get(product_id, ()):
+            needs[material_id] = needs.get(material_id, ZERO) + bom_quantity * quantity
+    return requirements
+
+
+def release_tasks_for_materials(material_ids):
+    """重新检查等待这些原料的原料不足任务，齐套的批量改为待接收
+
+    返回改为待接收的任务ID列表（按优先级）
+    """
+    from .mrp import committed_quantities
+
+    material_ids = set(material_ids)
+    if not material_ids:
+        return []
+
+    with transaction.atomic():
+        candidates = list(
+            ProductionTask.objects.filter(
+                status='material_insufficient', material_blocks__material_id__in=material_ids,
+            ).distinct().values_list(
+                'pk', 'product_id', 'required_quantity', 'order__delivery_date', 'planned_completion_date', 'created_at',
+            )
+        )
+        if not candidates:
+            return []
+        candidates.sort(key=lambda row: _priority(row[3] or row[4], row[5], row[0]))
+
+        requirements = _requirements([(pk, product_id, quantity) for pk, product_id, quantity, *_rest in candidates])
+        involved = {material_id for needs in requirements.values() for material_id in needs}
+
+        # 已是待接收的任务先占用原料
+        pending_rows = ProductionTask.objects.filter(status='pending').values_list('pk', 'product_id', 'required_quantity')
+        claimed = {}
+        for needs in _requirements(list(pending_rows)).values():
+            for material_id, quantity in needs.items():
+                if material_id in involved:
+                    claimed[material_id] = claimed.get(material_id, ZERO) + quantity
+
+        on_hand = material_quantities(involved)
+        committed = committed_quantities()
+        available = {
+            material_id: on_hand.get(material_id, ZERO) - committed.get(material_id, ZERO) - claimed.get(material_id, ZERO)
+            for material_id in involved
+        }
+
+        released, still_blocked = [], {}
+        for pk, *_rest in candidates:
+            needs = requirements[pk]
+            shortages = {
+                material_id: quantity - available[material_id]
+                for material_id, quantity in needs.items() if quantity > available[material_id]
+            }
+            if shortages:
+                still_blocked[pk] = shortages
+                continue
+            for material_id, quantity in needs.items():
+                available[material_id] -= quantity
+            released.append(pk)
+
+        if released:
+            updated = ProductionTask.objects.filter(pk__in=released, status='material_insufficient').update(status='pending')
+            # 批量更新不触发模型信号，手动调整状态计数、标记仪表板（交期冲突预警包含待接收任务）
+            adjust_status('production.ProductionTask', 'material_insufficient', 'pending', updated)
+            mark_dashboard_dirty('alerts')
+            clear_blocks(released)
+        block_tasks(still_blocked)
+    return released
+
+
+def _flush():
+    material_ids = getattr(_pending, 'material_ids', None)
+    if material_ids:
+        _pending.material_ids = set()
+        release_tasks_for_materials(material_ids)
+
+
+def schedule_release(material_id):
+    """登记原料入库，事务提交后对已登记的原料合并检查一次
+
+    每次登记都注册提交回调，第一个执行的回调处理全部已登记的原料，其余回调直接返回；
+    事务回滚时残留的登记在下次提交时一并重新检查（重新检查总是安全的）
+    """
+    if getattr(_pending, 'material_ids', None) is None:
+        _pending.material_ids = set()
+    _pending.material_ids.add(material_id)
+    transaction.on_commit(_flush)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_bom_sub_assemblies'),
+        ('production', '0005_productiontask_production_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskMaterialBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shortage', models.DecimalField(decimal_places=4, default=0, max_digits=12, verbose_name='缺口数量')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocked_tasks', to='inventory.material', verbose_name='原料')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='material_blocks', to='production.productiontask', verbose_name='生产任务')),
+            ],
+            options={
+                'verbose_name': '任务缺料索引',
+                'verbose_name_plural': '任务缺料索引',
+                'constraints': [models.UniqueConstraint(fields=('task', 'material'), name='unique_task_material_block')],
+            },
+        ),
+    ]
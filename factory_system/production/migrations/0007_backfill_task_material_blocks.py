@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:00
+
+from decimal import Decimal
+
+from django.db import migrations
+
+
+QUANTITY_PLACES = Decimal('0.0001')
+
+
+def explode(product_id, direct, path=()):
+    """按直接配方把产品逐层展开为 {material_id: 单位用量}（与 inventory.bom_cache 的展开规则一致）"""
+    needs = {}
+    if product_id in path:
+        return needs
+    for material_id, component_id, quantity in direct.get(product_id, ()):
+        if material_id:
+            needs[material_id] = needs.get(material_id, Decimal('0')) + quantity
+        elif component_id:
+            for sub_material_id, sub_quantity in explode(component_id, direct, path + (product_id,)).items():
+                part_quantity = (sub_quantity * quantity).quantize(QUANTITY_PLACES)
+                needs[sub_material_id] = needs.get(sub_material_id, Decimal('0')) + part_quantity
+    return needs
+
+
+def backfill_material_blocks(apps, schema_editor):
+    """为已是原料不足的生产任务写入缺料索引
+
+    按原料库存计算缺口：需求量超过库存的原料记为缺料；需求量都不超过库存的任务
+    （被其它任务、待审核领料单占用）记在全部原料上。第一次相关原料入库的重新检查会按优先级重建准确的缺料记录。
+    """
+    BOM = apps.get_model('inventory', 'BOM')
+    Inventory = apps.get_model('inventory', 'Inventory')
+    ProductionTask = apps.get_model('production', 'ProductionTask')
+    TaskMaterialBlock = apps.get_model('production', 'TaskMaterialBlock')
+
+    tasks = list(
+        ProductionTask.objects.filter(status='material_insufficient', material_blocks__isnull=True)
+        .values_list('pk', 'product_id', 'required_quantity')
+    )
+    if not tasks:
+        return
+
+    direct = {}
+    for product_id, material_id, component_id, quantity in BOM.objects.values_list(
+        'product_id', 'material_id', 'component_product_id', 'quantity',
+    ):
+        direct.setdefault(product_id, []).append((material_id, component_id, quantity))
+
+    on_hand = {}
+    for material_id, quantity in Inventory.objects.filter(inventory_type='material').values_list('material_id', 'quantity'):
+        on_hand[material_id] = on_hand.get(material_id, Decimal('0')) + quantity
+
+    exploded = {}
+    blocks = []
+    for task_id, product_id, required_quantity in tasks:
+        if product_id not in exploded:
+            exploded[product_id] = explode(product_id, direct)
+        needs = {
+            material_id: quantity * required_quantity
+            for material_id, quantity in exploded[product_id].items()
+        }
+        shortages = {
+            material_id: quantity - on_hand.get(material_id, Decimal('0'))
+            for material_id, quantity in needs.items() if quantity > on_hand.get(material_id, Decimal('0'))
+        }
+        if not shortages:
+            shortages = dict.fromkeys(needs, Decimal('0'))
+        blocks.extend(
+            TaskMaterialBlock(task_id=task_id, material_id=material_id, shortage=shortage)
+            for material_id, shortage in shortages.items()
+        )
+    TaskMaterialBlock.objects.bulk_create(blocks, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0006_task_material_blocks'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_material_blocks, migrations.RunPython.noop),
+    ]
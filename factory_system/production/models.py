@@ -99,6 +99,27 @@ class MaterialRequisitionItem(models.Model):
         return f"{self.requisition.requisition_no} - {self.material.name} x {self.required_quantity}"
 
 
+class TaskMaterialBlock(models.Model):
+    """原料不足任务的缺料索引：任务因哪些原料不足而等待
+
+    任务置为原料不足时写入，原料采购入库或调增后只重新检查等待该原料的任务（见 production.material_blocks）
+    """
+    task = models.ForeignKey(ProductionTask, on_delete=models.CASCADE, related_name='material_blocks', verbose_name='生产任务')
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='blocked_tasks', verbose_name='原料')
+    shortage = models.DecimalField(max_digits=12, decimal_places=4, default=0, verbose_name='缺口数量')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '任务缺料索引'
+        verbose_name_plural = '任务缺料索引'
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'material'], name='unique_task_material_block'),
+        ]
+
+    def __str__(self):
+        return f"{self.task.task_no} 缺 {self.material.name} {self.shortage}"
+
+
 class QCRecord(models.Model):
     """质检记录"""
     RESULT_CHOICES = [
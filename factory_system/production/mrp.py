@@ -0,0 +1,334 @@
+"""
+物料需求计划（MRP）净需求计算
+
+一次计算全部未开工需求对原料的占用，而不是逐个任务判断：
+1. 需求：未接收的生产任务（待接收、原料不足，接收时才发料）和尚未进入生产的订单缺口
+   （待审批至总经理已审批的订单，订单数量 - 批次分配，再按优先级扣除未预占的成品库存），按交付日期（备货任务按计划完成日期）排优先级，
+   无日期的排最后，同日期生产任务优先于订单，再按创建时间
+2. 多级BOM展开到原料（inventory.bom_cache），构成 需求×原料 的稀疏矩阵
+3. 供给：原料在库数量 - 待审核领料单未发数量
+4. 按优先级顺序逐列累计需求：某需求所需的任一原料累计需求超过供给即不可行。
+   排在前面的需求即使不可行也先占用原料，后面的需求不能插队
+5. 输出每种原料的总需求、供给和净需求（总需求 - 供给，不小于0），以及可行的需求集合
+
+安装了 NumPy 时用稀疏矩阵按列 cumsum 一次算完，否则按同样规则逐行计算，结果一致。
+"""
+import time
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+from inventory.availability import material_quantities
+from inventory.bom_cache import get_exploded_lines
+from inventory.models import Material
+
+
+# 尚未接收（接收时才发料）的生产任务状态
+OPEN_TASK_STATUSES = ('pending', 'material_insufficient')
+# 尚未创建生产任务的订单状态
+OPEN_ORDER_STATUSES = ('pending', 'approved', 'ceo_pending', 'ceo_approved')
+
+KIND_TASK = 'task'
+KIND_ORDER_ITEM = 'order_item'
+
+QUANTITY_PLACES = Decimal('0.01')
+_EPSILON = 1e-6
+
+
+def _decimal(value):
+    return Decimal(str(value)).quantize(QUANTITY_PLACES, rounding=ROUND_HALF_UP)
+
+
+class Demand:
+    """一条需求（生产任务或订单明细缺口）"""
+
+    def __init__(self, kind, pk, number, product_id, quantity, due_date, created_at):
+        self.kind = kind
+        self.pk = pk
+        self.number = number  # 任务单号或订单号
+        self.product_id = product_id
+        self.quantity = quantity
+        self.due_date = due_date
+        self.created_at = created_at
+        self.feasible = True
+        self.shortages = {}  # {material_id: 排到本需求时的累计缺口}
+
+    @property
+    def priority(self):
+        return (
+            self.due_date is None,
+            self.due_date or date.max,
+            0 if self.kind == KIND_TASK else 1,
+            self.created_at,
+            self.pk,
+        )
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'id': self.pk,
+            'number': self.number,
+            'product_id': self.product_id,
+            'quantity': float(self.quantity),
+            'due_date': self.due_date.isoformat() if self.due_date else None,
+            'feasible': self.feasible,
+            'short_material_ids': list(self.shortages),
+        }
+
+
+class MaterialPlan:
+    """一种原料的供需汇总"""
+
+    def __init__(self, material, on_hand, committed, required):
+        self.material = material
+        self.on_hand = on_hand  # 在库数量
+        self.committed = committed  # 待审核领料单未发数量
+        self.required = required  # 全部需求合计
+
+    @property
+    def supply(self):
+        return self.on_hand - self.committed
+
+    @property
+    def net_requirement(self):
+        return max(self.required - self.supply, Decimal('0'))
+
+    def as_dict(self):
+        return {
+            'material_id': self.material.pk,
+            'sku': self.material.sku,
+            'name': self.material.name,
+            'unit': self.material.unit,
+            'on_hand': float(self.on_hand),
+            'committed': float(self.committed),
+            'required': float(self.required),
+            'net_requirement': float(self.net_requirement),
+        }
+
+
+class MRPResult:
+    """MRP计算结果，demands 按优先级排序"""
+
+    def __init__(self, demands, materials, engine, elapsed):
+        self.demands = demands
+        self.materials = materials
+        self.engine = engine
+        self.elapsed = elapsed
+
+    @property
+    def feasible_task_ids(self):
+        return [demand.pk for demand in self.demands if demand.kind == KIND_TASK and demand.feasible]
+
+    @property
+    def infeasible_task_ids(self):
+        return [demand.pk for demand in self.demands if demand.kind == KIND_TASK and not demand.feasible]
+
+    @property
+    def shortages(self):
+        return [plan for plan in self.materials if plan.net_requirement > 0]
+
+    def as_dict(self):
+        return {
+            'engine': self.engine,
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+            'demand_count': len(self.demands),
+            'feasible_count': sum(1 for demand in self.demands if demand.feasible),
+            'demands': [demand.as_dict() for demand in self.demands],
+            'materials': [plan.as_dict() for plan in self.materials],
+        }
+
+
+def load_demands():
+    """读取全部未开工需求，按优先级排序（只取所需字段，不实例化模型）"""
+    from sales.models import SalesOrderItem
+    from .models import ProductionTask
+
+    demands = []
+
+    # 已有待审核领料单的任务，其需求按领料单计入已承诺数量
+    tasks = ProductionTask.objects.filter(status__in=OPEN_TASK_STATUSES).exclude(
+        material_requisitions__status='pending',
+    ).annotate(
+        open_quantity=F('required_quantity') - F('completed_quantity'),
+    ).filter(open_quantity__gt=0).values_list(
+        'pk', 'task_no', 'product_id', 'open_quantity', 'order__delivery_date', 'planned_completion_date', 'created_at',
+    )
+    for pk, task_no, product_id, quantity, delivery_date, planned_date, created_at in tasks:
+        demands.append(Demand(KIND_TASK, pk, task_no, product_id, quantity, delivery_date or planned_date, created_at))
+
+    items = SalesOrderItem.objects.filter(order__status__in=OPEN_ORDER_STATUSES).annotate(
+        allocated=Coalesce(Sum('batch_allocations__quantity'), Decimal('0')),
+    ).values_list('pk', 'order__order_no', 'product_id', 'quantity', 'allocated', 'order__delivery_date', 'order__created_at')
+    for pk, order_no, product_id, quantity, allocated, delivery_date, created_at in items:
+        shortage = quantity - allocated
+        if shortage > 0:
+            demands.append(Demand(KIND_ORDER_ITEM, pk, order_no, product_id, shortage, delivery_date, created_at))
+
+    demands.sort(key=lambda demand: demand.priority)
+    return _net_product_stock(demands)
+
+
+def _net_product_stock(demands):
+    """订单缺口按优先级依次扣除未预占的成品库存，完全被库存覆盖的订单缺口不再需要原料"""
+    from sales.reservations import free_product_quantities
+
+    product_ids = {demand.product_id for demand in demands if demand.kind == KIND_ORDER_ITEM}
+    free = free_product_quantities(product_ids) if product_ids else {}
+    netted = []
+    for demand in demands:
+        stock = free.get(demand.product_id, Decimal('0'))
+        if demand.kind == KIND_ORDER_ITEM and stock > 0:
+            used = min(stock, demand.quantity)
+            free[demand.product_id] = stock - used
+            demand.quantity -= used
+            if demand.quantity <= 0:
+                continue
+        netted.append(demand)
+    return netted
+
+
+def committed_quantities():
+    """待审核领料单尚未发出的原料数量 {material_id: 数量}"""
+    from .models import MaterialRequisitionItem
+
+    rows = MaterialRequisitionItem.objects.filter(requisition__status='pending').values('material_id').annotate(
+        total=Sum(F('required_quantity') - F('issued_quantity')),
+    )
+    return {row['material_id']: _decimal(row['total']) for row in rows}
+
+
+def _net_numpy(demands, exploded, material_index, supply):
+    """稀疏矩阵按列累计：返回 ({需求行号: [(原料列号, 累计缺口)]}, 每种原料的需求合计)"""
+    product_index = {product_id: i for i, product_id in enumerate(exploded)}
+    indptr = [0]
+    columns, per_unit = [], []
+    for lines in exploded.values():
+        for material_id, quantity, _unit in lines:
+            columns.append(material_index[material_id])
+            per_unit.append(float(quantity))
+        indptr.append(len(columns))
+    indptr = np.asarray(indptr, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.int64)
+    per_unit = np.asarray(per_unit, dtype=np.float64)
+
+    products = np.fromiter((product_index[demand.product_id] for demand in demands), dtype=np.int64, count=len(demands))
+    quantities = np.fromiter((float(demand.quantity) for demand in demands), dtype=np.float64, count=len(demands))
+
+    # 每条需求展开为其产品的BOM行：行号、列号、需求量（COO格式）
+    lengths = indptr[products + 1] - indptr[products]
+    rows = np.repeat(np.arange(len(demands)), lengths)
+    starts = np.repeat(indptr[products], lengths)
+    within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    positions = starts + within
+    cols = columns[positions]
+    values = per_unit[positions] * quantities[rows]
+
+    required = np.bincount(cols, weights=values, minlength=len(material_index))
+    if not len(values):
+        return {}, required
+
+    # 按 (列, 行) 排序后按列分段累计，得到每个元素处该原料的累计需求
+    order = np.lexsort((rows, cols))
+    rows, cols, values = rows[order], cols[order], values[order]
+    running = np.cumsum(values)
+    counts = np.bincount(cols, minlength=len(material_index))
+    column_offsets = np.concatenate(([0.0], running[np.cumsum(counts)[:-1] - 1]))
+    column_offsets[counts == 0] = 0.0
+    cumulative = running - np.repeat(column_offsets, counts)
+
+    excess = cumulative - supply[cols]
+    short = excess > _EPSILON
+    short_by_row = {}
+    for row, col, amount in zip(rows[short].tolist(), cols[short].tolist(), excess[short].tolist()):
+        short_by_row.setdefault(row, []).append((col, amount))
+    return short_by_row, required
+
+
+def _net_python(demands, exploded, material_index, supply):
+    """逐行累计，规则与 _net_numpy 相同"""
+    cumulative = [0.0] * len(material_index)
+    short_by_row = {}
+    for row, demand in enumerate(demands):
+        quantity = float(demand.quantity)
+        for material_id, per_unit, _unit in exploded[demand.product_id]:
+            col = material_index[material_id]
+            cumulative[col] += float(per_unit) * quantity
+            excess = cumulative[col] - supply[col]
+            if excess > _EPSILON:
+                short_by_row.setdefault(row, []).append((col, excess))
+    return short_by_row, cumulative
+
+
+def run_mrp(use_numpy=None):
+    """计算全部未开工需求的原料净需求和可行需求集合，返回 MRPResult"""
+    started = time.perf_counter()
+    use_numpy = np is not None if use_numpy is None else (use_numpy and np is not None)
+
+    demands = load_demands()
+    exploded = get_exploded_lines({demand.product_id for demand in demands})
+
+    material_ids = sorted({material_id for lines in exploded.values() for material_id, _qty, _unit in lines})
+    material_index = {material_id: i for i, material_id in enumerate(material_ids)}
+    on_hand = material_quantities(material_ids) if material_ids else {}
+    committed = committed_quantities()
+    supply_values = [
+        float(on_hand.get(material_id, 0)) - float(committed.get(material_id, 0)) for material_id in material_ids
+    ]
+
+    if use_numpy:
+        short_by_row, required = _net_numpy(demands, exploded, material_index, np.asarray(supply_values, dtype=np.float64))
+        required = required.tolist()
+    else:
+        short_by_row, required = _net_python(demands, exploded, material_index, supply_values)
+
+    for row, shortages in short_by_row.items():
+        demands[row].feasible = False
+        demands[row].shortages = {material_ids[col]: _decimal(amount) for col, amount in sorted(shortages)}
+
+    materials_by_id = Material.objects.in_bulk(material_ids) if material_ids else {}
+    materials = [
+        MaterialPlan(
+            materials_by_id[material_id],
+            on_hand.get(material_id, Decimal('0')),
+            committed.get(material_id, Decimal('0')),
+            _decimal(required[material_index[material_id]]),
+        )
+        for material_id in material_ids
+    ]
+    return MRPResult(demands, materials, 'numpy' if use_numpy else 'python', time.perf_counter() - started)
+
+
+def apply_task_statuses(result):
+    """按MRP结果更新生产任务状态：可行的原料不足任务改为待接收，不可行的待接收任务改为原料不足
+
+    同时重建这些任务的缺料索引（production.material_blocks），需在事务中调用。
+    返回 (改为待接收的数量, 改为原料不足的数量)
+    """
+    from accounts.dashboard import mark_dirty as mark_dashboard_dirty
+    from accounts.status_counters import adjust_status
+    from .material_blocks import block_tasks, clear_blocks
+    from .models import ProductionTask
+
+    released = ProductionTask.objects.filter(
+        pk__in=result.feasible_task_ids, status='material_insufficient',
+    ).update(status='pending')
+    blocked = ProductionTask.objects.filter(
+        pk__in=result.infeasible_task_ids, status='pending',
+    ).update(status='material_insufficient')
+    if released or blocked:
+        # 批量更新不触发模型信号，手动调整状态计数、标记仪表板（交期冲突预警包含待接收任务）
+        adjust_status('production.ProductionTask', 'material_insufficient', 'pending', released)
+        adjust_status('production.ProductionTask', 'pending', 'material_insufficient', blocked)
+        mark_dashboard_dirty('alerts')
+    clear_blocks(result.feasible_task_ids)
+    block_tasks({
+        demand.pk: demand.shortages for demand in result.demands if demand.kind == KIND_TASK and not demand.feasible
+    })
+    return released, blocked
@@ -0,0 +1,20 @@
+"""
+原料采购入库、库存调增后重新检查等待该原料的原料不足任务（见 production.material_blocks）
+"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from inventory.models import StockTransaction
+
+from .material_blocks import schedule_release
+
+
+@receiver(post_save, sender=StockTransaction)
+def release_blocked_tasks(sender, instance, created, **kwargs):
+    if not created or instance.quantity <= 0:
+        return
+    if instance.transaction_type not in ('purchase_in', 'adjustment'):
+        return
+    material_id = instance.inventory.material_id
+    if instance.inventory.inventory_type == 'material' and material_id:
+        schedule_release(material_id)
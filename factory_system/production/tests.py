@@ -1,3 +1,74 @@
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from inventory import bom_cache
+from inventory.allocation import receive_stock
+from inventory.models import BOM, Inventory, Material, Product, StockTransaction
+
+from .material_blocks import block_tasks
+from .models import ProductionTask, TaskMaterialBlock
+
+
+class MaterialBlockReleaseTests(TestCase):
+    """原料入库后按优先级释放等待该原料的原料不足任务"""
+
+    def setUp(self):
+        cache.clear()
+        bom_cache._local.__dict__.clear()
+        self.user = User.objects.create_user('keeper')
+        self.product = Product.objects.create(sku='P-MIX', name='砂浆', sale_price=Decimal('10'))
+        self.cement = Material.objects.create(sku='M-C', name='水泥', unit='kg')
+        self.sand = Material.objects.create(sku='M-S', name='砂', unit='kg')
+        BOM.objects.create(product=self.product, material=self.cement, quantity=Decimal('2'), unit='kg')
+        self.cement_stock = Inventory.objects.create(inventory_type='material', material=self.cement, unit='kg')
+        self.sand_stock = Inventory.objects.create(inventory_type='material', material=self.sand, unit='kg')
+        self.urgent = self.create_task('PT-1', date(2026, 3, 1))
+        self.later = self.create_task('PT-2', date(2026, 4, 1))
+        block_tasks({self.urgent.pk: {self.cement.pk: Decimal('10')}, self.later.pk: {self.cement.pk: Decimal('10')}})
+
+    def create_task(self, task_no, planned_completion_date):
+        return ProductionTask.objects.create(
+            task_no=task_no, production_type='stock', product=self.product, required_quantity=Decimal('5'),
+            status='material_insufficient', planned_completion_date=planned_completion_date,
+        )
+
+    def receive(self, inventory, quantity):
+        """采购入库，提交后执行释放检查"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                batch = receive_stock(inventory, Decimal(quantity), batch_no='B', batch_date=date(2026, 1, 1))
+                StockTransaction.objects.create(
+                    transaction_type='purchase_in', inventory=inventory, batch=batch, quantity=Decimal(quantity),
+                    unit='kg', operator=self.user,
+                )
+
+    def status(self, task):
+        return ProductionTask.objects.get(pk=task.pk).status
+
+    def test_release_in_priority_order(self):
+        self.receive(self.cement_stock, 10)
+        self.assertEqual(self.status(self.urgent), 'pending')
+        self.assertEqual(self.status(self.later), 'material_insufficient')
+        self.assertFalse(TaskMaterialBlock.objects.filter(task=self.urgent).exists())
+        # 已释放的任务占用了这批原料，后面的任务仍缺 10
+        self.assertEqual(TaskMaterialBlock.objects.get(task=self.later).shortage, Decimal('10'))
+
+        self.receive(self.cement_stock, 10)
+        self.assertEqual(self.status(self.later), 'pending')
+        self.assertFalse(TaskMaterialBlock.objects.exists())
+
+        out = StringIO()
+        call_command('rebuild_status_counters', check=True, stdout=out)
+        self.assertIn('状态计数与当前数据一致', out.getvalue())
+
+    def test_unrelated_material_does_not_release(self):
+        self.receive(self.sand_stock, 100)
+        self.assertEqual(self.status(self.urgent), 'material_insufficient')
+        self.assertEqual(TaskMaterialBlock.objects.count(), 2)
@@ -11,6 +11,7 @@ urlpatterns = [
     path('tasks/<int:pk>/receive/', views.task_receive, name='task_receive'),
     path('tasks/<int:pk>/complete/', views.task_complete, name='task_complete'),
     path('tasks/<int:pk>/terminate/', views.task_terminate, name='task_terminate'),
+    path('mrp/', views.mrp_run, name='mrp_run'),
     path('requisitions/', views.requisition_list, name='requisition_list'),
     path('requisitions/<int:pk>/approve/', views.requisition_approve, name='requisition_approve'),
     path('requisitions/<int:pk>/terminate/', views.requisition_terminate, name='requisition_terminate'),
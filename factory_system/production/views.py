@@ -6,9 +6,14 @@ from django.utils import timezone
 from django.core.paginator import Paginator
 from django.http import JsonResponse
 from decimal import Decimal
-from accounts.decorators import role_required
+from accounts.decorators import role_required, session_readonly
 from .models import ProductionTask, MaterialRequisition, MaterialRequisitionItem, QCRecord, FinishedProductInbound
-from inventory.models import BOM, Inventory, StockTransaction, Product
+from .mrp import run_mrp, apply_task_statuses
+from .material_blocks import block_task, clear_blocks
+from inventory.models import Inventory, StockTransaction, Product
+from inventory.allocation import issue_stock, receive_stock
+from inventory.availability import check_material_availability
+from inventory.numbering import next_number, PREFIX_PRODUCTION_TASK, PREFIX_REQUISITION, PREFIX_PRODUCT_INBOUND, PREFIX_SHIPPING_NOTICE
 
 
 @login_required
@@ -54,70 +59,34 @@ def task_detail(request, pk):
     """生产任务详情"""
     task = get_object_or_404(ProductionTask.objects.prefetch_related('material_requisitions__items'), pk=pk)
     
-    # 获取BOM信息
-    bom_items = BOM.objects.filter(product=task.product)
-    
-    # 计算每种原料的总需求量（BOM用量 × 需求数量）和缺口数量
-    material_requirements = []
-    total_materials_summary = {}  # {material_id: {'material': Material, 'total_quantity': Decimal, 'unit': str, 'available_quantity': Decimal, 'shortage': Decimal}}
-    
-    for bom_item in bom_items:
-        total_required = bom_item.quantity * task.required_quantity
-        
-        # 获取当前库存
-        try:
-            inventory = Inventory.objects.get(inventory_type='material', material=bom_item.material)
-            available_quantity = inventory.quantity
-        except Inventory.DoesNotExist:
-            available_quantity = Decimal('0')
-        
-        # 计算缺口数量
-        shortage = total_required - available_quantity
-        if shortage < 0:
-            shortage = Decimal('0')
-        
-        material_requirements.append({
-            'material': bom_item.material,
-            'material_id': bom_item.material.id,  # 用于JavaScript更新
-            'bom_quantity': bom_item.quantity,  # 单位产品用量
-            'total_required': total_required,  # 总需求量
-            'available_quantity': available_quantity,  # 当前库存
-            'shortage': shortage,  # 缺口数量
-            'unit': bom_item.unit,
-        })
-        
-        # 汇总到总原料统计中
-        material_id = bom_item.material.id
-        if material_id in total_materials_summary:
-            total_materials_summary[material_id]['total_quantity'] += total_required
-            # 更新可用库存和缺口（取最小值，因为同一原料可能在不同BOM中出现）
-            try:
-                inventory = Inventory.objects.get(inventory_type='material', material=bom_item.material)
-                available_qty = inventory.quantity
-            except Inventory.DoesNotExist:
-                available_qty = Decimal('0')
-            total_shortage = total_materials_summary[material_id]['total_quantity'] - available_qty
-            if total_shortage < 0:
-                total_shortage = Decimal('0')
-            total_materials_summary[material_id]['available_quantity'] = available_qty
-            total_materials_summary[material_id]['shortage'] = total_shortage
-        else:
-            try:
-                inventory = Inventory.objects.get(inventory_type='material', material=bom_item.material)
-                available_qty = inventory.quantity
-            except Inventory.DoesNotExist:
-                available_qty = Decimal('0')
-            total_shortage = total_required - available_qty
-            if total_shortage < 0:
-                total_shortage = Decimal('0')
-            total_materials_summary[material_id] = {
-                'material': bom_item.material,
-                'material_id': bom_item.material.id,
-                'total_quantity': total_required,
-                'available_quantity': available_qty,
-                'shortage': total_shortage,
-                'unit': bom_item.unit,
-            }
+    # 计算每种原料的总需求量（BOM用量 × 需求数量）和缺口数量，BOM展开和原料库存各一条查询
+    availability = check_material_availability([(task.product_id, task.required_quantity)])
+    bom_items = availability[0].lines
+    
+    material_requirements = [
+        {
+            'material': line.material,
+            'material_id': line.material.id,  # 用于JavaScript更新
+            'bom_quantity': line.bom_quantity,  # 单位产品用量
+            'total_required': line.required,  # 总需求量
+            'available_quantity': line.available,  # 当前库存
+            'shortage': line.shortage,  # 缺口数量
+            'unit': line.unit,
+        }
+        for line in availability[0].lines
+    ]
+    # 全部所需原料总数（同一原料可能在多行BOM中出现，按原料汇总）
+    total_materials_summary = {
+        material_id: {
+            'material': total.material,
+            'material_id': material_id,
+            'total_quantity': total.required,
+            'available_quantity': total.available,
+            'shortage': total.shortage,
+            'unit': total.unit,
+        }
+        for material_id, total in availability.materials.items()
+    }
     
     # 计算产品缺口数量
     shortage_quantity = task.required_quantity - task.completed_quantity
@@ -134,6 +103,7 @@ def task_detail(request, pk):
     return render(request, 'production/task_detail.html', context)
 
 
+@session_readonly
 @login_required
 @role_required('production', 'ceo')
 def task_status_api(request, pk):
@@ -146,26 +116,15 @@ def task_status_api(request, pk):
         shortage_quantity = 0
     
     # 计算每种原料的缺口数量
-    bom_items = BOM.objects.filter(product=task.product)
-    material_shortages = {}
-    
-    for bom_item in bom_items:
-        total_required = bom_item.quantity * task.required_quantity
-        try:
-            inventory = Inventory.objects.get(inventory_type='material', material=bom_item.material)
-            available_quantity = inventory.quantity
-        except Inventory.DoesNotExist:
-            available_quantity = Decimal('0')
-        
-        shortage = total_required - available_quantity
-        if shortage < 0:
-            shortage = Decimal('0')
-        
-        material_shortages[bom_item.material.id] = {
-            'total_required': float(total_required),
-            'available_quantity': float(available_quantity),
-            'shortage': float(shortage),
+    availability = check_material_availability([(task.product_id, task.required_quantity)])
+    material_shortages = {
+        material_id: {
+            'total_required': float(total.required),
+            'available_quantity': float(total.available),
+            'shortage': float(total.shortage),
         }
+        for material_id, total in availability.materials.items()
+    }
     
     return JsonResponse({
         'completed_quantity': float(task.completed_quantity),
@@ -177,6 +136,20 @@ def task_status_api(request, pk):
     })
 
 
+@login_required
+@role_required('production', 'ceo')
+def mrp_run(request):
+    """MRP净需求计算API：GET 返回计算结果，POST 计算后按结果更新待接收/原料不足任务的状态"""
+    result = run_mrp()
+    data = result.as_dict()
+    if request.method == 'POST':
+        with transaction.atomic():
+            released, blocked = apply_task_statuses(result)
+        data['released_count'] = released
+        data['blocked_count'] = blocked
+    return JsonResponse(data)
+
+
 @login_required
 @role_required('production', 'ceo')
 def task_receive(request, pk):
@@ -188,35 +161,17 @@ def task_receive(request, pk):
         messages.error(request, '任务状态不正确，只能接收待接收或原料不足状态的任务')
         return redirect('production:task_detail', pk=pk)
     
-    # 检查原材料是否充足
-    bom_items = BOM.objects.filter(product=task.product)
-    insufficient_materials = []
-    all_sufficient = True
-    
-    for bom_item in bom_items:
-        total_required = bom_item.quantity * task.required_quantity
-        try:
-            inventory = Inventory.objects.get(inventory_type='material', material=bom_item.material)
-            available_quantity = inventory.quantity
-        except Inventory.DoesNotExist:
-            available_quantity = Decimal('0')
-        
-        if available_quantity < total_required:
-            all_sufficient = False
-            shortage = total_required - available_quantity
-            insufficient_materials.append({
-                'material': bom_item.material,
-                'required': total_required,
-                'available': available_quantity,
-                'shortage': shortage,
-                'unit': bom_item.unit,
-            })
+    # 检查原材料是否充足（同一原料出现在多行BOM时按合计需求判断）
+    availability = check_material_availability([(task.product_id, task.required_quantity)])
+    insufficient_materials = availability.shortages
+    all_sufficient = availability.sufficient
     
     if request.method == 'POST':
         if not all_sufficient:
             # 原材料不足，更新状态为原料不足
             task.status = 'material_insufficient'
             task.save()
+            block_task(task, availability)
             messages.warning(request, f'任务 {task.task_no} 原材料不足，无法接收。请先采购补齐原材料。')
             return redirect('production:task_detail', pk=pk)
         
@@ -228,30 +183,28 @@ def task_receive(request, pk):
         task.save()
         
         # 自动创建领料单并扣减库存
-        requisition = create_material_requisition(task)
-        if requisition:
-            # 自动批准领料单并扣减库存
-            from inventory.models import StockTransaction
-            requisition.status = 'approved'
-            requisition.approved_by = request.user
-            requisition.approved_at = timezone.now()
-            requisition.save()
-            
-            # 扣减库存
-            for item in requisition.items.all():
-                inventory = Inventory.objects.get(inventory_type='material', material=item.material)
-                inventory.quantity -= item.required_quantity
-                inventory.save()
+        with transaction.atomic():
+            clear_blocks([task.pk])
+            requisition = create_material_requisition(task)
+            if requisition:
+                # 自动批准领料单
+                requisition.status = 'approved'
+                requisition.approved_by = request.user
+                requisition.approved_at = timezone.now()
+                requisition.save()
                 
-                # 记录库存变动
-                StockTransaction.objects.create(
-                    transaction_type='production_out',
-                    inventory=inventory,
-                    quantity=item.required_quantity,
-                    unit=item.unit,
-                    reference_no=requisition.requisition_no,
-                    operator=request.user,
-                )
+                # 扣减库存（锁定批次后按出库策略分配，库存总数量按差额更新）
+                for item in requisition.items.all():
+                    inventory = Inventory.objects.get(inventory_type='material', material=item.material)
+                    issue_stock(
+                        inventory,
+                        item.required_quantity,
+                        transaction_type='production_out',
+                        operator=request.user,
+                        reference_no=requisition.requisition_no,
+                        unit=item.unit,
+                        allow_unbatched=True,
+                    )
         
         messages.success(request, f'任务 {task.task_no} 已接收，已进入生产中状态')
         return redirect('production:task_detail', pk=pk)
@@ -266,29 +219,30 @@ def task_receive(request, pk):
 
 
 def create_material_requisition(task):
-    """根据BOM自动创建领料单"""
-    from inventory.models import BOM
+    """根据BOM自动创建领料单（多级BOM展开到原料）"""
+    from inventory.bom_cache import get_exploded_lines
     
-    bom_items = BOM.objects.filter(product=task.product)
+    bom_lines = get_exploded_lines([task.product_id])[task.product_id]
     
-    if not bom_items.exists():
+    if not bom_lines:
         return None
     
     requisition = MaterialRequisition.objects.create(
-        requisition_no=f"MR{timezone.now().strftime('%Y%m%d%H%M%S')}",
+        requisition_no=next_number(PREFIX_REQUISITION),
         task=task,
         status='pending',
         requested_by=task.received_by,
     )
     
-    for bom_item in bom_items:
-        required_qty = bom_item.quantity * task.required_quantity
-        MaterialRequisitionItem.objects.create(
+    MaterialRequisitionItem.objects.bulk_create([
+        MaterialRequisitionItem(
             requisition=requisition,
-            material=bom_item.material,
-            required_quantity=required_qty,
-            unit=bom_item.unit,
+            material_id=material_id,
+            required_quantity=quantity * task.required_quantity,
+            unit=unit,
         )
+        for material_id, quantity, unit in bom_lines
+    ])
     
     return requisition
 
@@ -360,36 +314,18 @@ def requisition_approve(request, pk):
             requisition.approved_at = timezone.now()
             requisition.save()
             
-            # 扣减库存（按批次FIFO）
-            from inventory.models import Batch
+            # 扣减库存（锁定批次后按出库策略分配，批次不足部分从未落到批次的库存扣减）
             for item in requisition.items.all():
                 inventory = Inventory.objects.get(inventory_type='material', material=item.material)
-                remaining_qty = item.required_quantity
-                
-                # 按FIFO原则从批次中扣减
-                for batch in inventory.get_batches().filter(quantity__gt=0).order_by('batch_date', 'created_at'):
-                    if remaining_qty <= 0:
-                        break
-                    
-                    allocate_qty = min(remaining_qty, batch.quantity)
-                    batch.quantity -= allocate_qty
-                    batch.save()
-                    
-                    # 记录库存变动
-                    StockTransaction.objects.create(
-                        transaction_type='production_out',
-                        inventory=inventory,
-                        batch=batch,
-                        quantity=allocate_qty,
-                        unit=item.unit,
-                        reference_no=requisition.requisition_no,
-                        operator=request.user,
-                    )
-                    
-                    remaining_qty -= allocate_qty
-                
-                # 更新库存总数量
-                inventory.update_quantity_from_batches()
+                issue_stock(
+                    inventory,
+                    item.required_quantity,
+                    transaction_type='production_out',
+                    operator=request.user,
+                    reference_no=requisition.requisition_no,
+                    unit=item.unit,
+                    allow_unbatched=True,
+                )
             
             requisition.task.status = 'material_preparing'
             requisition.task.save()
@@ -491,15 +427,8 @@ def inbound_create(request, task_pk):
                     return redirect('production:inbound_create', task_pk=task_pk)
             
             with transaction.atomic():
-                # 生成唯一的入库单号
-                import random
-                inbound_no = f"IN{timezone.now().strftime('%Y%m%d%H%M%S')}{random.randint(100, 999)}"
-                # 确保入库单号唯一
-                while FinishedProductInbound.objects.filter(inbound_no=inbound_no).exists():
-                    inbound_no = f"IN{timezone.now().strftime('%Y%m%d%H%M%S')}{random.randint(100, 999)}"
-                
                 inbound = FinishedProductInbound.objects.create(
-                    inbound_no=inbound_no,
+                    inbound_no=next_number(PREFIX_PRODUCT_INBOUND),
                     task=task,
                     qc_record=qc_record,
                     quantity=quantity,
@@ -547,21 +476,17 @@ def inbound_create(request, task_pk):
                 if expiry_date_str:
                     expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
                 
-                # 创建批次
-                from inventory.models import Batch
-                batch = Batch.objects.create(
+                # 创建批次，库存总数量按入库数量增加
+                batch = receive_stock(
+                    inventory,
+                    quantity,
                     batch_no=batch_no,
-                    inventory=inventory,
                     batch_date=batch_date,
-                    quantity=quantity,
                     unit_price=batch_unit_price,
                     expiry_date=expiry_date,
                     remark=f"生产任务：{task.task_no}，入库单：{inbound.inbound_no}",
                 )
                 
-                # 更新库存总数量
-                inventory.update_quantity_from_batches()
-                
                 # 记录库存变动
                 StockTransaction.objects.create(
                     transaction_type='production_in',
@@ -674,7 +599,7 @@ def check_order_ready_to_ship(order):
         ShippingNotice.objects.get_or_create(
             order=order,
             defaults={
-                'notice_no': f"SN{timezone.now().strftime('%Y%m%d%H%M%S')}",
+                'notice_no': lambda: next_number(PREFIX_SHIPPING_NOTICE),  # 只在新建时取号
                 'status': 'pending',
             }
         )
@@ -713,6 +638,7 @@ def task_terminate(request, pk):
             task.terminated_at = timezone.now()
             task.terminate_reason = terminate_reason
             task.save()
+            clear_blocks([task.pk])
             messages.success(request, f'备货生产任务 {task.task_no} 已终结')
         
         return redirect('production:task_detail', pk=pk)
@@ -807,46 +733,13 @@ def stock_task_create(request):
                 return redirect('production:stock_task_create')
             
             # 检查原材料是否充足
-            bom_items = BOM.objects.filter(product=product)
-            material_sufficient = True
-            insufficient_materials = []
-            
-            for bom_item in bom_items:
-                material_required = bom_item.quantity * required_qty
-                try:
-                    material_inventory = Inventory.objects.get(
-                        inventory_type='material',
-                        material=bom_item.material
-                    )
-                    if material_inventory.quantity < material_required:
-                        material_sufficient = False
-                        insufficient_materials.append({
-                            'material': bom_item.material,
-                            'required': material_required,
-                            'available': material_inventory.quantity,
-                            'shortage': material_required - material_inventory.quantity,
-                            'unit': bom_item.unit,
-                        })
-                except Inventory.DoesNotExist:
-                    material_sufficient = False
-                    insufficient_materials.append({
-                        'material': bom_item.material,
-                        'required': material_required,
-                        'available': Decimal('0'),
-                        'shortage': material_required,
-                        'unit': bom_item.unit,
-                    })
-            
-            # 生成任务单号
-            task_no = f"PT{timezone.now().strftime('%Y%m%d%H%M%S')}ST"
-            # 确保任务单号唯一
-            while ProductionTask.objects.filter(task_no=task_no).exists():
-                task_no = f"PT{timezone.now().strftime('%Y%m%d%H%M%S')}ST{timezone.now().microsecond}"
+            availability = check_material_availability([(product, required_qty)])
+            material_sufficient = availability.sufficient
             
             # 创建备货生产任务
             task_status = 'pending' if material_sufficient else 'material_insufficient'
             task = ProductionTask.objects.create(
-                task_no=task_no,
+                task_no=next_number(PREFIX_PRODUCTION_TASK),
                 production_type='stock',
                 product=product,
                 required_quantity=required_qty,
@@ -854,6 +747,8 @@ def stock_task_create(request):
                 planned_completion_date=planned_completion_date,
                 remark=remark,
             )
+            if not material_sufficient:
+                block_task(task, availability)
             
             if material_sufficient:
                 messages.success(request, f'备货生产任务 {task.task_no} 创建成功')
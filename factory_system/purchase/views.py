@@ -7,8 +7,10 @@ from django.core.paginator import Paginator
 from decimal import Decimal
 from accounts.decorators import role_required
 from .models import PurchaseTask, PurchaseTaskItem, Supplier
-from inventory.models import Material, Inventory, StockTransaction, Batch
-from django.db.models import Q
+from inventory.models import Material, Inventory, StockTransaction
+from inventory.allocation import receive_stock
+from inventory.numbering import next_number, PREFIX_PURCHASE_TASK
+from inventory import search_index
 
 
 @login_required
@@ -79,7 +81,7 @@ def task_create(request):
         
         with transaction.atomic():
             task = PurchaseTask.objects.create(
-                task_no=f"PT{timezone.now().strftime('%Y%m%d%H%M%S')}",
+                task_no=next_number(PREFIX_PURCHASE_TASK),
                 supplier=supplier,
                 contact_person=contact_person,
                 contact_phone=contact_phone,
@@ -260,22 +262,18 @@ def task_complete(request, pk):
                         if expiry_date_str:
                             expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
                         
-                        # 创建批次
-                        from inventory.models import Batch
-                        batch = Batch.objects.create(
+                        # 创建批次，库存总数量按入库数量增加
+                        batch = receive_stock(
+                            inventory,
+                            received_qty,
                             batch_no=batch_no,
-                            inventory=inventory,
                             batch_date=batch_date,
-                            quantity=received_qty,
                             unit_price=batch_unit_price,
                             expiry_date=expiry_date,
                             supplier=task.supplier,
                             remark=f"采购任务：{task.task_no}",
                         )
                         
-                        # 更新库存总数量
-                        inventory.update_quantity_from_batches()
-                        
                         # 记录库存变动
                         from inventory.models import StockTransaction
                         StockTransaction.objects.create(
@@ -346,11 +344,7 @@ def supplier_list(request):
     
     search = request.GET.get('search', '')
     if search:
-        suppliers = suppliers.filter(
-            Q(name__icontains=search) | 
-            Q(contact_person__icontains=search) |
-            Q(contact_phone__icontains=search)
-        )
+        suppliers = suppliers.filter(pk__in=search_index.matching_ids('supplier', search))
     
     # 分页处理
     paginator = Paginator(suppliers, 20)  # 每页20条
@@ -0,0 +1,260 @@
+"""
+可承诺量（ATP/CTP）估算
+
+下单时按 (产品, 数量) 估算可承诺数量和预计交付日期，数据来自按产品预先计算的快照：
+- 可承诺量（ATP）：成品库存 - 批次预占数量
+- 可生产量（CTP）：多级BOM展开到原料后，当前原料库存最多还能生产的成品数量
+- 生产周期：该产品历史生产任务从接收到完成的平均天数，无记录时用全部产品的平均值，
+  仍无记录时用 settings.ATP_DEFAULT_LEAD_DAYS
+
+快照存放在 Django 缓存中，缓存键带BOM版本号（BOM变化后全部失效），按增量失效：
+- 库存总数量变化（inventory.signals.stock_changed）、批次预占数量变化时登记受影响的库存，
+  事务提交后只删除受影响产品的快照；原料变化影响直接或经半成品用到该原料的全部成品
+- 查询时未命中的产品批量计算后写回，refresh_atp_snapshot 命令预先计算全部产品
+- 快照有效期 settings.ATP_SNAPSHOT_TIMEOUT，到期后重新计算，历史生产周期随之更新
+"""
+import math
+import threading
+from datetime import timedelta
+from decimal import Decimal, ROUND_DOWN
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.availability import material_quantities
+from inventory.bom_cache import get_bom_version, get_exploded_lines
+from inventory.models import BOM, Batch, Product
+
+from .reservations import free_product_quantities
+
+
+ZERO = Decimal('0')
+QUANTITY_PLACES = Decimal('0.01')
+
+# 计算历史生产周期时取最近完成的任务数
+LEAD_TIME_SAMPLE_SIZE = 500
+
+_pending = threading.local()
+
+
+def get_snapshot_timeout():
+    """快照有效期（settings.ATP_SNAPSHOT_TIMEOUT，默认1小时）"""
+    return getattr(settings, 'ATP_SNAPSHOT_TIMEOUT', 60 * 60)
+
+
+def get_default_lead_days():
+    """无历史生产记录时的生产周期（settings.ATP_DEFAULT_LEAD_DAYS，默认3天）"""
+    return getattr(settings, 'ATP_DEFAULT_LEAD_DAYS', 3)
+
+
+def _snapshot_key(version, product_id):
+    return f'sales:atp:{version}:{product_id}'
+
+
+class ProductSnapshot:
+    """单个产品的可承诺快照"""
+
+    def __init__(self, product_id, unit, free_quantity, producible_quantity, lead_days, computed_at):
+        self.product_id = product_id
+        self.unit = unit
+        self.free_quantity = free_quantity  # 未预占的成品库存
+        self.producible_quantity = producible_quantity  # 按当前原料库存可生产的数量
+        self.lead_days = lead_days  # 平均生产周期（天）
+        self.computed_at = computed_at
+
+
+class Promise:
+    """一次 (产品, 数量) 的可承诺估算结果"""
+
+    STATUS_STOCK = 'stock'  # 现有库存即可满足
+    STATUS_PRODUCTION = 'production'  # 需要生产，原料充足
+    STATUS_PURCHASE = 'purchase'  # 原料也不足，需要采购
+
+    def __init__(self, snapshot, quantity, today):
+        self.snapshot = snapshot
+        self.quantity = quantity
+        self.from_stock = min(max(snapshot.free_quantity, ZERO), quantity)
+        self.from_production = min(snapshot.producible_quantity, quantity - self.from_stock)
+        self.shortfall = quantity - self.from_stock - self.from_production
+
+        if self.from_stock >= quantity:
+            self.status = self.STATUS_STOCK
+            self.estimated_date = today
+        elif self.shortfall <= 0:
+            self.status = self.STATUS_PRODUCTION
+            self.estimated_date = today + timedelta(days=max(math.ceil(snapshot.lead_days), 1))
+        else:
+            self.status = self.STATUS_PURCHASE
+            self.estimated_date = None
+
+    def as_dict(self):
+        snapshot = self.snapshot
+        return {
+            'product_id': snapshot.product_id,
+            'unit': snapshot.unit,
+            'quantity': float(self.quantity),
+            'free_quantity': float(snapshot.free_quantity),
+            'producible_quantity': float(snapshot.producible_quantity),
+            'from_stock': float(self.from_stock),
+            'from_production': float(self.from_production),
+            'shortfall': float(self.shortfall),
+            'lead_days': round(snapshot.lead_days, 1),
+            'status': self.status,
+            'estimated_date': self.estimated_date.isoformat() if self.estimated_date else None,
+            'snapshot_at': snapshot.computed_at.isoformat(),
+        }
+
+
+def production_lead_days(product_ids):
+    """历史平均生产周期 {product_id: 天数}，没有记录的产品用全部产品的平均值"""
+    from production.models import ProductionTask
+
+    rows = ProductionTask.objects.filter(
+        status='completed', received_at__isnull=False, completed_at__isnull=False,
+    ).order_by('-completed_at').values_list('product_id', 'received_at', 'completed_at')[:LEAD_TIME_SAMPLE_SIZE]
+
+    durations = {}
+    for product_id, received_at, completed_at in rows:
+        days = max((completed_at - received_at).total_seconds(), 0) / 86400
+        durations.setdefault(product_id, []).append(days)
+
+    all_days = [days for values in durations.values() for days in values]
+    fallback = sum(all_days) / len(all_days) if all_days else get_default_lead_days()
+    return {
+        product_id: sum(durations[product_id]) / len(durations[product_id]) if product_id in durations else fallback
+        for product_id in product_ids
+    }
+
+
+def _producible_quantities(product_ids):
+    """按当前原料库存可生产的数量 {product_id: 数量}，没有BOM的产品为0"""
+    exploded = get_exploded_lines(product_ids)
+    material_ids = {material_id for lines in exploded.values() for material_id, _qty, _unit in lines}
+    on_hand = material_quantities(material_ids) if material_ids else {}
+
+    producible = {}
+    for product_id in product_ids:
+        limits = [
+            max(on_hand.get(material_id, ZERO), ZERO) / quantity
+            for material_id, quantity, _unit in exploded.get(product_id, ()) if quantity > 0
+        ]
+        producible[product_id] = min(limits).quantize(QUANTITY_PLACES, rounding=ROUND_DOWN) if limits else ZERO
+    return producible
+
+
+def compute_snapshots(product_ids):
+    """计算多个产品的快照 {product_id: ProductSnapshot}"""
+    product_ids = set(product_ids)
+    units = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'unit'))
+    product_ids &= units.keys()
+    if not product_ids:
+        return {}
+
+    free = free_product_quantities(product_ids)
+    producible = _producible_quantities(product_ids)
+    lead_days = production_lead_days(product_ids)
+    now = timezone.now()
+    return {
+        product_id: ProductSnapshot(
+            product_id, units[product_id], free.get(product_id, ZERO), producible[product_id], lead_days[product_id], now,
+        )
+        for product_id in product_ids
+    }
+
+
+def get_snapshots(product_ids):
+    """读取多个产品的快照，未命中的批量计算后写回缓存"""
+    product_ids = set(product_ids)
+    version = get_bom_version()
+    keys = {_snapshot_key(version, product_id): product_id for product_id in product_ids}
+    snapshots = {keys[key]: snapshot for key, snapshot in cache.get_many(keys).items()}
+
+    missing = product_ids - snapshots.keys()
+    if missing:
+        computed = compute_snapshots(missing)
+        cache.set_many(
+            {_snapshot_key(version, product_id): snapshot for product_id, snapshot in computed.items()},
+            timeout=get_snapshot_timeout(),
+        )
+        snapshots.update(computed)
+    return snapshots
+
+
+def refresh_snapshots(product_ids=None):
+    """重新计算并写入快照（默认全部产品），返回写入的产品数"""
+    if product_ids is None:
+        product_ids = Product.objects.values_list('pk', flat=True)
+    version = get_bom_version()
+    computed = compute_snapshots(product_ids)
+    cache.set_many(
+        {_snapshot_key(version, product_id): snapshot for product_id, snapshot in computed.items()},
+        timeout=get_snapshot_timeout(),
+    )
+    return len(computed)
+
+
+def promise(product_id, quantity, today=None):
+    """估算 (产品, 数量) 的可承诺情况，产品不存在时返回 None"""
+    snapshot = get_snapshots([product_id]).get(product_id)
+    if snapshot is None:
+        return None
+    return Promise(snapshot, Decimal(quantity), today or timezone.localdate())
+
+
+def products_using_materials(material_ids):
+    """直接或经半成品用到这些原料的全部成品ID（按层向上查找BOM）"""
+    product_ids = set(BOM.objects.filter(material_id__in=material_ids).values_list('product_id', flat=True))
+    level = set(product_ids)
+    while level:
+        level = set(
+            BOM.objects.filter(component_product_id__in=level).values_list('product_id', flat=True)
+        ) - product_ids
+        product_ids |= level
+    return product_ids
+
+
+def invalidate_products(product_ids):
+    """删除这些产品当前版本的快照，下次查询时重新计算"""
+    if product_ids:
+        version = get_bom_version()
+        cache.delete_many([_snapshot_key(version, product_id) for product_id in product_ids])
+
+
+def _flush():
+    pending = getattr(_pending, 'changes', None)
+    if not pending or not any(pending.values()):
+        return
+    _pending.changes = None
+
+    product_ids = set(pending['products'])
+    if pending['batches']:
+        product_ids |= set(
+            Batch.objects.filter(
+                pk__in=pending['batches'], inventory__inventory_type='product',
+            ).values_list('inventory__product_id', flat=True)
+        )
+    if pending['materials']:
+        product_ids |= products_using_materials(pending['materials'])
+    invalidate_products(product_ids)
+
+
+def _register(kind, ids):
+    if getattr(_pending, 'changes', None) is None:
+        _pending.changes = {'products': set(), 'materials': set(), 'batches': set()}
+    _pending.changes[kind].update(ids)
+    transaction.on_commit(_flush)
+
+
+def mark_inventory_stale(inventory):
+    """库存总数量变化后登记，事务提交后合并失效受影响产品的快照"""
+    if inventory.inventory_type == 'product' and inventory.product_id:
+        _register('products', [inventory.product_id])
+    elif inventory.inventory_type == 'material' and inventory.material_id:
+        _register('materials', [inventory.material_id])
+
+
+def mark_batches_stale(batch_ids):
+    """批次预占数量变化后登记，事务提交后失效这些批次所属产品的快照"""
+    _register('batches', batch_ids)
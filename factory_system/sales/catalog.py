@@ -0,0 +1,167 @@
+"""
+订单表单的成品目录（库存、单价、在库批次）
+
+订单表单不再在页面中内嵌全部产品的库存和批次数据，改为选择产品时按需请求目录接口：
+- 每页两条查询：一条查询产品及其成品库存（LEFT JOIN），一条查询这些产品的在库批次
+- 结果为紧凑格式：批次用数组表示，列名在 batch_fields 中给出
+- 目录版本号存放在 Django 缓存中，库存数量、批次预占、批次、产品变化后递增（见 sales.signals），
+  接口以 版本号+日期+查询参数 作为 ETag，客户端重复请求时返回 304；计算结果按同一键缓存
+
+订单明细表单的产品下拉选项（名称、库存、基础单价）同样按目录版本号缓存（product_choices），
+一条联表查询生成，同一请求内的整个 formset 共用一份。
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.models import Batch, Product
+
+
+VERSION_KEY = 'sales:catalog:version'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+BATCH_FIELDS = ['id', 'batch_no', 'batch_date', 'quantity', 'reserved_quantity', 'available_quantity',
+                'unit_price', 'expiry_date', 'is_expired']
+
+# 目录页在缓存中的有效期（秒），版本号变化后旧页自然失效
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+
+def get_catalog_version():
+    """当前目录版本号"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # 以毫秒时间戳作为初始版本号，版本号被缓存淘汰后重新初始化也不会与旧的 ETag 重复
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """递增目录版本号，使所有目录页和 ETag 失效"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def bump_catalog_version_on_commit():
+    """事务提交后递增版本号（同一事务内多次调用只需最后一次生效，重复递增无害）"""
+    transaction.on_commit(bump_catalog_version)
+
+
+def catalog_tag(product_ids=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """目录页的标识：版本号 + 日期（批次是否过期随日期变化）+ 查询参数摘要，用作 ETag 和缓存键"""
+    if product_ids is not None:
+        params = 'ids:' + ','.join(str(product_id) for product_id in sorted(product_ids))
+    else:
+        params = f'page:{page}:{page_size}'
+    digest = hashlib.md5(params.encode()).hexdigest()[:12]
+    return f'{get_catalog_version()}-{timezone.now():%Y%m%d}-{digest}'
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def build_catalog(product_ids=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """构建目录页（两条查询）
+
+    product_ids 不为 None 时只返回这些产品，否则按SKU顺序分页（多取一条判断是否有下一页，不执行 COUNT）
+    """
+    products = Product.objects.order_by('sku').values_list(
+        'pk', 'name', 'unit', 'unit_price', 'inventory__quantity', 'inventory__unit',
+    )
+    has_next = False
+    if product_ids is not None:
+        rows = list(products.filter(pk__in=product_ids))
+    else:
+        offset = (page - 1) * page_size
+        rows = list(products[offset:offset + page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
+    catalog = {}
+    for pk, name, unit, unit_price, quantity, inventory_unit in rows:
+        catalog[str(pk)] = {
+            'n': name,
+            'q': _float(quantity) or 0,
+            'u': inventory_unit or unit,
+            'p': _float(unit_price) or 0.0,
+            'b': [],
+        }
+
+    if catalog:
+        today = timezone.now().date()  # 与 Batch.is_expired 一致
+        batches = Batch.objects.filter(
+            inventory__inventory_type='product', inventory__product_id__in=[pk for pk, *_rest in rows], quantity__gt=0,
+        ).order_by('batch_date', 'created_at').values_list(
+            'inventory__product_id', 'pk', 'batch_no', 'batch_date', 'quantity', 'reserved_quantity', 'unit_price',
+            'expiry_date',
+        )
+        for product_id, pk, batch_no, batch_date, quantity, reserved, unit_price, expiry_date in batches:
+            catalog[str(product_id)]['b'].append([
+                pk,
+                batch_no,
+                batch_date.strftime('%Y-%m-%d'),
+                float(quantity),
+                float(reserved),
+                float(max(quantity - reserved, 0)),
+                _float(unit_price),
+                expiry_date.strftime('%Y-%m-%d') if expiry_date else None,
+                bool(expiry_date and today > expiry_date),
+            ])
+
+    return {
+        'page': page if product_ids is None else None,
+        'has_next': has_next,
+        'batch_fields': BATCH_FIELDS,
+        'products': catalog,
+    }
+
+
+def get_catalog(product_ids=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """返回 (ETag, 目录页)，目录页按同一标识缓存"""
+    tag = catalog_tag(product_ids, page, page_size)
+    key = f'sales:catalog:page:{tag}'
+    data = cache.get(key)
+    if data is None:
+        data = build_catalog(product_ids, page, page_size)
+        cache.set(key, data, timeout=CATALOG_CACHE_TIMEOUT)
+    return f'W/"{tag}"', data
+
+
+def _build_product_choices():
+    choices = [('', '---------')]
+    rows = Product.objects.order_by('sku').values_list(
+        'pk', 'name', 'unit', 'unit_price', 'inventory__quantity', 'inventory__unit',
+    )
+    for pk, name, unit, unit_price, quantity, inventory_unit in rows:
+        # 没有成品库存记录的产品按0库存、产品单位显示
+        if quantity is None:
+            quantity = 0.0
+        else:
+            quantity, unit = float(quantity), inventory_unit
+        unit_price = float(unit_price) if unit_price else 0.0
+        # 在选项文本中显示库存数量和基础单价，便于销售预判
+        if quantity <= 0:
+            label = f"{name} (库存: {quantity}{unit} - 缺货 | 基础单价: ¥{unit_price:.2f})"
+        else:
+            label = f"{name} (库存: {quantity}{unit} | 基础单价: ¥{unit_price:.2f})"
+        choices.append((pk, label))
+    return choices
+
+
+def product_choices():
+    """订单明细的产品下拉选项 [(product_id, 显示文本)]，按目录版本号缓存，库存或单价变化后重新生成"""
+    key = f'sales:catalog:choices:{get_catalog_version()}'
+    choices = cache.get(key)
+    if choices is None:
+        choices = _build_product_choices()
+        cache.set(key, choices, timeout=CATALOG_CACHE_TIMEOUT)
+    return choices
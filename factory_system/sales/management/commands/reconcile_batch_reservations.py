@@ -0,0 +1,49 @@
+"""
+对账命令：按订单批次分配重新汇总批次预占数量，修复 Batch.reserved_quantity 的偏差
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from inventory.models import Batch
+from sales.atp import mark_batches_stale
+from sales.catalog import bump_catalog_version_on_commit
+from sales.reservations import reserved_quantities_from_allocations
+
+
+class Command(BaseCommand):
+    help = '核对并修复批次预占数量（按有效预占订单的批次分配重新汇总）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只报告偏差，不修改数据')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        
+        with transaction.atomic():
+            expected = reserved_quantities_from_allocations()
+            # 只检查有预占记录或应有预占的批次
+            batches = Batch.objects.select_for_update().filter(
+                Q(reserved_quantity__gt=0) | Q(reserved_quantity__lt=0) | Q(pk__in=list(expected))
+            ).only('pk', 'batch_no', 'reserved_quantity')
+            
+            drifted = []
+            for batch in batches:
+                correct = expected.get(batch.pk, 0)
+                if batch.reserved_quantity != correct:
+                    self.stdout.write(f'  批次 {batch.batch_no}：记录 {batch.reserved_quantity}，应为 {correct}')
+                    batch.reserved_quantity = correct
+                    drifted.append(batch)
+            
+            if not drifted:
+                self.stdout.write(self.style.SUCCESS('批次预占数量一致，无需修复'))
+                return
+            
+            if dry_run:
+                self.stdout.write(self.style.WARNING(f'发现 {len(drifted)} 个批次预占数量有偏差（未修改）'))
+                return
+            
+            Batch.objects.bulk_update(drifted, ['reserved_quantity'])
+            mark_batches_stale([batch.pk for batch in drifted])
+            bump_catalog_version_on_commit()
+            self.stdout.write(self.style.SUCCESS(f'已修复 {len(drifted)} 个批次的预占数量'))
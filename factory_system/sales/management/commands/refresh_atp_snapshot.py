@@ -0,0 +1,17 @@
+"""
+预先计算全部产品的可承诺量快照（见 sales.atp），部署后或缓存清空后执行，避免首次查询时临时计算
+"""
+from django.core.management.base import BaseCommand
+
+from sales.atp import refresh_snapshots
+
+
+class Command(BaseCommand):
+    help = '重新计算全部产品的可承诺量快照（未预占库存、按原料可生产数量、历史生产周期）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int, help='只刷新指定产品ID（默认全部产品）')
+
+    def handle(self, *args, **options):
+        count = refresh_snapshots(options['product_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'已刷新 {count} 个产品的可承诺量快照'))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+RESERVING_STATUSES = ('pending', 'approved', 'ceo_pending', 'ceo_approved', 'in_production', 'ready_to_ship')
+
+
+def backfill_reserved_quantity(apps, schema_editor):
+    """按有效预占订单的批次分配回填批次预占数量"""
+    Batch = apps.get_model('inventory', 'Batch')
+    SalesOrderItemBatch = apps.get_model('sales', 'SalesOrderItemBatch')
+    rows = SalesOrderItemBatch.objects.filter(
+        order_item__order__reserve_inventory=True,
+        order_item__order__status__in=RESERVING_STATUSES,
+    ).values('batch_id').annotate(total=models.Sum('quantity'))
+    for row in rows:
+        Batch.objects.filter(pk=row['batch_id']).update(reserved_quantity=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_batch_reserved_quantity'),
+        ('sales', '0009_salesorderitembatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_reserved_quantity, migrations.RunPython.noop),
+    ]
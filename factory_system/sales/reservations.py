@@ -0,0 +1,82 @@
+"""
+批次预占数量维护
+
+选择了"预占库存"且处于有效状态的订单，其批次分配计入 Batch.reserved_quantity。
+订单保存（含状态变化、预占开关变化）和批次分配增删时，在同一事务中按差额更新批次的预占数量，
+订单表单、发货、可承诺量检查直接读取 Batch.reserved_quantity / available_quantity，不再扫描全部批次分配。
+"""
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+
+from inventory.models import Batch, Inventory
+
+
+# 预占库存生效的订单状态
+RESERVING_STATUSES = ('pending', 'approved', 'ceo_pending', 'ceo_approved', 'in_production', 'ready_to_ship')
+
+
+def is_reserving(reserve_inventory, status):
+    """订单是否占用批次库存"""
+    return bool(reserve_inventory) and status in RESERVING_STATUSES
+
+
+def adjust_reserved_quantities(deltas):
+    """按 {batch_id: 数量差额} 一条 UPDATE 更新批次预占数量"""
+    from .atp import mark_batches_stale
+    from .catalog import bump_catalog_version_on_commit
+
+    deltas = {batch_id: delta for batch_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Batch.objects.filter(pk__in=deltas).update(
+        reserved_quantity=F('reserved_quantity') + Case(
+            *[When(pk=batch_id, then=Value(delta)) for batch_id, delta in deltas.items()],
+            default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+    mark_batches_stale(deltas.keys())
+    bump_catalog_version_on_commit()
+
+
+def order_batch_quantities(order_id):
+    """订单各批次的分配数量合计 {batch_id: 数量}"""
+    from .models import SalesOrderItemBatch
+    rows = SalesOrderItemBatch.objects.filter(order_item__order_id=order_id).values('batch_id').annotate(
+        total=Sum('quantity')
+    )
+    return {row['batch_id']: row['total'] for row in rows}
+
+
+def apply_order_reservations(order_id, sign):
+    """将订单的全部批次分配计入（sign=1）或移出（sign=-1）批次预占"""
+    adjust_reserved_quantities({
+        batch_id: sign * quantity for batch_id, quantity in order_batch_quantities(order_id).items()
+    })
+
+
+def reserved_quantities_from_allocations():
+    """按批次分配重新汇总的预占数量 {batch_id: 数量}，用于对账"""
+    from .models import SalesOrderItemBatch
+    rows = SalesOrderItemBatch.objects.filter(
+        order_item__order__reserve_inventory=True,
+        order_item__order__status__in=RESERVING_STATUSES,
+    ).values('batch_id').annotate(total=Sum('quantity'))
+    return {row['batch_id']: row['total'] for row in rows}
+
+
+def free_product_quantities(product_ids):
+    """成品未被订单预占的库存 {product_id: 数量}（库存数量 - 批次预占数量）"""
+    free = {}
+    rows = Inventory.objects.filter(
+        inventory_type='product', product_id__in=set(product_ids),
+    ).values_list('product_id', 'quantity')
+    for product_id, quantity in rows:
+        free[product_id] = free.get(product_id, Decimal('0')) + quantity
+    reserved = Batch.objects.filter(
+        inventory__inventory_type='product', inventory__product_id__in=free.keys(), reserved_quantity__gt=0,
+    ).values_list('inventory__product_id', 'reserved_quantity')
+    for product_id, quantity in reserved:
+        free[product_id] -= quantity
+    return free
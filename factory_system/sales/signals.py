@@ -0,0 +1,84 @@
+"""
+订单批次预占的信号处理：订单或批次分配变化时同步 Batch.reserved_quantity
+库存数量变化时失效相关产品的可承诺量快照（见 sales.atp），并递增订单表单成品目录的版本号（见 sales.catalog）
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from inventory.models import Batch, Product
+from inventory.signals import stock_changed
+
+from .atp import mark_inventory_stale
+from .catalog import bump_catalog_version_on_commit
+from .models import SalesOrder, SalesOrderItemBatch
+from .reservations import adjust_reserved_quantities, apply_order_reservations, is_reserving
+
+
+@receiver(pre_save, sender=SalesOrder)
+def remember_order_reserving(sender, instance, **kwargs):
+    """保存前记录订单在数据库中的预占状态"""
+    instance._was_reserving = False
+    if instance.pk:
+        previous = SalesOrder.objects.filter(pk=instance.pk).values_list('reserve_inventory', 'status').first()
+        if previous:
+            instance._was_reserving = is_reserving(*previous)
+
+
+@receiver(post_save, sender=SalesOrder)
+def sync_order_reservations(sender, instance, created, **kwargs):
+    """订单预占状态变化（状态流转、预占开关）时整体计入或移出批次预占"""
+    now_reserving = is_reserving(instance.reserve_inventory, instance.status)
+    was_reserving = getattr(instance, '_was_reserving', False)
+    if now_reserving != was_reserving and not created:
+        apply_order_reservations(instance.pk, 1 if now_reserving else -1)
+
+
+def _allocation_order_reserving(allocation):
+    state = SalesOrder.objects.filter(items__pk=allocation.order_item_id).values_list(
+        'reserve_inventory', 'status'
+    ).first()
+    return bool(state) and is_reserving(*state)
+
+
+@receiver(pre_save, sender=SalesOrderItemBatch)
+def remember_allocation(sender, instance, **kwargs):
+    """保存前记录原分配的批次和数量（修改分配时先移出旧值）"""
+    instance._previous_allocation = None
+    if instance.pk:
+        instance._previous_allocation = SalesOrderItemBatch.objects.filter(pk=instance.pk).values_list(
+            'batch_id', 'quantity'
+        ).first()
+
+
+@receiver(post_save, sender=SalesOrderItemBatch)
+def reserve_allocation(sender, instance, **kwargs):
+    if not _allocation_order_reserving(instance):
+        return
+    deltas = {instance.batch_id: instance.quantity}
+    previous = getattr(instance, '_previous_allocation', None)
+    if previous:
+        batch_id, quantity = previous
+        deltas[batch_id] = deltas.get(batch_id, 0) - quantity
+    adjust_reserved_quantities(deltas)
+
+
+@receiver(post_delete, sender=SalesOrderItemBatch)
+def release_allocation(sender, instance, **kwargs):
+    if _allocation_order_reserving(instance):
+        adjust_reserved_quantities({instance.batch_id: -instance.quantity})
+
+
+@receiver(stock_changed)
+def invalidate_atp_snapshot(sender, inventory, **kwargs):
+    mark_inventory_stale(inventory)
+    if inventory.inventory_type == 'product':
+        bump_catalog_version_on_commit()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Batch)
+@receiver(post_delete, sender=Batch)
+def invalidate_catalog(sender, instance, **kwargs):
+    """产品（名称、单位、单价）或批次（批次号、日期、过期日期）变化"""
+    bump_catalog_version_on_commit()
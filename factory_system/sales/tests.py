@@ -1,3 +1,254 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import UserProfile
+from inventory import bom_cache
+from inventory.allocation import change_quantity, receive_stock
+from inventory.models import BOM, Batch, Customer, Inventory, Material, Product, StockTransaction
+from inventory.signals import stock_changed
+from logistics.models import Shipment
+
+from . import atp, catalog
+from .models import SalesOrder, SalesOrderItem, SalesOrderItemBatch, ShippingNotice
+from .reservations import reserved_quantities_from_allocations
+from .views import terminate_order_chain
+
+
+def create_order(salesperson, product, quantity, order_no='SO-TEST-1', **fields):
+    customer, _created = Customer.objects.get_or_create(
+        name='测试客户', defaults={'contact_person': '张三', 'phone': '123', 'address': '地址'},
+    )
+    order = SalesOrder.objects.create(order_no=order_no, customer=customer, salesperson=salesperson, **fields)
+    SalesOrderItem.objects.create(
+        order=order, product=product, quantity=quantity, unit_price=product.sale_price,
+        subtotal=product.sale_price * quantity,
+    )
+    return order
+
+
+def create_product_stock(sku='P-TEST', batches=((date(2026, 1, 1), 10),)):
+    """成品及其批次库存，返回 (产品, 库存, [批次])"""
+    product = Product.objects.create(sku=sku, name=f'产品{sku}', sale_price=Decimal('10'), unit='袋')
+    inventory = Inventory.objects.create(inventory_type='product', product=product, quantity=0, unit='袋')
+    created = [
+        receive_stock(inventory, Decimal(quantity), batch_no=f'{sku}-{batch_date:%m%d}', batch_date=batch_date)
+        for batch_date, quantity in batches
+    ]
+    return product, inventory, created
+
+
+class ReservationCounterTests(TestCase):
+    """批次预占数量：按差额维护，始终等于有效预占订单的批次分配合计"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('sales1')
+        self.product, _inventory, (self.batch, self.other_batch) = create_product_stock(
+            batches=((date(2026, 1, 1), 10), (date(2026, 2, 1), 10)),
+        )
+        self.order = create_order(self.user, self.product, Decimal('6'), status='pending', reserve_inventory=True)
+        self.item = self.order.items.get()
+
+    def reserved(self, batch):
+        return Batch.objects.get(pk=batch.pk).reserved_quantity
+
+    def assert_matches_allocations(self):
+        expected = reserved_quantities_from_allocations()
+        for batch in Batch.objects.all():
+            self.assertEqual(batch.reserved_quantity, expected.get(batch.pk, 0), batch.batch_no)
+
+    def test_allocation_changes(self):
+        allocation = SalesOrderItemBatch.objects.create(order_item=self.item, batch=self.batch, quantity=Decimal('6'))
+        self.assertEqual(self.reserved(self.batch), Decimal('6'))
+        allocation.quantity = Decimal('4')
+        allocation.save()
+        self.assertEqual(self.reserved(self.batch), Decimal('4'))
+        allocation.batch = self.other_batch
+        allocation.save()
+        self.assertEqual(self.reserved(self.batch), Decimal('0'))
+        self.assertEqual(self.reserved(self.other_batch), Decimal('4'))
+        allocation.delete()
+        self.assertEqual(self.reserved(self.other_batch), Decimal('0'))
+        self.assert_matches_allocations()
+
+    def test_order_status_and_reserve_flag(self):
+        SalesOrderItemBatch.objects.create(order_item=self.item, batch=self.batch, quantity=Decimal('6'))
+        self.order.status = 'cancelled'
+        self.order.save()
+        self.assertEqual(self.reserved(self.batch), Decimal('0'))
+        self.order.status = 'pending'
+        self.order.save()
+        self.assertEqual(self.reserved(self.batch), Decimal('6'))
+        self.order.reserve_inventory = False
+        self.order.save()
+        self.assertEqual(self.reserved(self.batch), Decimal('0'))
+        self.assert_matches_allocations()
+
+    def test_non_reserving_order_and_cascade_delete(self):
+        other = create_order(self.user, self.product, Decimal('3'), order_no='SO-TEST-2', status='pending')
+        SalesOrderItemBatch.objects.create(order_item=other.items.get(), batch=self.batch, quantity=Decimal('3'))
+        SalesOrderItemBatch.objects.create(order_item=self.item, batch=self.batch, quantity=Decimal('6'))
+        self.assertEqual(self.reserved(self.batch), Decimal('6'))
+        self.order.delete()
+        self.assertEqual(self.reserved(self.batch), Decimal('0'))
+        self.assert_matches_allocations()
+
+
+class ATPSnapshotTests(TestCase):
+    """可承诺量快照：缓存命中不查询，库存、原料、预占变化提交后失效受影响产品"""
+
+    def setUp(self):
+        cache.clear()
+        bom_cache._local.__dict__.clear()
+        self.user = User.objects.create_user('sales1')
+        UserProfile.objects.create(user=self.user, role='sales')
+        self.product, self.inventory, (self.batch,) = create_product_stock()
+        self.cement = Material.objects.create(sku='M-C', name='水泥', unit='kg')
+        BOM.objects.create(product=self.product, material=self.cement, quantity=Decimal('2'), unit='kg')
+        self.cement_stock = Inventory.objects.create(
+            inventory_type='material', material=self.cement, quantity=Decimal('20'), unit='kg',
+        )
+
+    def snapshot(self):
+        return atp.get_snapshots([self.product.pk])[self.product.pk]
+
+    def receive(self, inventory, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                receive_stock(inventory, Decimal(quantity), batch_no='IN', batch_date=date(2026, 3, 1))
+
+    def test_promise_status(self):
+        self.assertEqual(atp.promise(self.product.pk, 8).status, atp.Promise.STATUS_STOCK)
+        production = atp.promise(self.product.pk, 15)
+        self.assertEqual(production.status, atp.Promise.STATUS_PRODUCTION)
+        self.assertEqual((production.from_stock, production.from_production), (Decimal('10'), Decimal('5')))
+        self.assertEqual(atp.promise(self.product.pk, 100).shortfall, Decimal('80'))
+
+    def test_cached_snapshot_without_queries(self):
+        self.snapshot()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.snapshot().free_quantity, Decimal('10'))
+
+    def test_product_stock_change(self):
+        self.snapshot()
+        self.receive(self.inventory, 5)
+        self.assertEqual(self.snapshot().free_quantity, Decimal('15'))
+
+    def test_material_change_invalidates_products_using_it(self):
+        self.assertEqual(self.snapshot().producible_quantity, Decimal('10'))
+        self.receive(self.cement_stock, 10)
+        self.assertEqual(self.snapshot().producible_quantity, Decimal('15'))
+
+    def test_reservation_change(self):
+        self.snapshot()
+        order = create_order(self.user, self.product, Decimal('4'), status='pending', reserve_inventory=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            SalesOrderItemBatch.objects.create(order_item=order.items.get(), batch=self.batch, quantity=Decimal('4'))
+        self.assertEqual(self.snapshot().free_quantity, Decimal('6'))
+
+    def test_api_rejects_invalid_quantity(self):
+        self.client.force_login(self.user)
+        for quantity in ('NaN', 'Infinity', 'abc', '-1'):
+            response = self.client.get('/sales/atp/', {'product': self.product.pk, 'quantity': quantity})
+            self.assertEqual(response.status_code, 400, quantity)
+        response = self.client.get('/sales/atp/', {'product': self.product.pk, 'quantity': '8'})
+        self.assertEqual(response.json()['status'], atp.Promise.STATUS_STOCK)
+
+
+class CatalogVersionTests(TestCase):
+    """订单表单成品目录：ETag 条件请求，库存、预占、产品变化提交后版本号递增"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sales1')
+        UserProfile.objects.create(user=self.user, role='sales')
+        self.client.force_login(self.user)
+        self.product, self.inventory, (self.batch,) = create_product_stock()
+
+    def get(self, etag=''):
+        return self.client.get('/sales/catalog/', {'product': self.product.pk}, HTTP_IF_NONE_MATCH=etag)
+
+    def entry(self, response):
+        return response.json()['products'][str(self.product.pk)]
+
+    def test_not_modified(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.entry(first)['q'], 10)
+        self.assertEqual(self.get(first['ETag']).status_code, 304)
+
+    def test_stock_change(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                change_quantity(self.inventory, Decimal('5'))
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.entry(response)['q'], 15)
+
+    def test_reservation_change(self):
+        etag = self.get()['ETag']
+        order = create_order(self.user, self.product, Decimal('4'), status='pending', reserve_inventory=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            SalesOrderItemBatch.objects.create(order_item=order.items.get(), batch=self.batch, quantity=Decimal('4'))
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        available = self.entry(response)['b'][0][catalog.BATCH_FIELDS.index('available_quantity')]
+        self.assertEqual(available, 6)
+
+    def test_product_change(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.unit_price = Decimal('12.50')
+            self.product.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.entry(response)['p'], 12.5)
+
+    def test_product_choices_follow_version(self):
+        catalog.product_choices()
+        with self.assertNumQueries(0):
+            choices = dict(catalog.product_choices())
+        self.assertIn('库存: 10.0袋', choices[self.product.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                change_quantity(self.inventory, Decimal('-10'))
+        self.assertIn('缺货', dict(catalog.product_choices())[self.product.pk])
+
+
+class TerminateOrderChainTests(TestCase):
+    """终结已发货订单：退回的库存经 adjust_stock 入库"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('ceo1')
+        self.product = Product.objects.create(sku='P-TEST', name='测试产品', sale_price=Decimal('10'), unit='袋')
+        self.order = create_order(self.user, self.product, Decimal('5'), status='shipped')
+        notice = ShippingNotice.objects.create(notice_no='SN-TEST-1', order=self.order, status='shipped')
+        Shipment.objects.create(
+            shipment_no='SH-TEST-1', shipping_notice=notice, order=self.order, status='shipped', shipped_by=self.user,
+        )
+
+    def test_returns_stock_without_existing_inventory(self):
+        changed = []
+
+        def receiver(sender, inventory, **kwargs):
+            changed.append(inventory.pk)
+
+        stock_changed.connect(receiver)
+        try:
+            terminate_order_chain(self.order, self.user, '客户取消')
+        finally:
+            stock_changed.disconnect(receiver)
+
+        inventory = Inventory.objects.get(inventory_type='product', product=self.product)
+        self.assertEqual(inventory.quantity, Decimal('5'))
+        self.assertEqual(changed, [inventory.pk])
+        stock_transaction = StockTransaction.objects.get(inventory=inventory)
+        self.assertEqual(stock_transaction.transaction_type, 'adjustment')
+        self.assertEqual(stock_transaction.quantity, Decimal('5'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'terminated')
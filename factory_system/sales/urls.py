@@ -14,5 +14,7 @@ urlpatterns = [
     path('orders/<int:pk>/ceo-reject/', views.ceo_reject, name='ceo_reject'),
     path('orders/<int:pk>/terminate/', views.order_terminate, name='order_terminate'),
     path('orders/<int:pk>/cancel/', views.order_cancel, name='order_cancel'),
+    path('atp/', views.atp_api, name='atp_api'),
+    path('catalog/', views.catalog_api, name='catalog_api'),
 ]
 
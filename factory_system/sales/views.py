@@ -4,12 +4,15 @@ from django.contrib import messages
 from django.db import transaction
 from django.utils import timezone
 from django.core.paginator import Paginator
-import json
+from django.http import JsonResponse, HttpResponseNotModified
 from decimal import Decimal, InvalidOperation
-from accounts.decorators import role_required
+from accounts.decorators import role_required, session_readonly
 from .models import SalesOrder, SalesOrderItem, SalesOrderItemBatch, ShippingNotice
-from inventory.models import Customer, Product, Inventory, Batch
+from inventory.models import Customer, Inventory, Batch
+from inventory.allocation import adjust_stock
+from inventory.numbering import next_number, PREFIX_SALES_ORDER, PREFIX_PRODUCTION_TASK, PREFIX_SHIPPING_NOTICE
 from production.models import ProductionTask, MaterialRequisition
+from production.material_blocks import block_tasks, clear_blocks
 
 
 @login_required
@@ -51,6 +54,10 @@ def order_list(request):
 def order_create(request, order_pk=None):
     """创建订单或编辑被退回的订单"""
     from .forms import SalesOrderForm, SalesOrderItemFormSet
+    from .catalog import product_choices
+    
+    # 产品下拉选项每个请求只取一次，formset 中的所有明细表单共用
+    item_form_kwargs = {'product_choices': product_choices()}
     
     # 如果是编辑被退回的订单
     order = None
@@ -70,9 +77,9 @@ def order_create(request, order_pk=None):
         # 编辑时使用不同的formset
         from .forms import SalesOrderItemFormSet, SalesOrderItemFormSetEdit
         if order_pk:
-            formset = SalesOrderItemFormSetEdit(request.POST, instance=order)
+            formset = SalesOrderItemFormSetEdit(request.POST, instance=order, form_kwargs=item_form_kwargs)
         else:
-            formset = SalesOrderItemFormSet(request.POST, instance=order)
+            formset = SalesOrderItemFormSet(request.POST, instance=order, form_kwargs=item_form_kwargs)
         
         if form.is_valid() and formset.is_valid():
             # 验证至少有一个订单明细
@@ -90,7 +97,7 @@ def order_create(request, order_pk=None):
                 order = form.save(commit=False)
                 if not order_pk:  # 新建订单
                     order.salesperson = request.user
-                    order.order_no = f"SO{timezone.now().strftime('%Y%m%d%H%M%S')}"
+                    order.order_no = next_number(PREFIX_SALES_ORDER)
                 else:  # 编辑被退回的订单，重置状态为待审批
                     order.status = 'pending'
                     order.rejected_by = None
@@ -168,92 +175,72 @@ def order_create(request, order_pk=None):
         # 编辑时，extra=0，不显示空行；新建时，extra=1，显示一个空行
         from .forms import SalesOrderItemFormSet, SalesOrderItemFormSetEdit
         if order_pk:
-            formset = SalesOrderItemFormSetEdit(instance=order, queryset=order.items.all())
+            formset = SalesOrderItemFormSetEdit(instance=order, queryset=order.items.all(), form_kwargs=item_form_kwargs)
         else:
             # 新建订单时，instance=None，只显示一个空行
-            formset = SalesOrderItemFormSet(instance=None)
+            formset = SalesOrderItemFormSet(instance=None, form_kwargs=item_form_kwargs)
     
     title = '编辑订单' if order_pk else '创建订单'
     
-    # 获取产品库存数据和批次数据用于前端显示
-    import json
-    from django.db.models import Sum, Q
-    products = Product.objects.all()
-    product_inventory_data = {}
-    product_batches_data = {}
-    
-    # 计算每个批次已被预占的数量（只统计选择了"预占库存"且订单状态有效的订单）
-    # 有效状态：pending, approved, ceo_pending, ceo_approved, in_production, ready_to_ship
-    # 排除当前正在编辑的订单（如果存在）
-    valid_statuses = ['pending', 'approved', 'ceo_pending', 'ceo_approved', 'in_production', 'ready_to_ship']
-    batch_reserved_qty = {}
-    
-    # 获取所有选择了"预占库存"且状态有效的订单的批次分配
-    reserved_batch_allocations = SalesOrderItemBatch.objects.filter(
-        order_item__order__reserve_inventory=True,
-        order_item__order__status__in=valid_statuses
-    )
-    
-    # 如果正在编辑订单，排除当前订单的预占
-    if order_pk:
-        reserved_batch_allocations = reserved_batch_allocations.exclude(order_item__order__pk=order_pk)
-    
-    # 按批次汇总已预占的数量
-    for allocation in reserved_batch_allocations:
-        batch_id = allocation.batch.id
-        if batch_id not in batch_reserved_qty:
-            batch_reserved_qty[batch_id] = Decimal('0')
-        batch_reserved_qty[batch_id] += allocation.quantity
-    
-    for product in products:
-        try:
-            inventory = Inventory.objects.get(inventory_type='product', product=product)
-            batches = inventory.get_batches().filter(quantity__gt=0).order_by('batch_date', 'created_at')
-            product_inventory_data[str(product.pk)] = {
-                'quantity': float(inventory.quantity),
-                'unit': inventory.unit,
-                'unit_price': float(product.unit_price) if product.unit_price else 0.0
-            }
-            product_batches_data[str(product.pk)] = []
-            
-            for batch in batches:
-                # 计算该批次已被预占的数量
-                reserved_qty = float(batch_reserved_qty.get(batch.id, Decimal('0')))
-                # 可用数量 = 批次数量 - 已预占数量
-                available_qty = float(batch.quantity) - reserved_qty
-                
-                product_batches_data[str(product.pk)].append({
-                    'id': batch.id,
-                    'batch_no': batch.batch_no,
-                    'batch_date': batch.batch_date.strftime('%Y-%m-%d'),
-                    'quantity': float(batch.quantity),  # 总数量
-                    'available_quantity': max(0, available_qty),  # 可用数量（排除已预占）
-                    'reserved_quantity': reserved_qty,  # 已预占数量
-                    'unit_price': float(batch.unit_price) if batch.unit_price else None,
-                    'expiry_date': batch.expiry_date.strftime('%Y-%m-%d') if batch.expiry_date else None,
-                    'is_expired': batch.is_expired(),
-                })
-        except Inventory.DoesNotExist:
-            product_inventory_data[str(product.pk)] = {
-                'quantity': 0,
-                'unit': product.unit,
-                'unit_price': float(product.unit_price) if product.unit_price else 0.0
-            }
-            product_batches_data[str(product.pk)] = []
-    
-    product_inventory_data_json = json.dumps(product_inventory_data)
-    product_batches_data_json = json.dumps(product_batches_data)
-    
+    # 产品库存和批次数据不再内嵌到页面，选择产品时由前端请求 catalog_api 按需加载
     return render(request, 'sales/order_form.html', {
         'form': form, 
         'formset': formset, 
         'title': title, 
         'order': order,
-        'product_inventory_data_json': product_inventory_data_json,
-        'product_batches_data_json': product_batches_data_json
     })
 
 
+@session_readonly
+@login_required
+@role_required('sales', 'ceo')
+def catalog_api(request):
+    """订单表单的成品目录API：?product=1,2 按产品加载，或 ?page=&page_size= 分页加载；支持 ETag 条件请求"""
+    from .catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, get_catalog
+    
+    try:
+        product_ids = None
+        if request.GET.get('product'):
+            product_ids = sorted({int(pk) for pk in request.GET['product'].split(',') if pk.strip()})[:MAX_PAGE_SIZE]
+        page = max(int(request.GET.get('page') or 1), 1)
+        page_size = min(max(int(request.GET.get('page_size') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': '参数格式不正确'}, status=400)
+    
+    etag, data = get_catalog(product_ids, page, page_size)
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@session_readonly
+@login_required
+@role_required('sales', 'ceo')
+def atp_api(request):
+    """可承诺量API：按产品和数量估算可承诺数量和预计交付日期（订单表单输入时调用）"""
+    from .atp import promise
+    
+    try:
+        product_id = int(request.GET.get('product', ''))
+        quantity = Decimal(request.GET.get('quantity') or '0')
+    except (ValueError, InvalidOperation):
+        return JsonResponse({'error': '产品或数量格式不正确'}, status=400)
+    # Decimal 能解析 NaN、Infinity，比较时会抛出异常，按格式错误处理
+    if not quantity.is_finite():
+        return JsonResponse({'error': '产品或数量格式不正确'}, status=400)
+    if quantity < 0:
+        return JsonResponse({'error': '数量不能为负数'}, status=400)
+    
+    result = promise(product_id, quantity)
+    if result is None:
+        return JsonResponse({'error': '产品不存在'}, status=404)
+    return JsonResponse(result.as_dict())
+
+
 @login_required
 @role_required('sales', 'sales_mgr', 'warehouse', 'ceo')
 def order_detail(request, pk):
@@ -483,7 +470,7 @@ def ceo_reject(request, pk):
 def terminate_order_chain(order, terminated_by, terminate_reason):
     """终结订单及其所有关联流程的完整链路"""
     from logistics.models import Shipment
-    from inventory.models import Inventory, StockTransaction
+    from inventory.models import Inventory
     
     with transaction.atomic():
         # 1. 检查订单是否已出库，如果已出库，需要重新入库
@@ -497,43 +484,21 @@ def terminate_order_chain(order, terminated_by, terminate_reason):
             if shipped_shipments.exists():
                 # 对于已发货的商品，需要重新入库
                 for item in order.items.all():
-                    try:
-                        inventory = Inventory.objects.get(
-                            inventory_type='product',
-                            product=item.product
-                        )
-                        # 重新入库：增加库存
-                        inventory.quantity += item.quantity
-                        inventory.save()
-                        
-                        # 记录库存变动（使用adjustment类型，备注说明是终结退回）
-                        StockTransaction.objects.create(
-                            transaction_type='adjustment',
-                            inventory=inventory,
-                            quantity=item.quantity,
-                            unit=item.product.unit,
-                            reference_no=f"TERMINATE-{order.order_no}",
-                            remark=f"订单终结退回：{terminate_reason}",
-                            operator=terminated_by,
-                        )
-                    except Inventory.DoesNotExist:
-                        # 如果库存不存在，创建新的库存记录
-                        inventory = Inventory.objects.create(
-                            inventory_type='product',
-                            product=item.product,
-                            quantity=item.quantity,
-                            unit=item.product.unit,
-                        )
-                        # 记录库存变动
-                        StockTransaction.objects.create(
-                            transaction_type='adjustment',
-                            inventory=inventory,
-                            quantity=item.quantity,
-                            unit=item.product.unit,
-                            reference_no=f"TERMINATE-{order.order_no}",
-                            remark=f"订单终结退回：{terminate_reason}",
-                            operator=terminated_by,
-                        )
+                    # 库存不存在时先创建空库存记录，数量统一由 adjust_stock 增加
+                    inventory, created = Inventory.objects.get_or_create(
+                        inventory_type='product',
+                        product=item.product,
+                        defaults={'quantity': 0, 'unit': item.product.unit}
+                    )
+                    # 重新入库：增加库存（启用批次的库存同步新建退回批次），并记录库存变动（adjustment类型）
+                    adjust_stock(
+                        inventory,
+                        item.quantity,
+                        operator=terminated_by,
+                        reference_no=f"TERMINATE-{order.order_no}",
+                        unit=item.product.unit,
+                        remark=f"订单终结退回：{terminate_reason}",
+                    )
         
         # 2. 检查订单是否在审核时锁定了库存（ready_to_ship状态但未发货）
         # 如果订单状态是ready_to_ship，说明审核时库存充足，已经锁定了库存
@@ -549,43 +514,20 @@ def terminate_order_chain(order, terminated_by, terminate_reason):
                 
                 # 如果没有生产任务，说明审核时库存充足，已经锁定了库存
                 if not has_production_task:
-                    try:
-                        inventory = Inventory.objects.get(
-                            inventory_type='product',
-                            product=item.product
-                        )
-                        # 退回锁定的库存：增加库存
-                        inventory.quantity += item.quantity
-                        inventory.save()
-                        
-                        # 记录库存变动
-                        StockTransaction.objects.create(
-                            transaction_type='adjustment',
-                            inventory=inventory,
-                            quantity=item.quantity,
-                            unit=item.product.unit,
-                            reference_no=f"TERMINATE-{order.order_no}",
-                            remark=f"订单终结退回锁定库存：{terminate_reason}",
-                            operator=terminated_by,
-                        )
-                    except Inventory.DoesNotExist:
-                        # 如果库存不存在，创建新的库存记录
-                        inventory = Inventory.objects.create(
-                            inventory_type='product',
-                            product=item.product,
-                            quantity=item.quantity,
-                            unit=item.product.unit,
-                        )
-                        # 记录库存变动
-                        StockTransaction.objects.create(
-                            transaction_type='adjustment',
-                            inventory=inventory,
-                            quantity=item.quantity,
-                            unit=item.product.unit,
-                            reference_no=f"TERMINATE-{order.order_no}",
-                            remark=f"订单终结退回锁定库存：{terminate_reason}",
-                            operator=terminated_by,
-                        )
+                    inventory, created = Inventory.objects.get_or_create(
+                        inventory_type='product',
+                        product=item.product,
+                        defaults={'quantity': 0, 'unit': item.product.unit}
+                    )
+                    # 退回锁定的库存：增加库存（启用批次的库存同步新建退回批次），并记录库存变动（adjustment类型）
+                    adjust_stock(
+                        inventory,
+                        item.quantity,
+                        operator=terminated_by,
+                        reference_no=f"TERMINATE-{order.order_no}",
+                        unit=item.product.unit,
+                        remark=f"订单终结退回锁定库存：{terminate_reason}",
+                    )
         
         # 2. 终结产品订单
         order.status = 'terminated'
@@ -614,6 +556,8 @@ def terminate_order_chain(order, terminated_by, terminate_reason):
                         requisition.terminate_reason = f"关联订单 {order.order_no} 已终结：{terminate_reason}"
                         requisition.save()
         
+        clear_blocks([task.pk for task in production_tasks])
+        
         # 注意：ShippingNotice和Shipment模型没有terminated状态，但可以通过订单状态判断是否已终结
 
 
@@ -656,94 +600,53 @@ def order_terminate(request, pk):
     return render(request, 'sales/order_terminate.html', context)
 
 
+def _order_items_with_allocations(order):
+    """订单明细，附带批次分配合计（batch_allocated）和成品库存（product_stock），查询次数与明细数量无关"""
+    items = list(order.items.select_related('product').prefetch_related('batch_allocations').order_by('pk'))
+    product_stock = dict(Inventory.objects.filter(
+        inventory_type='product', product_id__in={item.product_id for item in items},
+    ).values_list('product_id', 'quantity'))
+    for item in items:
+        item.batch_allocated = sum(
+            (order_batch.quantity for order_batch in item.batch_allocations.all()), Decimal('0')
+        )
+        item.product_stock = product_stock.get(item.product_id, 0)
+    return items
+
+
 def check_inventory_status(order):
     """检查库存状态（不实际创建任务，仅用于显示判断结果）
     支持部分批次分配：如果批次分配总和小于订单数量，不足部分需要生产
     """
-    from inventory.models import BOM
-    from decimal import Decimal
-    from sales.models import SalesOrderItemBatch
+    from inventory.availability import check_material_availability
+    
+    items = _order_items_with_allocations(order)
+    # 计算需要生产的数量（订单数量 - 批次分配总和），有缺口的产品一次检查原料
+    shortages = [max(Decimal('0'), item.quantity - item.batch_allocated) for item in items]
+    availability = check_material_availability(
+        (item.product_id, shortage) for item, shortage in zip(items, shortages) if shortage > 0
+    )
+    material_checks = iter(availability)
     
     result = {
         'all_sufficient': True,
         'items': [],
-        'material_requirements': {},  # 汇总所有原料需求 {material_id: {'material': Material, 'required': Decimal, 'available': Decimal, 'shortage': Decimal}}
+        'material_requirements': availability.materials,  # 汇总所有原料需求 {material_id: MaterialTotal}
         'next_step': None,
         'next_step_display': None,
     }
     
-    for item in order.items.all():
-        # 计算该订单项已分配的批次数量总和
-        batch_allocated_qty = Decimal('0')
-        order_batch_allocations = SalesOrderItemBatch.objects.filter(order_item=item)
-        for order_batch in order_batch_allocations:
-            batch_allocated_qty += order_batch.quantity
-        
-        # 计算需要生产的数量（订单数量 - 批次分配总和）
-        shortage = max(Decimal('0'), item.quantity - batch_allocated_qty)
-        
-        # 获取成品库存（用于显示）
-        try:
-            inventory = Inventory.objects.get(inventory_type='product', product=item.product)
-            available_qty = inventory.quantity
-        except Inventory.DoesNotExist:
-            available_qty = 0
-        
+    for item, shortage in zip(items, shortages):
         item_result = {
             'product': item.product,
             'required_quantity': item.quantity,
-            'batch_allocated_quantity': batch_allocated_qty,  # 批次分配的总和
-            'available_quantity': available_qty,  # 总库存（用于显示）
-            'sufficient': batch_allocated_qty >= item.quantity,  # 批次分配是否充足
+            'batch_allocated_quantity': item.batch_allocated,  # 批次分配的总和
+            'available_quantity': item.product_stock,  # 总库存（用于显示）
+            'sufficient': item.batch_allocated >= item.quantity,  # 批次分配是否充足
             'shortage': shortage,  # 需要生产的数量
-            'material_needs': [],  # 该产品缺口所需的原料列表
+            # 生产缺口数量所需的原料列表
+            'material_needs': next(material_checks).lines if shortage > 0 else [],
         }
-        
-        # 如果有缺口（批次分配不足），计算生产缺口产品所需的原料
-        if shortage > 0:
-            bom_items = BOM.objects.filter(product=item.product)
-            for bom_item in bom_items:
-                # 计算生产缺口数量所需该原料的数量
-                material_required = bom_item.quantity * shortage
-                
-                # 获取该原料的库存
-                try:
-                    material_inventory = Inventory.objects.get(
-                        inventory_type='material',
-                        material=bom_item.material
-                    )
-                    material_available = material_inventory.quantity
-                except Inventory.DoesNotExist:
-                    material_available = Decimal('0')
-                
-                material_shortage = max(Decimal('0'), material_required - material_available)
-                
-                # 记录该产品的原料需求
-                item_result['material_needs'].append({
-                    'material': bom_item.material,
-                    'required': material_required,
-                    'available': material_available,
-                    'shortage': material_shortage,
-                    'unit': bom_item.unit,
-                })
-                
-                # 汇总到总原料需求中
-                material_id = bom_item.material.id
-                if material_id not in result['material_requirements']:
-                    result['material_requirements'][material_id] = {
-                        'material': bom_item.material,
-                        'required': Decimal('0'),
-                        'available': material_available,
-                        'shortage': Decimal('0'),
-                        'unit': bom_item.unit,
-                    }
-                result['material_requirements'][material_id]['required'] += material_required
-                result['material_requirements'][material_id]['shortage'] = max(
-                    Decimal('0'),
-                    result['material_requirements'][material_id]['required'] - 
-                    result['material_requirements'][material_id]['available']
-                )
-        
         result['items'].append(item_result)
         
         if not item_result['sufficient']:
@@ -765,60 +668,45 @@ def check_inventory_and_create_tasks(order):
     支持部分批次分配：如果批次分配总和小于订单数量，不足部分创建生产任务
     """
     from django.db import transaction
-    from sales.models import SalesOrderItemBatch
+    from inventory.availability import check_material_availability
     
     with transaction.atomic():
-        all_sufficient = True
+        items = _order_items_with_allocations(order)
+        # 计算需要生产的数量（订单数量 - 批次分配总和）
+        production_items = [
+            (item, item.quantity - item.batch_allocated) for item in items
+            if item.quantity - item.batch_allocated > 0
+        ]
+        all_sufficient = not production_items
         
-        for item in order.items.all():
-            # 计算该订单项已分配的批次数量总和
-            batch_allocated_qty = Decimal('0')
-            order_batch_allocations = SalesOrderItemBatch.objects.filter(order_item=item)
-            for order_batch in order_batch_allocations:
-                batch_allocated_qty += order_batch.quantity
-            
-            # 计算需要生产的数量（订单数量 - 批次分配总和）
-            shortage = item.quantity - batch_allocated_qty
-            
-            if shortage > 0:
-                # 批次分配不足，需要生产不足的部分
-                all_sufficient = False
-                
-                # 检查原材料是否充足
-                from inventory.models import BOM
-                material_sufficient = True
-                bom_items = BOM.objects.filter(product=item.product)
-                for bom_item in bom_items:
-                    material_required = bom_item.quantity * shortage
-                    try:
-                        material_inventory = Inventory.objects.get(
-                            inventory_type='material',
-                            material=bom_item.material
-                        )
-                        if material_inventory.quantity < material_required:
-                            material_sufficient = False
-                            break
-                    except Inventory.DoesNotExist:
-                        material_sufficient = False
-                        break
-                
-                # 创建生产任务，根据原材料是否充足设置状态
-                task_status = 'pending' if material_sufficient else 'material_insufficient'
-                task = ProductionTask.objects.create(
-                    task_no=f"PT{timezone.now().strftime('%Y%m%d%H%M%S')}{order.pk}",
-                    production_type='order',
-                    order=order,
-                    product=item.product,
-                    required_quantity=shortage,
-                    status=task_status,
-                )
-            # 如果 shortage <= 0，说明批次分配已足够，不需要生产
-            # 注意：不再直接锁定库存，因为批次分配已经指定了具体批次，库存扣减在发货时进行
+        # 一次检查所有缺口产品的原材料
+        availability = check_material_availability(
+            (item.product_id, shortage) for item, shortage in production_items
+        )
+        
+        blocked = {}
+        for (item, shortage), material_check in zip(production_items, availability):
+            # 批次分配不足，创建生产任务生产不足的部分，根据原材料是否充足设置状态
+            task_status = 'pending' if material_check.sufficient else 'material_insufficient'
+            task = ProductionTask.objects.create(
+                task_no=next_number(PREFIX_PRODUCTION_TASK),
+                production_type='order',
+                order=order,
+                product=item.product,
+                required_quantity=shortage,
+                status=task_status,
+            )
+            if not material_check.sufficient:
+                # 记录缺料索引，原料入库后自动重新检查
+                blocked[task.pk] = {line.material.pk: line.shortage for line in material_check.shortages}
+        block_tasks(blocked)
+        # 批次分配已足够的明细不需要生产
+        # 注意：不再直接锁定库存，因为批次分配已经指定了具体批次，库存扣减在发货时进行
         
         if all_sufficient:
             # 所有产品批次分配充足，创建发货通知单
             ShippingNotice.objects.create(
-                notice_no=f"SN{timezone.now().strftime('%Y%m%d%H%M%S')}",
+                notice_no=next_number(PREFIX_SHIPPING_NOTICE),
                 order=order,
                 status='pending',
             )